@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic scale benchmark suite
+
+Runs the optimisation rules of the Snakefile on synthetic inputs at each number of
+hexagons in the 'benchmark_suite' section of config.yaml, offline, and records the
+wall time, throughput and peak RSS of every rule from its Snakemake benchmark file.
+The outputs of every rule are checked against golden results, so a change that
+makes the pipeline faster but changes its results shows up as well. Scales without
+a folder of golden results, such as the large ones, are only timed.
+
+Run from the repository root:
+
+    python src/benchmark/run_benchmarks.py [--large | --hexagons 1000 10000] [--update-golden]
+"""
+
+import argparse
+from copy import deepcopy
+from datetime import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import yaml
+from synthetic import write_synthetic_inputs
+
+# Rules timed by the suite, in pipeline order
+RULES = ['optimize_transport', 'calculate_water_costs', 'optimize_plant',
+         'calculate_total_costs', 'calculate_cost_components', 'calculate_map_costs']
+
+def get_outputs(country, weather_year, plant_type):
+    '''
+    Gets the outputs of the timed rules, as named in the Snakefile.
+
+    Parameters
+    ----------
+    country : string
+        country wildcard.
+    weather_year : int
+        weather year wildcard.
+    plant_type : string
+        plant type wildcard.
+
+    Returns
+    -------
+    outputs : dictionary
+        output paths of each rule, relative to the working directory.
+    benchmarks : dictionary
+        Snakemake benchmark file of each rule.
+    '''
+    outputs = {
+        'optimize_transport' : [f'resources/hex_transport_{country}_{plant_type}.geojson'],
+        'calculate_water_costs' : [f'resources/hex_water_{country}_{plant_type}.geojson'],
+        'optimize_plant' : [f'resources/hex_lc_{country}_{weather_year}_{plant_type}.geojson'],
+        'calculate_total_costs' : [f'results/hex_total_cost_{country}_{weather_year}_{plant_type}.geojson'],
+        'calculate_cost_components' : [f'results/hex_cost_components_{country}_{weather_year}_{plant_type}.geojson',
+                                       f'results/hex_cost_components_{country}_{weather_year}_{plant_type}.csv'],
+        'calculate_map_costs' : [f'plots/{country}_{weather_year}_{plant_type}'],
+        }
+    wildcards = {
+        'optimize_transport' : f'{country}_{plant_type}',
+        'calculate_water_costs' : f'{country}_{plant_type}',
+        }
+    benchmarks = {rule : f'benchmarks/{rule}_{wildcards.get(rule, f"{country}_{weather_year}_{plant_type}")}.tsv'
+                  for rule in RULES}
+    return outputs, benchmarks
+
+def update_config(config, values):
+    '''
+    Updates a nested config with nested values, like Snakemake's --config.
+
+    Parameters
+    ----------
+    config : dictionary
+        config to update in place.
+    values : dictionary
+        values to write over the config.
+    '''
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            update_config(config[key], value)
+        else:
+            config[key] = value
+
+def read_output(path):
+    '''
+    Reads an output of a rule as it would be written to and read from a golden file.
+
+    Parameters
+    ----------
+    path : string
+        GeoJSON or CSV file, or folder of plots.
+
+    Returns
+    -------
+    output : pandas DataFrame
+        attributes of every hexagon without geometry, or the names of the plots.
+    '''
+    if os.path.isdir(path):
+        return pd.DataFrame({'plot' : sorted(os.listdir(path))})
+    if path.endswith('.csv'):
+        output = pd.read_csv(path, encoding='latin-1', index_col=0)
+    else:
+        output = pd.DataFrame(gpd.read_file(path).drop(columns='geometry'))
+    # Round trip through csv, so outputs and golden files compare with the same types
+    return pd.read_csv(io.StringIO(output.to_csv(index=False)))
+
+def compare_with_golden(output, golden, rtol):
+    '''
+    Compares an output with its golden result.
+
+    Parameters
+    ----------
+    output : pandas DataFrame
+        output from read_output.
+    golden : pandas DataFrame
+        golden result read back from its csv file.
+    rtol : float
+        relative tolerance of numeric values.
+
+    Returns
+    -------
+    differences : list
+        description of every column that is missing, extra or different.
+    '''
+    differences = [f'missing {column}' for column in golden.columns if column not in output.columns]
+    differences += [f'extra {column}' for column in output.columns if column not in golden.columns]
+    if len(output) != len(golden):
+        return differences + [f'{len(output)} rows instead of {len(golden)}']
+    for column in golden.columns.intersection(output.columns):
+        expected, actual = golden[column], output[column]
+        if pd.api.types.is_numeric_dtype(expected) and pd.api.types.is_numeric_dtype(actual):
+            same = np.isclose(actual, expected, rtol=rtol, atol=1e-9, equal_nan=True)
+        else:
+            same = expected.fillna('').astype(str).to_numpy() == actual.fillna('').astype(str).to_numpy()
+        if not same.all():
+            differences.append(f'{column} differs in {(~same).sum()} rows')
+    return differences
+
+def run_scale(n_hexagons, settings, config, update_golden=False):
+    '''
+    Times the rules on synthetic inputs with a number of hexagons.
+
+    Parameters
+    ----------
+    n_hexagons : int
+        number of hexagons.
+    settings : dictionary
+        'benchmark_suite' section of the config.
+    config : dictionary
+        config of the pipeline.
+    update_golden : bool
+        write the outputs as the new golden results instead of checking them.
+        Default is False.
+
+    Returns
+    -------
+    results : list
+        rule, seconds, hexagons per second, peak RSS in MB and golden result check
+        of every rule. The check is "none" at scales without golden results.
+    '''
+    country, weather_year, plant_type = 'XX', 2023, str(settings['plant_type'])
+    folder = os.path.join(str(settings['folder']), f'{n_hexagons}_hexagons')
+    inputs = {'hexagons' : n_hexagons, 'demand_centers' : int(settings['demand_centers']),
+              'seed' : int(settings['seed']), 'plant_type' : plant_type}
+    inputs_path = os.path.join(folder, 'synthetic_inputs.json')
+    written = None
+    if os.path.exists(inputs_path):
+        with open(inputs_path) as file:
+            written = json.load(file)
+    if written != inputs:
+        print(f"\nGenerating synthetic inputs with {n_hexagons} hexagons...")
+        write_synthetic_inputs(folder, n_hexagons, inputs['demand_centers'], country, weather_year,
+                               plant_type, inputs['seed'])
+        with open(inputs_path, 'w') as file:
+            json.dump(inputs, file)
+
+    run_config = deepcopy(config)
+    update_config(run_config, settings['config'])
+    run_config['scenario'].update(country=[country], weather_year=[weather_year], plant_type=plant_type)
+    config_path = os.path.join(folder, 'config.yaml')
+    with open(config_path, 'w') as file:
+        yaml.safe_dump(run_config, file)
+
+    outputs, benchmarks = get_outputs(country, weather_year, plant_type)
+    print(f"\nRunning the pipeline on {n_hexagons} hexagons...")
+    # The synthetic hexagons and cutout stand in for the prep rules, so every rule
+    # from optimize_transport on is run again
+    subprocess.run([sys.executable, '-m', 'snakemake', '--snakefile', os.path.abspath('Snakefile'),
+                    '--directory', folder, '--configfile', os.path.abspath(config_path),
+                    '--cores', str(settings['cores']), '--forcerun', RULES[0],
+                    *outputs[RULES[-1]]], check=True)
+
+    results = []
+    golden_folder = os.path.join(str(settings['golden']), f'{n_hexagons}_hexagons')
+    # Once a scale has golden results, every output must match one
+    checked = update_golden or os.path.isdir(golden_folder)
+    for rule in RULES:
+        benchmark = pd.read_csv(os.path.join(folder, benchmarks[rule]), sep='\t').iloc[-1]
+        differences = []
+        for output in outputs[rule] if checked else []:
+            golden_path = os.path.join(golden_folder, f'{os.path.basename(output)}.csv.gz')
+            result = read_output(os.path.join(folder, output))
+            if update_golden:
+                os.makedirs(golden_folder, exist_ok=True)
+                result.to_csv(golden_path, index=False, compression='gzip')
+            elif os.path.exists(golden_path):
+                differences += compare_with_golden(result, pd.read_csv(golden_path), float(settings['rtol']))
+            else:
+                differences.append(f'no golden result {golden_path}')
+        if update_golden:
+            golden = "updated"
+        elif checked:
+            golden = "; ".join(differences) or "match"
+        else:
+            golden = "none"
+        results.append({'hexagons' : n_hexagons,
+                        'rule' : rule,
+                        'seconds' : benchmark['s'],
+                        'hexagons per second' : n_hexagons/max(benchmark['s'], 1e-9),
+                        'peak RSS (MB)' : benchmark['max_rss'],
+                        'golden' : golden})
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the optimisation rules on synthetic inputs.")
+    parser.add_argument('--hexagons', type=int, nargs='+',
+                        help="numbers of hexagons, instead of those in config.yaml")
+    parser.add_argument('--large', action='store_true',
+                        help="also run the large_hexagons scales of config.yaml")
+    parser.add_argument('--update-golden', action='store_true',
+                        help="write the outputs as the new golden results")
+    arguments = parser.parse_args()
+
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file)
+    settings = config.pop('benchmark_suite')
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    scales = arguments.hexagons or settings['hexagons']
+    if arguments.large:
+        scales = list(scales) + list(settings['large_hexagons'])
+    results = []
+    for n_hexagons in scales:
+        results += run_scale(int(n_hexagons), settings, config, arguments.update_golden)
+    results = pd.DataFrame(results)
+    results.insert(0, 'commit', commit)
+    results.insert(0, 'date', datetime.now().isoformat(timespec='seconds'))
+
+    # Results of every run are kept, so regressions show up against earlier commits
+    results_path = os.path.join(str(settings['folder']), 'results.csv')
+    results.to_csv(results_path, mode='a', index=False, header=not os.path.exists(results_path))
+    print(f"\nBenchmark results, appended to {results_path}:")
+    print(results.drop(columns=['date', 'commit']).to_string(index=False))
+    if not (results['golden'].isin(["match", "updated", "none"])).all():
+        sys.exit("\nOutputs differ from the golden results.")
+
+if __name__ == "__main__":
+    main()
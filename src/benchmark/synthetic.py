@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic inputs for the benchmark suite
+
+Generates hexagons, demand centers and an ERA5-like weather cutout of any size,
+laid out like the inputs of the optimisation rules, so the pipeline can be
+timed offline and reproducibly from a seed.
+"""
+
+import os
+import shutil
+import atlite
+from atlite.pv.solar_position import SolarPosition
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+def get_synthetic_hexagons(n_hexagons, country_name, spacing=0.02, origin=(15., -25.), seed=0):
+    '''
+    Gets a square patch of hexagons with every attribute the rules read.
+
+    Parameters
+    ----------
+    n_hexagons : int
+        number of hexagons.
+    country_name : string
+        country of every hexagon, as in the country parameters.
+    spacing : float
+        distance between hexagon centers in degrees. Default is 0.02, about 2 km.
+    origin : tuple
+        longitude and latitude of the south-west corner. Default is (15., -25.).
+    seed : int
+        seed of the random attributes. Default is 0.
+
+    Returns
+    -------
+    hexagons : geopandas GeoDataFrame
+        pointy-top hexagons in EPSG:4326 with distances in km to roads, the grid,
+        the ocean (to the west), waterbodies and waterways, and the theoretical
+        solar (MW) and turbine potential.
+    '''
+    rng = np.random.default_rng(seed)
+    columns = int(np.ceil(np.sqrt(n_hexagons)))
+    row, column = np.divmod(np.arange(n_hexagons), columns)
+    lon = origin[0] + spacing*(column + 0.5*(row % 2))
+    lat = origin[1] + spacing*np.sqrt(3)/2*row
+    radius = spacing/np.sqrt(3)
+    angles = np.pi/6 + np.pi/3*np.arange(7)
+    corners = np.stack([lon[:, None] + radius*np.cos(angles), lat[:, None] + radius*np.sin(angles)], axis=-1)
+
+    hexagons = gpd.GeoDataFrame({
+        'h3_index' : [f'synthetic{i:07d}' for i in range(n_hexagons)],
+        'country' : country_name,
+        # Roads and the grid cover most of the patch, water is rarer
+        'road_dist' : np.where(rng.random(n_hexagons) < 0.3, 0., rng.exponential(10., n_hexagons)),
+        'grid_dist' : rng.exponential(20., n_hexagons),
+        'ocean_dist' : (lon - origin[0])*111.*np.cos(np.radians(lat)) + rng.uniform(1., 5., n_hexagons),
+        'waterbody_dist' : rng.exponential(30., n_hexagons),
+        'waterway_dist' : rng.exponential(15., n_hexagons),
+        'theo_pv' : np.where(rng.random(n_hexagons) < 0.02, 0., rng.uniform(100., 2000., n_hexagons)),
+        'theo_turbines' : np.where(rng.random(n_hexagons) < 0.1, 0., rng.uniform(10., 300., n_hexagons).round()),
+        }, geometry=shapely.polygons(corners), crs='EPSG:4326')
+    return hexagons
+
+def get_synthetic_demand_centers(hexagons, n_demand_centers, seed=0):
+    '''
+    Gets demand centers spread over the hexagons, one in every demand state.
+
+    Parameters
+    ----------
+    hexagons : geopandas GeoDataFrame
+        hexagons from get_synthetic_hexagons.
+    n_demand_centers : int
+        number of demand centers.
+    seed : int
+        seed of the locations and demands. Default is 0.
+
+    Returns
+    -------
+    demand_centers : pandas DataFrame
+        location, annual demand and demand state of each demand center, with the
+        columns of the demand parameters.
+    '''
+    rng = np.random.default_rng(seed + 1)
+    centroids = hexagons.geometry.centroid
+    locations = rng.choice(len(hexagons), n_demand_centers, replace=False)
+    states = ['500 bar', 'LH2', 'NH3']
+    return pd.DataFrame({'Lat [deg]' : centroids.y.to_numpy()[locations],
+                         'Lon [deg]' : centroids.x.to_numpy()[locations],
+                         'Annual demand [kg/a]' : rng.uniform(1e6, 5e6, n_demand_centers).round(),
+                         'Demand state' : [states[i % len(states)] for i in range(n_demand_centers)]},
+                        index=pd.Index([f'Synthetic {i+1}' for i in range(n_demand_centers)],
+                                       name='Demand center'))
+
+def write_synthetic_cutout(path, hexagons, weather_year, seed=0):
+    '''
+    Writes an atlite cutout with synthetic ERA5 weather over the hexagons.
+
+    Irradiance follows the position of the sun with cloudiness that persists for a
+    few hours, and wind speeds follow a Weibull distribution with a daily cycle, so
+    the plants see realistic variability without any download.
+
+    Parameters
+    ----------
+    path : string
+        path of the netCDF cutout.
+    hexagons : geopandas GeoDataFrame
+        hexagons the cutout must cover.
+    weather_year : int
+        year of hourly weather.
+    seed : int
+        seed of the weather. Default is 0.
+    '''
+    rng = np.random.default_rng(seed + 2)
+    min_lon, min_lat, max_lon, max_lat = hexagons.total_bounds
+    cutout = atlite.Cutout(path, module='era5', x=slice(min_lon - 0.25, max_lon + 0.25),
+                           y=slice(min_lat - 0.25, max_lat + 0.25), time=str(weather_year))
+    ds = cutout.data
+    shape = (ds.sizes['time'], ds.sizes['y'], ds.sizes['x'])
+    dims = ('time', 'y', 'x')
+
+    def add(name, feature, values, units):
+        values = np.broadcast_to(values, shape if np.ndim(values) == 3 else shape[1:])
+        ds[name] = (dims if np.ndim(values) == 3 else ('y', 'x'), values.astype(np.float32))
+        ds[name].attrs.update(module='era5', feature=feature, units=units)
+
+    hours = np.arange(shape[0])
+    daily = 2. + 4.*np.sin(2*np.pi*(hours % 24)/24)[:, None, None]
+    yearly = 15. + 10.*np.sin(2*np.pi*hours/8760)[:, None, None]
+    add('temperature', 'temperature', 273.15 + yearly + daily, 'K')
+    add('soil temperature', 'temperature', 273.15 + yearly + daily/2, 'K')
+    add('dewpoint temperature', 'temperature', 273.15 + yearly - 5., 'K')
+
+    # Clear-sky irradiance dimmed by clouds that follow an AR(1) process over hours.
+    # The solar position is stored like in ERA5 cutouts, at the middle of each hour.
+    solar_position = SolarPosition(ds.chunk({'time' : 100}), time_shift='+30min').compute()
+    altitude = solar_position['altitude'].transpose(*dims).to_numpy()
+    add('solar_altitude', 'influx', altitude, 'rad')
+    add('solar_azimuth', 'influx', solar_position['azimuth'].transpose(*dims).to_numpy(), 'rad')
+    influx_toa = 1361.*np.maximum(np.sin(altitude), 0.)
+    clouds = np.empty(shape)
+    clouds[0] = rng.random(shape[1:])
+    for t in range(1, shape[0]):
+        clouds[t] = 0.9*clouds[t-1] + 0.1*rng.random(shape[1:])
+    clearness = 0.75*(1. - 0.6*clouds)
+    add('influx_toa', 'influx', influx_toa, 'W m**-2')
+    add('influx_direct', 'influx', influx_toa*clearness*0.8, 'W m**-2')
+    add('influx_diffuse', 'influx', influx_toa*clearness*0.2 + influx_toa*0.05*clouds, 'W m**-2')
+    add('albedo', 'influx', np.full(shape, 0.25) + 0.05*rng.random(shape[1:]), '(0 - 1)')
+
+    gusts = np.empty(shape)
+    gusts[0] = rng.random(shape[1:])
+    for t in range(1, shape[0]):
+        gusts[t] = 0.95*gusts[t-1] + 0.05*rng.random(shape[1:])
+    scale = 7. + 2.*rng.random(shape[1:]) + 1.5*np.sin(2*np.pi*(hours % 24)/24)[:, None, None]
+    wind_speed = scale*(-np.log(np.clip(1. - gusts, 1e-6, 1.)))**(1/2.)
+    add('wnd100m', 'wind', wind_speed, 'm s**-1')
+    add('wnd_shear_exp', 'wind', np.full(shape, 1/7), '')
+    add('wnd_azimuth', 'wind', 2*np.pi*rng.random(shape), '')
+    add('roughness', 'wind', np.full(shape[1:], 0.03) + 0.02*rng.random(shape[1:]), 'm')
+    add('height', 'height', 100. + 500.*rng.random(shape[1:]), 'm')
+
+    folder = os.path.dirname(path)
+    if folder != '':
+        os.makedirs(folder, exist_ok=True)
+    ds.to_netcdf(path)
+
+def write_synthetic_inputs(folder, n_hexagons, n_demand_centers, country, weather_year, plant_type, seed=0):
+    '''
+    Writes synthetic inputs of the optimisation rules into a working directory.
+
+    The hexagons take the place of the output of prep_main and the cutout of the
+    output of get_weather_data, so runs in the folder start at optimize_transport.
+    Parameter sheets are copied from the Indian parameters, with synthetic demand
+    centers, and the plant designs from parameters/.
+
+    Parameters
+    ----------
+    folder : string
+        working directory of the benchmark run.
+    n_hexagons : int
+        number of hexagons.
+    n_demand_centers : int
+        number of demand centers.
+    country : string
+        country wildcard of the run, e.g. 'XX'.
+    weather_year : int
+        weather year wildcard of the run.
+    plant_type : string
+        plant type wildcard of the run, 'hydrogen' or 'ammonia'.
+    seed : int
+        seed of the hexagons, demand centers and weather. Default is 0.
+    '''
+    parameters = os.path.join(folder, 'parameters', country, plant_type)
+    shutil.copytree(os.path.join('parameters', 'IN', plant_type), parameters, dirs_exist_ok=True)
+    for design in ('basic_h2_plant', 'basic_nh3_plant'):
+        shutil.copytree(os.path.join('parameters', design), os.path.join(folder, 'parameters', design),
+                        dirs_exist_ok=True)
+    country_name = pd.read_excel(os.path.join(parameters, 'country_parameters.xlsx'),
+                                 index_col='Country').index[0]
+
+    hexagons = get_synthetic_hexagons(n_hexagons, country_name, seed=seed)
+    os.makedirs(os.path.join(folder, 'data'), exist_ok=True)
+    hexagons.to_file(os.path.join(folder, 'data', f'hexagons_with_country_{country}_{plant_type}.geojson'),
+                     driver='GeoJSON', encoding='utf-8')
+    get_synthetic_demand_centers(hexagons, n_demand_centers, seed).to_excel(
+        os.path.join(parameters, 'demand_parameters.xlsx'), sheet_name='Demand centers')
+    write_synthetic_cutout(os.path.join(folder, 'Cutouts', f'{country}_{weather_year}.nc'),
+                           hexagons, weather_year, seed)
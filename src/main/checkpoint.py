@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+
+from solve_cache import results_from_list, results_to_list
+
+class Checkpoint:
+    """
+    A class representing an append-only checkpoint of plant optimisation results.
+
+    Each solved (demand center, hexagon, transport) is written to a JSON lines file
+    and flushed to disk as soon as its result arrives, so a run that is killed can be
+    restarted without re-solving them. The first line holds a fingerprint of the run
+    settings and inputs, and a checkpoint with a different fingerprint is discarded.
+
+    Attributes
+    ----------
+    path : string
+        path to the JSON lines file.
+    fingerprint : string
+        fingerprint of the run settings and inputs.
+    results : dictionary
+        results in the checkpoint, keyed by demand center, hexagon index and transport.
+    Methods
+    -------
+    get(demand_center, hexagon):
+        gets the checkpointed results of a hexagon.
+    add(demand_center, hexagon, transport, results):
+        writes the results of a solved hexagon and transport.
+    remove():
+        deletes the checkpoint file once the run has finished.
+    """
+    def __init__(self, path, fingerprint):
+        """
+
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.results = {}
+        self._read()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if os.path.getsize(self.path) == 0:
+            self._write({'fingerprint' : self.fingerprint})
+
+    def get(self, demand_center, hexagon):
+        '''
+        Gets the checkpointed results of a hexagon.
+
+        Parameters
+        ----------
+        demand_center : string
+            name of the demand center.
+        hexagon : int
+            index of the hexagon in the hexagon file.
+
+        Returns
+        -------
+        results : dictionary
+            results of each transport already solved, keyed by "trucking" or "pipeline".
+        '''
+        return {transport: self.results[(demand_center, hexagon, transport)]
+                for transport in ("trucking", "pipeline")
+                if (demand_center, hexagon, transport) in self.results}
+
+    def add(self, demand_center, hexagon, transport, results):
+        '''
+        Writes the results of a solved hexagon and transport to disk.
+
+        Parameters
+        ----------
+        demand_center : string
+            name of the demand center.
+        hexagon : int
+            index of the hexagon in the hexagon file.
+        transport : string
+            "trucking" or "pipeline".
+        results : tuple
+            results of solve_hexagon_transport.
+        '''
+        key = (demand_center, int(hexagon), transport)
+        if key in self.results:
+            return
+        self.results[key] = results
+        self._write({'demand_center' : demand_center,
+                     'hexagon' : int(hexagon),
+                     'transport' : transport,
+                     'results' : results_to_list(results)})
+
+    def remove(self):
+        '''
+        Deletes the checkpoint file once the run has finished.
+        '''
+        self._file.close()
+        os.remove(self.path)
+
+    def _read(self):
+        '''
+        Reads the results of a previous run with the same fingerprint.
+        '''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as file:
+            lines = file.readlines()
+        valid = len(lines) > 0
+        if valid:
+            try:
+                valid = json.loads(lines[0]).get('fingerprint') == self.fingerprint
+            except json.JSONDecodeError:
+                valid = False
+        if not valid:
+            print(f"\nDiscarding checkpoint {self.path} of a run with other settings or inputs.")
+            os.remove(self.path)
+            return
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The run was killed while writing this line
+                continue
+            self.results[(record['demand_center'], record['hexagon'], record['transport'])] = \
+                results_from_list(record['results'])
+        # Start a new line after a partly written one
+        if not lines[-1].endswith('\n'):
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write('\n')
+        print(f"\nResuming from checkpoint {self.path} with {len(self.results)} solved plants.")
+
+    def _write(self, record):
+        '''
+        Appends a record and makes sure it is on disk before returning.
+        '''
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+def get_run_fingerprint(config, wildcards, input_files):
+    '''
+    Gets a fingerprint of the settings and inputs of a run.
+
+    Parameters
+    ----------
+    config : dictionary
+        snakemake config.
+    wildcards : dictionary
+        snakemake wildcards of the rule.
+    input_files : list
+        paths of the input files, fingerprinted by size and modification time.
+
+    Returns
+    -------
+    fingerprint : string
+        hexadecimal SHA-256 digest.
+    '''
+    digest = hashlib.sha256()
+    digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+    digest.update(json.dumps(dict(wildcards), sort_keys=True, default=str).encode())
+    for input_file in input_files:
+        status = os.stat(input_file)
+        digest.update(f'{input_file}:{status.st_size}:{status.st_mtime_ns}'.encode())
+    return digest.hexdigest()
@@ -12,8 +12,16 @@ Add attributes to hex file for cost of each component
 
 import geopandas as gpd
 import pandas as pd
-from geopy.geocoders import Photon
 from functions import CRF
+from instrumentation import Instrumentation, get_benchmark_path
+from profiling import start_profiling
+import time
+
+start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+# Time every stage of the rule, with the records under benchmarks/
+instrumentation = Instrumentation(get_benchmark_path('calculate_cost_components', snakemake.wildcards)
+                                  if snakemake.config['instrumentation'] else None, reset=True)
+start_inputs = time.perf_counter()
 
 # Load hexagons
 hexagons = gpd.read_file(str(snakemake.input.hexagons))
@@ -42,6 +50,7 @@ elif plant_type == "ammonia":
     links_parameters = pd.read_csv(links_csv_path, index_col='name')
     generators_csv_path = 'parameters/basic_nh3_plant/generators.csv' # Solar and generator 
     generators_parameters = pd.read_csv(generators_csv_path, index_col='name')
+instrumentation.add('read inputs', time.perf_counter() - start_inputs)
 
 
 # For each demand center, get costs for each component
@@ -50,14 +59,9 @@ demand_centers = demand_parameters.index
 transport_methods = ['pipeline', 'trucking']
 for demand_center in demand_centers:
     print(f"\nCalculating for {demand_center} begins...")
-    # Get location of demand center
-    lat = demand_parameters.loc[demand_center, 'Lat [deg]']
-    lon = demand_parameters.loc[demand_center, 'Lon [deg]']
-    coordinates = str(lat) + ", " + str(lon)
-    # Get country where the demand center is
-    geolocator = Photon(user_agent="MyApp")
-    location = geolocator.reverse(coordinates, language="en")
-    country = location.raw['properties']['country']
+    start_demand_center = time.perf_counter()
+    # Plants are financed in the country of the run, the only row of its parameters
+    country = country_parameters.index[0]
     
     # Store CRF from plant data
     interest_plant = country_parameters.loc[country, 'Plant interest rate']
@@ -112,7 +116,11 @@ for demand_center in demand_centers:
             hexagons[f'{demand_center} LC - {transport_method} {generator_lower} portion'] = \
                 hexagons[f'{demand_center} {transport_method} {generator_lower} costs']/ \
                     demand_parameters.loc[demand_center, 'Annual demand [kg/a]']
+    instrumentation.add('cost components', time.perf_counter() - start_demand_center,
+                        demand_center=demand_center, hexagons=len(hexagons))
 
 print("\nCalculations complete.\n")
-hexagons.to_file(snakemake.output[0], driver='GeoJSON', encoding='utf-8') # snakemake config
-hexagons.to_csv(snakemake.output[1], encoding='latin-1') # snakemake config
\ No newline at end of file
+with instrumentation.time('write output'):
+    hexagons.to_file(snakemake.output[0], driver='GeoJSON', encoding='utf-8') # snakemake config
+    hexagons.to_csv(snakemake.output[1], encoding='latin-1') # snakemake config
+instrumentation.write_report()
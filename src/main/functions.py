@@ -576,11 +576,8 @@ def calculate_nh3_pipeline_costs(distance, quantity, elec_cost, pipeline_params_
                                     index_col = 'Parameter'
                                     ).squeeze('columns')
     y_int = pipeline_parameters['Capex y-intercept (€/t/yr/100km)']
-    print(y_int)
     slope = pipeline_parameters['Capex flow coefficient (€/t^2/yr^2/100km)']
-    print(slope)
     capex_coeff = (y_int + slope*quantity_per_pipeline)
-    print(capex_coeff)
     capex_annual = (n_pipelines*(capex_coeff*distance/100*quantity_per_pipeline)*CRF(interest,lifetime_pipeline)) # distance coefficients are per 100 km
     opex_annual = opex*n_pipelines*(capex_coeff*distance/100*quantity_per_pipeline)
     electricity_costs = electricity_demand * distance * quantity * elec_cost
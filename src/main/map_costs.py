@@ -12,6 +12,9 @@ import geopandas as gpd
 import cartopy.crs as ccrs
 import matplotlib.pyplot as plt
 import pandas as pd
+from instrumentation import Instrumentation, get_benchmark_path
+from profiling import start_profiling
+import time
 from utils import check_folder_exists
 
 def plot_and_save(crs, hexagons, name, legend_kwds, output_folder, figsize=(10,5), legend=True, cmap='coolwarm', #VIRIDIS_R
@@ -67,12 +70,18 @@ def plot_and_save(crs, hexagons, name, legend_kwds, output_folder, figsize=(10,5
     plt.close()
 
 if __name__ == "__main__":
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('calculate_map_costs', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
+    start_inputs = time.perf_counter()
     plant_type = str(snakemake.wildcards.plant_type)
     hexagons = gpd.read_file(str(snakemake.input.hexagons))
     demand_excel_path = str(snakemake.input.demand_parameters)
     demand_parameters = pd.read_excel(demand_excel_path,index_col='Demand center')
     demand_centers = demand_parameters.index
     transport_methods = ["trucking", "pipeline"]
+    instrumentation.add('read inputs', time.perf_counter() - start_inputs)
 
     # plot LCOH for each hexagon
     # update central coordinates for area considered
@@ -91,6 +100,7 @@ if __name__ == "__main__":
 
     for demand_center in demand_centers:
         print(f"\nPlotting for {demand_center} begins...")
+        start_demand_center = time.perf_counter()
         # plot lowest LC in each location
         plot_and_save(crs, hexagons, f'{demand_center} lowest cost', 
                     {'label':'LC [euros/kg]'}, output_folder)
@@ -164,16 +174,19 @@ if __name__ == "__main__":
                 # generator costs
                 plot_and_save(crs, hexagons, f'{demand_center} {transport_method} {generator} costs',
                             {'label': '$'}, output_folder)
+        instrumentation.add('plots', time.perf_counter() - start_demand_center, demand_center=demand_center)
         
     # %% plot water costs
-    plot_and_save(crs, hexagons, 'Ocean water costs',
-                {'label':'Water cost [euros/kg H2]'}, output_folder)
+    with instrumentation.time('water cost plots'):
+        plot_and_save(crs, hexagons, 'Ocean water costs',
+                    {'label':'Water cost [euros/kg H2]'}, output_folder)
 
-    plt.ticklabel_format(style='plain')
+        plt.ticklabel_format(style='plain')
 
-    plot_and_save(crs, hexagons, 'Freshwater costs',
-                {'label':'Water cost [euros/kg H2]'}, output_folder)
+        plot_and_save(crs, hexagons, 'Freshwater costs',
+                    {'label':'Water cost [euros/kg H2]'}, output_folder)
 
-    plt.ticklabel_format(style='plain')
+        plt.ticklabel_format(style='plain')
 
-    print("\nPlotting complete\n")
\ No newline at end of file
+    print("\nPlotting complete\n")
+    instrumentation.write_report()
\ No newline at end of file
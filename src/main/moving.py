@@ -1,4 +1,6 @@
 import os
+from instrumentation import Instrumentation, get_benchmark_path
+from profiling import start_profiling
 import shutil
 
 def move_to_target(src, target):
@@ -14,6 +16,10 @@ def move_to_target(src, target):
     shutil.move(src, dest)
 
 def main():
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('moving_files', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
     # Get the target directory from snakemake.params.
     target = snakemake.params.target
     # Ensure the target directory exists.
@@ -23,27 +29,31 @@ def main():
     # snakemake.input contains: 'results', 'plots', 'resources', and 'xcsv'.
     
     # Handle 'results' input, which is a list of files.
-    results = snakemake.input.results
-    if isinstance(results, list):
-        for src in results:
-            move_to_target(src, target)
-    else:
-        move_to_target(results, target)
+    with instrumentation.time('move results'):
+        results = snakemake.input.results
+        if isinstance(results, list):
+            for src in results:
+                move_to_target(src, target)
+        else:
+            move_to_target(results, target)
     
     # Handle 'plots' input (a directory).
-    move_to_target(snakemake.input.plots, target)
+    with instrumentation.time('move plots'):
+        move_to_target(snakemake.input.plots, target)
     
     # Handle 'resources' input, which is a list of files.
-    resources = snakemake.input.resources
-    if isinstance(resources, list):
-        for src in resources:
-            move_to_target(src, target)
-    else:
-        move_to_target(resources, target)
-    
-    move_to_target(snakemake.input.lcresults, target)
+    with instrumentation.time('move resources'):
+        resources = snakemake.input.resources
+        if isinstance(resources, list):
+            for src in resources:
+                move_to_target(src, target)
+        else:
+            move_to_target(resources, target)
+        move_to_target(snakemake.input.lcresults, target)
     # Handle 'xcsv' input (a CSV file).
-    move_to_target(snakemake.input.xcsv, target)
+    with instrumentation.time('move cost components'):
+        move_to_target(snakemake.input.xcsv, target)
+    instrumentation.write_report()
 
 if __name__ == "__main__":
     main()
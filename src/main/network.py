@@ -1,10 +1,17 @@
+from copy import deepcopy
 import logging
 import numpy as np
 import pandas as pd
 import pypsa
+from linopy.matrices import MatrixAccessor
+from pypsa.descriptors import get_switchable_as_dense
 
 from functions import CRF
 
+# Plant networks with the design imported and the plant capital costs annualised,
+# keyed by plant type, plant interest rate and plant lifetime. Built once per process.
+_plant_templates = {}
+
 class Network:
     """
     A class representing a Network.
@@ -19,10 +26,16 @@ class Network:
         network. Default is None
     Methods
     -------
-    set_network(demand_profile, times, country_series):
+    set_network(demand_profile, times, country_series, segment_lengths):
         sets up the network.
     set_generators_in_network(country_series):
         sets provided generator in the network.
+    update_network(generators, demand_profile):
+        updates the generators and demand of a network that has already been set up.
+    get_production_cost_bound(demand_profile, country_series, electricity_per_demand):
+        gets a lower bound on the levelized cost of the plant without solving it.
+    _get_plant_template(country_series):
+        gets the cached plant design for this plant type.
     _create_override_components():
         set up new component attributes as required.
     """
@@ -34,7 +47,7 @@ class Network:
         self.generators = generators
         self.n = None
 
-    def set_network(self, demand_profile, times, country_series):
+    def set_network(self, demand_profile, times, country_series, segment_lengths=None):
         '''
         Sets up the network.
 
@@ -46,52 +59,31 @@ class Network:
             1D dataarray with timestamps for wind and solar potential.
         country_series: pandas Series
             interest rate and lifetime information.
+        segment_lengths : numpy array
+            number of snapshots each snapshot stands for when the time series have been
+            aggregated. Default is None
         '''
-        # Set the time values for the network
-        if self.n == None:
-            self.n = pypsa.Network(override_component_attrs=self._create_override_components())
+        # Start from a copy of the cached plant design
+        self.n = deepcopy(self._get_plant_template(country_series))
 
         if self.type == "hydrogen":
+            # Set the time values for the network
             self.n.set_snapshots(times)
-
-            # Import the design of the H2 plant into the network
-            self.n.import_from_csv_folder("parameters/basic_h2_plant")
-
-            # Import demand profile
-            # Note: All flows are in MW or MWh, conversions for hydrogen done using HHVs. Hydrogen HHV = 39.4 MWh/t
-            self.n.add('Load',
-                'Hydrogen demand',
-                bus = 'Hydrogen',
-                p_set = demand_profile['Demand']/1000*39.4,  # Should clean up these parameters or at least comment re units
-                       # we probably want to make HHV an input in the end via snakemake or a file so this can be generalised
-                )
-
-            for item in [self.n.links, self.n.stores, self.n.storage_units]:
-                item.capital_cost = item.capital_cost * CRF(country_series['Plant interest rate'], 
-                                                            country_series['Plant lifetime (years)'])
+            if segment_lengths is not None:
+                # Aggregated snapshots are weighted by the number of snapshots they stand for
+                self.n.snapshot_weightings = pd.Series(segment_lengths, index=self.n.snapshots, dtype=float)
         elif self.type == "ammonia":
             # Set the time values for the network
             self.n.set_snapshots(demand_profile.index)
-            demand_profile['weights'] = 8760 / len(self.n.snapshots)
+            if segment_lengths is None:
+                demand_profile['weights'] = 8760 / len(self.n.snapshots)
+            else:
+                demand_profile['weights'] = 8760 * segment_lengths / segment_lengths.sum()
             self.n.snapshot_weightings = demand_profile['weights']
 
-            # Import the design of the NH3 plant into the network
-            self.n.import_from_csv_folder("parameters/basic_nh3_plant")
-
-            # Import demand profile
-            # Note: All flows are in MW or MWh, conversions for hydrogen done using HHVs. Hydrogen HHV = 39.4 MWh/t
-            # Note: All flows are in MW or MWh, conversions for ammonia done using HHVs. Ammonia HHV = 6.25 MWh/t
-            # hydrogen_demand = pd.read_excel(demand_path,index_col = 0) # Excel file in kg hydrogen, convert to MWh
-            self.n.add('Load',
-                'Ammonia demand',
-                bus='Ammonia',
-                p_set=demand_profile['Demand'].to_numpy() / 1000 * 6.25,
-                )
-            
-            for item in [self.n.links, self.n.stores]:
-                item.capital_cost = item.capital_cost * CRF(country_series['Plant interest rate'],
-                                                            country_series['Plant lifetime (years)'])
-            self.n.links.loc['HydrogenCompression', 'marginal_cost'] = 0.0001  # Just stops pointless cycling through storage
+        # Import demand profile
+        load, bus, p_set = self._get_load(demand_profile)
+        self.n.add('Load', load, bus=bus, p_set=p_set)
 
     def set_generators_in_network(self, country_series):
         '''
@@ -102,6 +94,96 @@ class Network:
         country_series: pandas Series
             interest rate and lifetime information.
         '''
+        self._set_generator_potentials()
+        for gen in self.generators.keys():
+            # specify technology-specific and country-specific WACC and lifetime here
+            self.n.generators.loc[gen,'capital_cost'] = self.n.generators.loc[gen,'capital_cost']\
+                * CRF(country_series[f'{gen} interest rate'], country_series[f'{gen} lifetime (years)'])
+
+    def update_network(self, generators, demand_profile):
+        '''
+        Updates the generators and demand of a network that has already been set up.
+
+        Only the weather profiles, maximum capacities and load change, so the demand
+        profile must have the same snapshots as the one the network was set up with.
+        If the optimisation model has already been built, it is updated in place.
+
+        Parameters
+        ----------
+        generators : dictionary
+            contains generator types with their potential and maximum capacity.
+        demand_profile : pandas DataFrame
+            hourly dataframe of commodity demand in kg.
+        '''
+        self.generators = generators
+        self._set_generator_potentials()
+        load, bus, p_set = self._get_load(demand_profile)
+        # Same conversion to the snapshots as in pypsa.Network.add
+        self.n.loads_t.p_set[load] = pd.Series(data=p_set, index=self.n.snapshots, dtype=float)
+
+        if hasattr(self.n, 'model'):
+            self._update_model()
+
+    def get_production_cost_bound(self, demand_profile, country_series, electricity_per_demand):
+        '''
+        Gets a lower bound on the levelized cost of the plant without solving it.
+
+        Only the energy balance over the whole period is kept: the generators must supply
+        the electricity the demand needs, cheapest generation per MWh first and up to their
+        maximum capacities, and the electrolyzer must be large enough to take its share of
+        that electricity at a constant rate. Every other cost of the plant is left out.
+
+        Parameters
+        ----------
+        demand_profile : pandas DataFrame
+            hourly dataframe of commodity demand in kg.
+        country_series: pandas Series
+            interest rate and lifetime information.
+        electricity_per_demand : float
+            least MWh of electricity the plant needs per MWh of demand.
+
+        Returns
+        -------
+        lc : float
+            lower bound on the levelized cost, or inf if the generators cannot supply the electricity.
+        '''
+        template = self._get_plant_template(country_series)
+        _, _, p_set = self._get_load(demand_profile)
+        # Same snapshot weightings as set_network
+        weighting = 1. if self.type == "hydrogen" else 8760/len(demand_profile)
+        demand = np.sum(p_set)*weighting
+        remaining = demand*electricity_per_demand
+
+        generation = []
+        for gen, gen_list in self.generators.items():
+            energy_per_capacity = float(gen_list[0].sum())*weighting
+            if energy_per_capacity > 0:
+                capital_cost = template.generators.loc[gen, 'capital_cost']\
+                    * CRF(country_series[f'{gen} interest rate'], country_series[f'{gen} lifetime (years)'])
+                generation.append((capital_cost/energy_per_capacity, gen_list[1]*energy_per_capacity))
+        cost = 0.
+        for cost_per_energy, max_energy in sorted(generation):
+            energy = min(remaining, max_energy)
+            cost += cost_per_energy*energy
+            remaining -= energy
+        if remaining > 1e-9*demand*electricity_per_demand:
+            return np.inf
+
+        electrolysis = template.links.loc['Electrolysis']
+        if self.type == "hydrogen":
+            electrolysis_input = demand/electrolysis['efficiency']
+            heating_value = 39.4
+        elif self.type == "ammonia":
+            haber_bosch = template.links.loc['HB']
+            electrolysis_input = demand*(-haber_bosch['efficiency2']/haber_bosch['efficiency'])/electrolysis['efficiency']
+            heating_value = 6.25
+        cost += electrolysis['capital_cost']*electrolysis_input/(len(demand_profile)*weighting)
+        return cost/(demand/heating_value*1000)
+
+    def _set_generator_potentials(self):
+        '''
+        Sets the weather profile and the maximum capacity of the provided generators.
+        '''
         # Send the weather data to the model
         for gen, gen_list in self.generators.items():
             self.n.generators_t.p_max_pu[gen] = gen_list[0]
@@ -109,9 +191,110 @@ class Network:
             # specify maximum capacity based on land use
             self.n.generators.loc[gen,'p_nom_max'] = gen_list[1] # same as above
 
-            # specify technology-specific and country-specific WACC and lifetime here
-            self.n.generators.loc[gen,'capital_cost'] = self.n.generators.loc[gen,'capital_cost']\
-                * CRF(country_series[f'{gen} interest rate'], country_series[f'{gen} lifetime (years)'])
+    def _get_load(self, demand_profile):
+        '''
+        Gets the load of the plant from the demand profile.
+
+        Parameters
+        ----------
+        demand_profile : pandas DataFrame
+            hourly dataframe of commodity demand in kg.
+
+        Returns
+        -------
+        load : string
+            name of the load.
+        bus : string
+            bus the load is attached to.
+        p_set : pandas Series or numpy array
+            demand in MW.
+        '''
+        if self.type == "hydrogen":
+            # Note: All flows are in MW or MWh, conversions for hydrogen done using HHVs. Hydrogen HHV = 39.4 MWh/t
+            # Should clean up these parameters or at least comment re units
+            # we probably want to make HHV an input in the end via snakemake or a file so this can be generalised
+            return 'Hydrogen demand', 'Hydrogen', demand_profile['Demand']/1000*39.4
+        elif self.type == "ammonia":
+            # Note: All flows are in MW or MWh, conversions for ammonia done using HHVs. Ammonia HHV = 6.25 MWh/t
+            # hydrogen_demand = pd.read_excel(demand_path,index_col = 0) # Excel file in kg hydrogen, convert to MWh
+            return 'Ammonia demand', 'Ammonia', demand_profile['Demand'].to_numpy() / 1000 * 6.25
+
+    def _update_model(self):
+        '''
+        Writes the generator potentials, maximum capacities and load of the network into
+        its already built linopy model, so it can be re-solved without being rebuilt.
+        '''
+        m = self.n.model
+        p_nom = m.variables['Generator-p_nom'].labels
+        gen_dim = p_nom.dims[0]
+        max_pu = get_switchable_as_dense(self.n, 'Generator', 'p_max_pu')
+
+        # Dispatch limit p - p_max_pu * p_nom <= 0. pypsa puts the dispatch in the first
+        # term and the capacity in the second, and linopy drops the capacity term where
+        # p_max_pu was zero, so both its variable and its coefficient are written.
+        constraint = m.constraints['Generator-ext-p-upper']
+        coeffs = constraint.coeffs.copy()
+        variables = constraint.vars.copy()
+        for gen in self.generators.keys():
+            where = {gen_dim: coeffs.indexes[gen_dim].get_loc(gen), '_term': 1}
+            coeffs[where] = -max_pu[gen].to_numpy()
+            variables[where] = p_nom.loc[gen].item()
+        constraint.coeffs = coeffs
+        constraint.vars = variables
+
+        # Capacity limit p_nom <= p_nom_max
+        constraint = m.constraints['Generator-ext-p_nom-upper']
+        rhs = constraint.rhs.copy()
+        for gen in self.generators.keys():
+            rhs.loc[{gen_dim: gen}] = self.n.generators.at[gen, 'p_nom_max']
+        constraint.rhs = rhs
+
+        # Loads are the right-hand side of the nodal balance
+        constraint = m.constraints['Bus-nodal_balance']
+        rhs = constraint.rhs.copy()
+        for load, bus in self.n.loads.bus.items():
+            rhs.loc[{'Bus': bus}] = -self.n.loads_t.p_set[load].to_numpy() * self.n.loads.at[load, 'sign']
+        constraint.rhs = rhs
+
+        # The direct solver interface reads the model through matrices that linopy
+        # flattens once and caches, so they are rebuilt from the updated constraints
+        m.matrices = MatrixAccessor(m)
+
+    def _get_plant_template(self, country_series):
+        '''
+        Gets the plant design for this plant type, building it on first use.
+
+        The csv design is only read and its capital costs only annualised once per
+        plant type and country; every network is then a copy of the cached template.
+
+        Parameters
+        ----------
+        country_series: pandas Series
+            interest rate and lifetime information.
+
+        Returns
+        -------
+        template : pypsa Network
+            plant design without snapshots, loads or generator profiles. Must not be modified.
+        '''
+        interest = country_series['Plant interest rate']
+        lifetime = country_series['Plant lifetime (years)']
+        key = (self.type, interest, lifetime)
+        if key not in _plant_templates:
+            template = pypsa.Network(override_component_attrs=self._create_override_components())
+            if self.type == "hydrogen":
+                # Import the design of the H2 plant into the network
+                template.import_from_csv_folder("parameters/basic_h2_plant")
+                for item in [template.links, template.stores, template.storage_units]:
+                    item.capital_cost = item.capital_cost * CRF(interest, lifetime)
+            elif self.type == "ammonia":
+                # Import the design of the NH3 plant into the network
+                template.import_from_csv_folder("parameters/basic_nh3_plant")
+                for item in [template.links, template.stores]:
+                    item.capital_cost = item.capital_cost * CRF(interest, lifetime)
+                template.links.loc['HydrogenCompression', 'marginal_cost'] = 0.0001  # Just stops pointless cycling through storage
+            _plant_templates[key] = template
+        return _plant_templates[key]
 
     def _create_override_components(self):
         # I assume this is just so that we can have hydrogen and power both as buses? Hmm
@@ -144,65 +327,3 @@ class Network:
         ]
         
         return override_component_attrs
-    
-def nh3_pyomo_constraints(n, snapshots):
-    """Includes a series of additional constraints which make the ammonia plant work as needed:
-    i) Battery sizing
-    ii) Ramp hard constraints down (Cannot be violated)
-    iii) Ramp hard constraints up (Cannot be violated)
-    iv) Ramp soft constraints down
-    v) Ramp soft constraints up
-    (iv) and (v) just softly suppress ramping so that the model doesn't 'zig-zag', which looks a bit odd on operation.
-    Makes very little difference on LCOA. """
-    timestep = int(snakemake.config['freq'][0])
-    # The battery constraint is built here - it doesn't need a special function because it doesn't depend on time
-    n.model.battery_interface = pm.Constraint(
-        rule=lambda model: n.model.link_p_nom['BatteryInterfaceIn'] ==
-                        n.model.link_p_nom['BatteryInterfaceOut'] /
-                        n.links.efficiency["BatteryInterfaceOut"])
-
-    # Constrain the maximum discharge of the H2 storage relative to its size
-    time_step_cycle = 4/8760*timestep*0.5  # Factor 0.5 for 3 hour time step, 0.5 for oversized storage
-    n.model.cycling_limit = pm.Constraint(
-        rule=lambda model: n.model.link_p_nom['BatteryInterfaceOut'] ==
-                        n.model.store_e_nom['CompressedH2Store'] * time_step_cycle)
-
-    # The HB Ramp constraints are functions of time, so we need to create some pyomo sets/parameters to represent them.
-    n.model.t = pm.Set(initialize=n.snapshots)
-    n.model.HB_max_ramp_down = pm.Param(initialize=n.links.loc['HB'].ramp_limit_down)
-    n.model.HB_max_ramp_up = pm.Param(initialize=n.links.loc['HB'].ramp_limit_up)
-
-    # Using those sets/parameters, we can now implement the constraints...
-    logging.warning('Pypsa has been overridden - Ramp rates on NH3 plant are included')
-    n.model.NH3_pyomo_overwrite_ramp_down = pm.Constraint(n.model.t, rule=_nh3_ramp_down)
-    n.model.NH3_pyomo_overwrite_ramp_up = pm.Constraint(n.model.t, rule=_nh3_ramp_up)
-    # n.model.NH3_pyomo_penalise_ramp_down = pm.Constraint(n.model.t, rule=_penalise_ramp_down)
-    # n.model.NH3_pyomo_penalise_ramp_up = pm.Constraint(n.model.t, rule=_penalise_ramp_up)
-
-def _nh3_ramp_down(model, t):
-    """Places a cap on how quickly the ammonia plant can ramp down"""
-    timestep = int(snakemake.config['freq'][0])
-    if t == model.t.at(1):
-
-        old_rate = model.link_p['HB', model.t.at(-1)]
-    else:
-        # old_rate = model.link_p['HB', t - 1]
-        old_rate = model.link_p['HB', t - pd.Timedelta(timestep, unit = 'H')]
-
-    return old_rate - model.link_p['HB', t] <= \
-        model.link_p_nom['HB'] * model.HB_max_ramp_down
-    # Note 20 is the UB of the size of the ammonia plant; essentially if x = 0 then the constraint is not active
-
-
-def _nh3_ramp_up(model, t):
-    """Places a cap on how quickly the ammonia plant can ramp down"""
-    timestep = int(snakemake.config['freq'][0])
-    if t == model.t.at(1):
-        old_rate = model.link_p['HB', model.t.at(-1)]
-    else:
-        # old_rate = model.link_p['HB', t - 1]
-        old_rate = model.link_p['HB', t - pd.Timedelta(timestep, unit = 'H')]
-
-
-    return model.link_p['HB', t] - old_rate <= \
-        model.link_p_nom['HB'] * model.HB_max_ramp_up()
\ No newline at end of file
@@ -9,14 +9,27 @@ the commodity's plant capacity.
 
 """
 
-import atlite
-from copy import deepcopy
+from checkpoint import Checkpoint, get_run_fingerprint
+from functools import partial
+from instrumentation import Instrumentation, get_benchmark_path
+from itertools import chain
 import geopandas as gpd
+import hashlib
+import heapq
 import logging
+import multiprocessing
 import numpy as np
+import os
 import pandas as pd
-import pyomo.environ as pm
 from network import Network
+from profiling import start_profiling
+from progress import Progress, get_status_path
+from solve_cache import SolveCache
+from solve_times import SolveTimes, get_solve_time_features
+from sparse_lp import solve_benders, solve_rolling_horizon, solve_sparse_lps
+from surrogate import fit_surrogate, get_clusters, predict_surrogate
+import tempfile
+from thread_budget import apply_thread_budget, get_thread_budget
 import time
 
 def get_demand_schedule(quantity, start_date, end_date, transport_state, transport_params_filepath, freq):
@@ -52,7 +65,7 @@ def get_demand_schedule(quantity, start_date, end_date, transport_state, transpo
 
     # NaN is where there is no road access and no construction so hexagon is infeasible for trucking.
     if pd.isnull(transport_state):
-        trucking_hourly_demand_schedule = np.nan
+        trucking_demand_resampled_schedule = np.nan
     # If demand center is in hexagon
     elif transport_state=="None":
         # Schedule for trucking
@@ -115,7 +128,7 @@ def get_water_constraint(n, demand_profile, water_limit):
         total_ammonia_demand = (
                     (n.loads_t.p_set['Ammonia demand'] * n.snapshot_weightings['objective']).sum() / 6.25 * 1000)
         # total hydrogen demand in kg
-        total_hydrogen_demand = total_ammonia_demand * 17 / 3  # convert kg ammonia to kg H2
+        total_hydrogen_demand = total_ammonia_demand * 3 / 17  # convert kg ammonia to kg H2
         # check if hydrogen demand can be met based on hexagon water availability
         water_constraint = total_hydrogen_demand <= water_limit * 111.57  # kg H2 per cubic meter of water
         # note that this constraint is purely stoichiometric-- more water may be needed for cooling or other processes
@@ -163,7 +176,206 @@ def get_generator_profile(generator, cutout, layout, hexagons, freq):
     
     return profile
 
-def solve_model(network_class, solver):
+def get_electricity_per_demand(plant_type):
+    '''
+    Gets the least electricity a plant needs per unit of demand, from the efficiencies
+    of its links. Losses of storage, batteries and compression are left out.
+
+    Parameters
+    ----------
+    plant_type : string
+        type of plant, "hydrogen" or "ammonia".
+
+    Returns
+    -------
+    electricity : float
+        MWh of electricity per MWh of hydrogen or ammonia.
+    '''
+    if plant_type == "hydrogen":
+        links = pd.read_csv("parameters/basic_h2_plant/links.csv", index_col='name')
+        return 1/links.loc['Electrolysis', 'efficiency']
+    elif plant_type == "ammonia":
+        links = pd.read_csv("parameters/basic_nh3_plant/links.csv", index_col='name')
+        # Haber-Bosch takes power and hydrogen from electrolysis for each MWh of ammonia
+        haber_bosch = links.loc['HB']
+        return (1 - haber_bosch['efficiency2']/links.loc['Electrolysis', 'efficiency'])/haber_bosch['efficiency']
+
+def get_prescreen(hexagon_list, profiles, demand_quantities, plant_type, water_limit):
+    '''
+    Finds the hexagons where a plant cannot meet the demand of a demand center,
+    before any network is built.
+
+    A hexagon is screened out if its generators have no potential, if running every
+    generator at its maximum capacity for the whole weather period cannot produce the
+    electricity the demand needs, or if there is not enough water for the electrolysis.
+    Generation is compared with 1% to spare, so no plant that could meet the demand
+    is screened out.
+
+    Parameters
+    ----------
+    hexagon_list : list
+        hexagon dictionaries as taken by optimize_hexagon.
+    profiles : dictionary
+        generator potential of every hexagon for each generator type.
+    demand_quantities : pandas Series
+        annual demand in kilograms of each demand center.
+    plant_type : string
+        type of plant, "hydrogen" or "ammonia".
+    water_limit : float
+        annual limit on water available for electrolysis in a hexagon, in cubic meters,
+        or False for no limit.
+
+    Returns
+    -------
+    screening : pandas DataFrame
+        "feasible", "zero potential", "land limit" or "water limit" for each hexagon
+        index and demand center.
+    '''
+    index = [hexagon['index'] for hexagon in hexagon_list]
+    max_generation = np.zeros(len(index))
+    for gen, profile in profiles.items():
+        max_capacities = np.array([hexagon['max_capacities'][gen] for hexagon in hexagon_list], dtype=float)
+        max_generation += max_capacities*profile.sum('time').sel(hexagon=index).values
+
+    heating_value = 39.4 if plant_type == "hydrogen" else 6.25 # MWh/t, as in the network loads
+    required = demand_quantities.to_numpy()/1000*heating_value*get_electricity_per_demand(plant_type)
+    status = np.full((len(index), len(demand_quantities)), "feasible", dtype=object)
+    if water_limit != False:
+        hydrogen_quantities = demand_quantities.to_numpy() if plant_type == "hydrogen" \
+            else demand_quantities.to_numpy()*3/17 # convert kg ammonia to kg H2
+        status[:, hydrogen_quantities > water_limit*111.57] = "water limit" # kg H2 per cubic meter of water
+    status[max_generation[:, None] < 0.99*required[None, :]] = "land limit"
+    status[max_generation <= 0] = "zero potential"
+    return pd.DataFrame(status, index=index, columns=demand_quantities.index)
+
+def get_solver_options(solver, threads=0, presolve='auto', method='auto', time_limit=0):
+    '''
+    Gets the options that keep the solver quiet and set its threads, presolve, method and time limit.
+
+    Parameters
+    ----------
+    solver : string
+        name of solver to be used.
+    threads : int
+        number of threads per solve. Default is 0, the solver's own choice.
+    presolve : string
+        'auto', 'on' or 'off'.
+    method : string
+        LP algorithm: 'auto', 'simplex', 'dual', 'primal' or 'barrier'.
+    time_limit : float
+        seconds after which a solve is stopped. Default is 0, no limit.
+
+    Returns
+    -------
+    solver_options : dictionary
+        options in the naming of the solver. Options the solver has no equivalent for are left out.
+    '''
+    if solver == "highs":
+        solver_options = {'output_flag' : False}
+        if threads > 0:
+            solver_options['threads'] = threads
+        if presolve != 'auto':
+            solver_options['presolve'] = presolve
+        if method in ('simplex', 'dual', 'primal'):
+            solver_options['solver'] = 'simplex'
+            # HiGHS strategy 1 is dual, 4 is primal simplex
+            if method != 'simplex':
+                solver_options['simplex_strategy'] = 1 if method == 'dual' else 4
+        elif method == 'barrier':
+            solver_options['solver'] = 'ipm'
+        if time_limit > 0:
+            solver_options['time_limit'] = float(time_limit)
+    elif solver == "gurobi":
+        solver_options = {'LogToConsole' : 0, 'OutputFlag' : 0}
+        if threads > 0:
+            solver_options['Threads'] = threads
+        if presolve != 'auto':
+            solver_options['Presolve'] = 0 if presolve == 'off' else 2
+        if method != 'auto':
+            solver_options['Method'] = {'simplex' : 1, 'dual' : 1, 'primal' : 0, 'barrier' : 2}[method]
+        if time_limit > 0:
+            solver_options['TimeLimit'] = float(time_limit)
+    elif solver == "cbc":
+        solver_options = {}
+        if threads > 0:
+            solver_options['threads'] = threads
+        if presolve != 'auto':
+            solver_options['presolve'] = presolve
+        if method != 'auto':
+            # Cbc takes the algorithm as a command without a value
+            solver_options[{'simplex' : 'dualSimplex', 'dual' : 'dualSimplex',
+                            'primal' : 'primalSimplex', 'barrier' : 'barrier'}[method]] = ''
+        if time_limit > 0:
+            solver_options['sec'] = float(time_limit)
+    else:
+        solver_options = {}
+    return solver_options
+
+def get_relaxed_solver_options(solver, time_limit=0):
+    '''
+    Gets solver options for a retry after a failed solve: the solver's own choice of
+    threads, presolve and method, and ten times the default feasibility tolerances.
+
+    Parameters
+    ----------
+    solver : string
+        name of solver to be used.
+    time_limit : float
+        seconds after which a solve is stopped. Default is 0, no limit.
+
+    Returns
+    -------
+    solver_options : dictionary
+        options in the naming of the solver.
+    '''
+    solver_options = get_solver_options(solver, time_limit=time_limit)
+    if solver == "highs":
+        solver_options.update({'primal_feasibility_tolerance' : 1e-6, 'dual_feasibility_tolerance' : 1e-6})
+    elif solver == "gurobi":
+        solver_options.update({'FeasibilityTol' : 1e-5, 'OptimalityTol' : 1e-5})
+    elif solver == "cbc":
+        solver_options.update({'primalTolerance' : 1e-6, 'dualTolerance' : 1e-6})
+    return solver_options
+
+def get_failure_reason(error, seconds=0, time_limit=0):
+    '''
+    Gets a short reason code for an exception raised while solving a plant.
+
+    Parameters
+    ----------
+    error : Exception
+        exception raised by the solve or by reading its results.
+    seconds : float
+        wall time of the failed solve. Default is 0.
+    time_limit : float
+        time limit of the solve, 0 for none. Default is 0.
+
+    Returns
+    -------
+    reason : string
+        'time_limit', 'infeasible', 'unbounded' or 'solver_error'.
+    '''
+    message = str(error).lower()
+    # Not every solver interface reports that the time limit was reached
+    if ('time' in message and 'limit' in message) or 0 < time_limit <= seconds:
+        return 'time_limit'
+    if 'infeasible' in message:
+        return 'infeasible'
+    if 'unbounded' in message:
+        return 'unbounded'
+    return 'solver_error'
+
+def get_gurobi_env():
+    '''
+    Gets the Gurobi environment of this process, so the licence is only checked out once.
+    '''
+    global _gurobi_env
+    if _gurobi_env is None:
+        import gurobipy
+        _gurobi_env = gurobipy.Env()
+    return _gurobi_env
+
+def solve_model(network_class, solver, solver_options, persistent_model=False, **kwargs):
     '''
     Solves model using the provided solver.
 
@@ -173,18 +385,252 @@ def solve_model(network_class, solver):
         network.
     solver : string
         name of solver to be used.
+    solver_options : dictionary
+        options passed to the solver, see get_solver_options.
+    persistent_model : boolean
+        whether to keep the optimisation model of the network, building it only on the
+        first solve and re-solving it in place afterwards. Default is False.
+    **kwargs
+        passed on to the linopy solve, e.g. io_api or the basis files from get_warm_start.
+
+    Returns
+    -------
+    timings : dictionary
+        seconds spent building the optimisation model as "model build", 0 if it was kept
+        from an earlier solve, and solving it and reading the solution as "solve".
     '''
-    if network_class.type == "hydrogen": ######## USED OPTIMIZE instead of LOPF
-        network_class.n.optimize(solver_name=solver,
-            solver_options = {'LogToConsole':0, 'OutputFlag':0},
-            pyomo=False,
-            )
-    elif network_class.type == "ammonia":
-        network_class.n.optimize(solver_name=solver,
-            solver_options={'LogToConsole': 0, 'OutputFlag': 0},
-            pyomo=True,
-            extra_functionality=_nh3_pyomo_constraints,
-            )
+    if solver == "gurobi":
+        kwargs['env'] = get_gurobi_env()
+    n = network_class.n
+    start = time.perf_counter()
+    # Same steps as n.optimize, split so the model build and solve can be timed
+    if not persistent_model or not hasattr(n, 'model'):
+        n.optimize.create_model()
+        if network_class.type == "ammonia":
+            _nh3_extra_functionality(n, n.snapshots)
+    model_built = time.perf_counter()
+    # A persistent network still holds the solution of the previous hexagon, so it must
+    # not be read unless this solve succeeds
+    status, condition = n.optimize.solve_model(solver_name=solver,
+        solver_options=solver_options,
+        **kwargs,
+        )
+    # Without an optimal solution, the network has no results to read
+    if status != "ok":
+        raise RuntimeError(f'Plant optimisation failed: {condition}')
+    return {'model build' : model_built - start, 'solve' : time.perf_counter() - model_built}
+
+def get_model_statistics(n):
+    '''
+    Gets the size of the optimisation model of a network and the solver iterations of its last solve.
+
+    Parameters
+    ----------
+    n :
+        network solved by solve_model.
+
+    Returns
+    -------
+    statistics : dictionary
+        number of "variables" and "constraints", and "iterations" (nan for solvers
+        that do not report them to linopy).
+    '''
+    model = n.model
+    iterations = np.nan
+    solver_model = getattr(model, 'solver_model', None)
+    if hasattr(solver_model, 'getInfo'):
+        # HiGHS
+        info = solver_model.getInfo()
+        iterations = info.simplex_iteration_count + info.ipm_iteration_count + info.crossover_iteration_count
+    elif hasattr(solver_model, 'IterCount'):
+        # Gurobi
+        iterations = solver_model.IterCount
+    return {'variables' : int(model.nvars), 'constraints' : int(model.ncons), 'iterations' : iterations}
+
+def get_warm_start(network_class, basis_dir):
+    '''
+    Gets the basis files to warm start a solve from the previous solve of the same shape.
+
+    Every solve writes its final basis, and the next solve in the same process of a
+    network with the same plant type and snapshots starts from it. Neighbouring hexagons
+    have very similar optimal plants, so this saves most simplex iterations when hexagons
+    are solved in spatial order. Solvers without basis files in linopy (e.g. HiGHS) ignore it.
+
+    Parameters
+    ----------
+    network_class : Network
+        network to be solved.
+    basis_dir : string
+        directory of the basis files, made and removed by the main process, or None
+        not to warm start solves.
+
+    Returns
+    -------
+    kwargs : dictionary
+        basis_fn and, once a basis exists, warmstart_fn for solve_model. Empty if
+        basis_dir is None.
+    '''
+    if basis_dir is None:
+        return {}
+    basis_fn = os.path.join(basis_dir,
+                            f'{network_class.type}_{len(network_class.n.snapshots)}_{os.getpid()}.bas')
+    kwargs = {'basis_fn' : basis_fn}
+    if os.path.exists(basis_fn):
+        kwargs['warmstart_fn'] = basis_fn
+    return kwargs
+
+def get_hilbert_order(hexagons, bits=16):
+    '''
+    Gets the order of the hexagons along a Hilbert curve through their centroids.
+
+    Hexagons that are close in this order are close in space, so consecutive solves
+    have similar weather profiles and optimal plants.
+
+    Parameters
+    ----------
+    hexagons : geodataframe
+        hexagon GeoJSON file.
+    bits : int
+        resolution of the curve, the bounding box is split into 2**bits cells per side.
+
+    Returns
+    -------
+    order : numpy array
+        hexagon indices in curve order.
+    '''
+    bounds = hexagons.geometry.bounds
+    lon = ((bounds['minx'] + bounds['maxx'])/2).to_numpy()
+    lat = ((bounds['miny'] + bounds['maxy'])/2).to_numpy()
+    side = 2**bits
+    # Scale the centres onto the integer grid of the curve
+    def to_grid(values):
+        span = values.max() - values.min()
+        if span == 0:
+            return np.zeros(len(values), dtype=np.int64)
+        return ((values - values.min())/span*(side - 1)).astype(np.int64)
+    x = to_grid(lon)
+    y = to_grid(lat)
+
+    # Standard conversion from grid coordinates to distance along the curve
+    distance = np.zeros(len(x), dtype=np.int64)
+    s = side//2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        distance += s*s*((3*rx) ^ ry)
+        # Rotate the quadrant so the sub-curve is in the standard orientation
+        flip = rx & ~ry
+        x = np.where(flip, side - 1 - x, x)
+        y = np.where(flip, side - 1 - y, y)
+        x, y = np.where(ry, x, y), np.where(ry, y, x)
+        s //= 2
+
+    return np.argsort(distance, kind='stable')
+
+def get_segments(features, n_segments):
+    '''
+    Splits a time series into chronological segments of variable length.
+
+    Neighbouring segments are merged, starting from one segment per snapshot, as long
+    as there are more than n_segments, always merging the pair that adds the least
+    variance within segments. Segments stay in order, so storage can be modelled
+    across them.
+
+    Parameters
+    ----------
+    features : numpy array
+        one row per snapshot and one column per normalised time series.
+    n_segments : int
+        number of segments.
+
+    Returns
+    -------
+    starts : numpy array
+        position of the first snapshot of each segment.
+    lengths : numpy array
+        number of snapshots in each segment.
+    '''
+    length = len(features)
+    if n_segments >= length:
+        return np.arange(length), np.ones(length, dtype=np.int64)
+    counts = np.ones(length)
+    sums = features.astype(float)
+    next_segment = np.arange(1, length + 1)
+    previous_segment = np.arange(-1, length - 1)
+    alive = np.ones(length, dtype=bool)
+    version = np.zeros(length, dtype=np.int64)
+
+    def merge_cost(a, b):
+        # Increase of the sum of squared deviations from the segment means
+        difference = sums[a]/counts[a] - sums[b]/counts[b]
+        return counts[a]*counts[b]/(counts[a] + counts[b])*difference.dot(difference)
+
+    # Entries are (cost, left, right, left version, right version) and go stale
+    # when either segment has changed since they were pushed
+    costs = 0.5*((features[1:] - features[:-1])**2).sum(axis=1)
+    heap = [(cost, a, a + 1, 0, 0) for a, cost in enumerate(costs)]
+    heapq.heapify(heap)
+    n_alive = length
+    while n_alive > n_segments:
+        cost, a, b, version_a, version_b = heapq.heappop(heap)
+        if not (alive[a] and alive[b] and version[a] == version_a and version[b] == version_b):
+            continue
+        counts[a] += counts[b]
+        sums[a] += sums[b]
+        alive[b] = False
+        version[a] += 1
+        next_segment[a] = next_segment[b]
+        n_alive -= 1
+        if next_segment[a] < length:
+            c = next_segment[a]
+            previous_segment[c] = a
+            heapq.heappush(heap, (merge_cost(a, c), a, c, version[a], version[c]))
+        if previous_segment[a] >= 0:
+            c = previous_segment[a]
+            heapq.heappush(heap, (merge_cost(c, a), c, a, version[c], version[a]))
+
+    starts = np.flatnonzero(alive)
+    return starts, counts[starts].astype(np.int64)
+
+def aggregate_time_series(generators, demand_schedule, n_segments):
+    '''
+    Aggregates the generator potentials and demand of a plant into chronological segments.
+
+    Parameters
+    ----------
+    generators : dictionary
+        contains generator types with their potential and maximum capacity.
+    demand_schedule : pandas DataFrame
+        demand profile for the transport type.
+    n_segments : int
+        number of segments.
+
+    Returns
+    -------
+    generators : dictionary
+        generator types with their potential averaged over each segment and maximum capacity.
+    demand_schedule : pandas DataFrame
+        demand averaged over each segment, indexed by the start of the segment.
+    segment_lengths : numpy array
+        number of snapshots in each segment.
+    '''
+    potentials = [np.asarray(gen_list[0], dtype=float) for gen_list in generators.values()]
+    # The demand schedule runs up to and including the end date, a snapshot past the
+    # weather data. Like pypsa when it sets the load, demand past the last snapshot is dropped.
+    demand_schedule = demand_schedule.iloc[:len(potentials[0])]
+    demand = demand_schedule['Demand'].to_numpy(dtype=float)
+    if any(len(potential) != len(demand) for potential in potentials):
+        raise ValueError('Generator potentials and demand schedule must have the same snapshots to be aggregated.')
+    # Potentials are per unit, so the demand is scaled to the same range
+    scaled_demand = demand/demand.max() if demand.max() > 0 else demand
+    starts, segment_lengths = get_segments(np.column_stack(potentials + [scaled_demand]), n_segments)
+
+    aggregated_generators = {}
+    for (gen, gen_list), potential in zip(generators.items(), potentials):
+        aggregated_generators[gen] = [np.add.reduceat(potential, starts)/segment_lengths, gen_list[1]]
+    aggregated_schedule = pd.DataFrame({'Demand' : np.add.reduceat(demand, starts)/segment_lengths},
+                                       index=demand_schedule.index[starts])
+    return aggregated_generators, aggregated_schedule, segment_lengths
 
 def get_h2_results(n, generators):
     '''
@@ -212,14 +658,13 @@ def get_h2_results(n, generators):
     '''
     generator_capacities = {}
     # n.remove("Store","Compressed H2 Store")
-    lc = n.objective/(n.loads_t.p_set.sum()[0]/39.4*1000) # convert back to kg H2
-    print(lc) ###### PRINTING LC
+    lc = n.objective/((n.loads_t.p_set['Hydrogen demand'] * n.snapshot_weightings[
+        'objective']).sum()/39.4*1000) # convert back to kg H2
     for generator in generators:
             generator_capacities[generator] = n.generators.p_nom_opt[f"{generator}"]
     electrolyzer_capacity = n.links.p_nom_opt['Electrolysis']
     battery_capacity = n.storage_units.p_nom_opt['Battery']
     h2_storage = n.stores.e_nom_opt['Compressed H2 Store']
-    print(generator_capacities, electrolyzer_capacity, battery_capacity, h2_storage)
     return lc, generator_capacities, electrolyzer_capacity, battery_capacity, h2_storage
 
 def get_nh3_results(n, generators):
@@ -253,7 +698,6 @@ def get_nh3_results(n, generators):
     #n.remove("Stores","Ammonia")
     lc = n.objective / ((n.loads_t.p_set['Ammonia demand'] * n.snapshot_weightings[
         'objective']).sum() / 6.25 * 1000)  # convert back to kg NH3
-    print(lc) ###### PRINTING LC
     for generator in generators:
             generator_capacities[generator] = n.generators.p_nom_opt[generator]
     electrolyzer_capacity = n.links.p_nom_opt['Electrolysis']
@@ -263,72 +707,984 @@ def get_nh3_results(n, generators):
     nh3_storage = n.stores.e_nom_opt['Ammonia']
     return lc, generator_capacities, electrolyzer_capacity, battery_capacity, h2_storage, nh3_storage
 
-def _nh3_pyomo_constraints(n, snapshots):
+def _nh3_extra_functionality(n, snapshots):
     """Includes a series of additional constraints which make the ammonia plant work as needed:
     i) Battery sizing
-    ii) Ramp hard constraints down (Cannot be violated)
-    iii) Ramp hard constraints up (Cannot be violated)
-    iv) Ramp soft constraints down
-    v) Ramp soft constraints up
-    (iv) and (v) just softly suppress ramping so that the model doesn't 'zig-zag', which looks a bit odd on operation.
-    Makes very little difference on LCOA. """
-    timestep = int(snakemake.config['freq'][0])
-    # The battery constraint is built here - it doesn't need a special function because it doesn't depend on time
-    n.model.variables.battery_interface = pm.Constraint(
-        rule=lambda model: n.model.link_p_nom['BatteryInterfaceIn'] ==
-                        n.model.link_p_nom["BatteryInterfaceOut"] /
-                        n.links.efficiency["BatteryInterfaceOut"])
+    ii) Cycling limit of the battery relative to the hydrogen storage
+    iii) Ramp hard constraints down (Cannot be violated)
+    iv) Ramp hard constraints up (Cannot be violated)
+    The ramp constraints are cyclic, so the first snapshot also follows on from the last.
+    All constraints are added to the linopy model as whole arrays, not per snapshot."""
+    m = n.model
+    link_p_nom = m['Link-p_nom']
+    link_ext_dim = link_p_nom.dims[0]
+    # Length of a snapshot in hours, from the snapshots rather than the freq string
+    if len(snapshots) > 1:
+        timestep = pd.Series(snapshots).diff().min() / pd.Timedelta(hours=1)
+    else:
+        timestep = 1
+
+    # The battery constraint doesn't depend on time
+    m.add_constraints(link_p_nom.loc[{link_ext_dim: 'BatteryInterfaceIn'}] -
+                      link_p_nom.loc[{link_ext_dim: 'BatteryInterfaceOut'}] /
+                      n.links.efficiency['BatteryInterfaceOut'] == 0,
+                      name='battery_interface')
 
     # Constrain the maximum discharge of the H2 storage relative to its size
     time_step_cycle = 4/8760*timestep*0.5  # Factor 0.5 for 3 hour time step, 0.5 for oversized storage
-    n.model.variables.cycling_limit = pm.Constraint(
-        rule=lambda model: n.model.link_p_nom['BatteryInterfaceOut'] ==
-                        n.model.store_e_nom['CompressedH2Store'] * time_step_cycle)
-
-    # The HB Ramp constraints are functions of time, so we need to create some pyomo sets/parameters to represent them.
-    n.model.variables.t = pm.Set(initialize=n.snapshots)
-    n.model.variables.HB_max_ramp_down = pm.Param(initialize=n.links.loc['HB'].ramp_limit_down)
-    n.model.variables.HB_max_ramp_up = pm.Param(initialize=n.links.loc['HB'].ramp_limit_up)
+    m.add_constraints(link_p_nom.loc[{link_ext_dim: 'BatteryInterfaceOut'}] -
+                      m['Store-e_nom'].loc[{m['Store-e_nom'].dims[0]: 'CompressedH2Store'}] * time_step_cycle == 0,
+                      name='cycling_limit')
 
-    # Using those sets/parameters, we can now implement the constraints...
+    # The non-cyclic ramp limits that pypsa builds from links.csv are replaced by cyclic ones
+    for name in ('Link-ext-p0-ramp_limit_up', 'Link-ext-p0-ramp_limit_down'):
+        if name in m.constraints:
+            m.remove_constraints(name)
     logging.warning('Pypsa has been overridden - Ramp rates on NH3 plant are included')
-    n.model.variables.NH3_pyomo_overwrite_ramp_down = pm.Constraint(n.model.variables.t, rule=_nh3_ramp_down)
-    n.model.variables.NH3_pyomo_overwrite_ramp_up = pm.Constraint(n.model.variables.t, rule=_nh3_ramp_up)
-    # n.model.NH3_pyomo_penalise_ramp_down = pm.Constraint(n.model.t, rule=_penalise_ramp_down)
-    # n.model.NH3_pyomo_penalise_ramp_up = pm.Constraint(n.model.t, rule=_penalise_ramp_up)
+    hb_p = m['Link-p'].loc[{'Link': 'HB'}]
+    hb_p_nom = link_p_nom.loc[{link_ext_dim: 'HB'}]
+    # Rolling by one snapshot pairs every snapshot with the one before it, the first with the last
+    ramp = hb_p - hb_p.roll(snapshot=1)
+    m.add_constraints(ramp + hb_p_nom * n.links.at['HB', 'ramp_limit_down'] >= 0, name='HB_ramp_down')
+    m.add_constraints(ramp - hb_p_nom * n.links.at['HB', 'ramp_limit_up'] <= 0, name='HB_ramp_up')
 
-def _nh3_ramp_down(model, t):
-    """Places a cap on how quickly the ammonia plant can ramp down"""
-    timestep = int(snakemake.config['freq'][0])
-    if t == model.t.at(1):
+# Networks kept between solves with the persistent model setting, one per plant type
+# and demand schedule shape in each process
+_persistent_networks = {}
+# Cache of plant optimisation results opened by this process
+_solve_cache = None
+# Gurobi environment shared by the solves of this process
+_gurobi_env = None
+# History of solve times opened by this process
+_solve_times = None
+# Timing records of this process
+_instrumentation = None
 
-        old_rate = model.link_p['HB', model.t.at(-1)]
-    else:
-        # old_rate = model.link_p['HB', t - 1]
-        old_rate = model.link_p['HB', t - pd.Timedelta(timestep, unit = 'H')]
+def get_plant_results(network, generators, plant_type):
+    '''
+    Gets the results of a solved plant network.
 
-    return old_rate - model.link_p['HB', t] <= \
-        model.link_p_nom['HB'] * model.HB_max_ramp_down
-    # Note 20 is the UB of the size of the ammonia plant; essentially if x = 0 then the constraint is not active
+    Parameters
+    ----------
+    network : Network
+        solved plant network.
+    generators : dictionary
+        contains generator types with their potential and maximum capacity.
+    plant_type : string
+        type of plant, "hydrogen" or "ammonia".
 
+    Returns
+    -------
+    results : tuple
+        levelized cost, generator capacities, electrolyzer capacity, battery capacity,
+        hydrogen storage and ammonia storage (nan for hydrogen plants).
+    '''
+    if plant_type == "hydrogen":
+        lc, generators_capacities, electrolyzer_capacity, battery_capacity, \
+        h2_storage = get_h2_results(network.n, generators)
+        nh3_storage = np.nan
+    elif plant_type == "ammonia":
+        lc, generators_capacities, electrolyzer_capacity, battery_capacity, \
+        h2_storage, nh3_storage = get_nh3_results(network.n, generators)
+    return lc, generators_capacities, electrolyzer_capacity, battery_capacity, h2_storage, nh3_storage
+
+def get_nan_results(generators):
+    '''
+    Gets the results recorded for a hexagon where a transport type is not viable.
+
+    Parameters
+    ----------
+    generators : list
+        contains types of generators that this plant uses.
+
+    Returns
+    -------
+    results : tuple
+        same layout as the results of solve_hexagon_transport, with every value set to nan.
+    '''
+    generator_capacities = {gen: np.nan for gen in generators}
+    return np.nan, generator_capacities, np.nan, np.nan, np.nan, np.nan
+
+def get_solve_cache(settings):
+    '''
+    Gets the persistent cache of plant optimisation results for this process.
+
+    Parameters
+    ----------
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    solve_cache : SolveCache or None
+        cache of results, or None if the solve cache setting is off.
+    '''
+    global _solve_cache
+    if settings['solve_cache_path'] is None:
+        return None
+    if _solve_cache is None or _solve_cache.path != settings['solve_cache_path']:
+        _solve_cache = SolveCache(settings['solve_cache_path'])
+    return _solve_cache
+
+def get_solve_times(settings):
+    '''
+    Gets the history of plant optimisation solve times for this process.
+
+    Parameters
+    ----------
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    solve_times : SolveTimes
+        history of solve times.
+    '''
+    global _solve_times
+    if _solve_times is None or _solve_times.path != settings['solve_time_history']:
+        _solve_times = SolveTimes(settings['solve_time_history'], settings['solve_time_records'])
+    return _solve_times
+
+def get_instrumentation(settings):
+    '''
+    Gets the timing records of this process, labelled with the current demand center.
+
+    Parameters
+    ----------
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    instrumentation : Instrumentation
+        timing records, which record nothing if the instrumentation setting is off.
+    '''
+    global _instrumentation
+    if _instrumentation is None or _instrumentation.path != settings['benchmark_path']:
+        _instrumentation = Instrumentation(settings['benchmark_path'])
+    _instrumentation.labels = {'demand_center' : settings['demand_center']}
+    return _instrumentation
+
+def get_network(generators, demand_schedule, settings, segment_lengths=None):
+    '''
+    Gets the plant network for one transport type of a hexagon, ready to be solved.
 
-def _nh3_ramp_up(model, t):
-    """Places a cap on how quickly the ammonia plant can ramp down"""
-    timestep = int(snakemake.config['freq'][0])
-    if t == model.t.at(1):
-        old_rate = model.link_p['HB', model.t.at(-1)]
+    With the persistent model setting, one network and its optimisation model are kept
+    per plant type and demand schedule shape, and later hexagons only update the weather
+    profiles, maximum capacities and demand of that network. Aggregated snapshots differ
+    between hexagons, so aggregated networks are always built from scratch.
+
+    Parameters
+    ----------
+    generators : dictionary
+        contains generator types with their potential and maximum capacity.
+    demand_schedule : pandas DataFrame
+        demand profile for the transport type.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    segment_lengths : numpy array
+        number of snapshots each snapshot of an aggregated demand schedule stands for.
+        Default is None for a full-resolution schedule.
+
+    Returns
+    -------
+    network : Network
+        network with its generators and demand set.
+    '''
+    persistent_model = settings['persistent_model'] and segment_lengths is None
+    if persistent_model:
+        # Generators without a finite maximum capacity have no capacity limit in the model
+        key = (settings['plant_type'],
+               demand_schedule.index[0], demand_schedule.index[-1], len(demand_schedule),
+               tuple(np.isfinite(gen_list[1]) for gen_list in generators.values()))
+        if key in _persistent_networks:
+            network = _persistent_networks[key]
+            network.update_network(generators, demand_schedule)
+            return network
+
+    network = Network(settings['plant_type'], generators)
+    times = settings['times'] if segment_lengths is None else demand_schedule.index
+    network.set_network(demand_schedule, times, settings['country_series'], segment_lengths)
+    network.set_generators_in_network(settings['country_series'])
+    if persistent_model:
+        _persistent_networks[key] = network
+    return network
+
+def solve_hexagon_transport(generators, demand_schedule, settings, labels=None):
+    '''
+    Sets up the plant network for one transport type of a hexagon and solves it.
+
+    Parameters
+    ----------
+    generators : dictionary
+        contains generator types with their potential and maximum capacity.
+    demand_schedule : pandas DataFrame
+        demand profile for the transport type.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    labels : dictionary
+        labels of the timing records of the solve. Default is None.
+
+    Returns
+    -------
+    results : tuple
+        levelized cost, generator capacities, electrolyzer capacity, battery capacity,
+        hydrogen storage and ammonia storage (nan for hydrogen plants).
+    '''
+    return solve_hexagon_transports([(generators, demand_schedule)], settings,
+                                    labels=None if labels is None else [labels])[0]
+
+def solve_hexagon_transports(problems, settings, failures=None, labels=None):
+    '''
+    Sets up the plant networks of several hexagons and transport types and solves them.
+
+    With the sparse engine, the networks are stacked into block-diagonal LPs of up to
+    batch_size plants, so that each solver call solves several plants at once.
+
+    A plant whose solve fails, or runs past the time limit, is solved again with the
+    fallback solves of the settings through PyPSA. With failure isolation, a plant that
+    still fails gets nan results instead of stopping the run.
+
+    Parameters
+    ----------
+    problems : list
+        (generators, demand_schedule) tuples as taken by solve_hexagon_transport.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    failures : dictionary
+        if given, the reason code from get_failure_reason of each failed problem is
+        added under its position in problems. Default is None.
+    labels : list
+        labels of the timing records of each problem, such as hexagon and transport.
+        Default is None.
+
+    Returns
+    -------
+    results : list
+        results of solve_hexagon_transport for each problem.
+    '''
+    plant_type = settings['plant_type']
+    results = [None]*len(problems)
+    keys = [None]*len(problems)
+    batch = []
+    solve_cache = get_solve_cache(settings)
+    # A persistent network is shared between hexagons, so it cannot be stacked
+    batch_size = settings['batch_size'] if settings['engine'] == 'sparse' else 1
+    network_settings = dict(settings, persistent_model=False) if batch_size > 1 else settings
+    instrumentation = get_instrumentation(settings)
+    if labels is None:
+        labels = [{} for _ in problems]
+
+    def solve_engine(batch):
+        # Errors of the plants that failed, for engines that solve the rest of the batch anyway
+        errors = {}
+        start = time.perf_counter()
+        if settings['engine'] == 'sparse':
+            network_errors = solve_sparse_lps([network.n for _, network in batch], settings['solve_time_limit'] or None)
+            # The error of the sparse engine says whether the time limit was reached
+            errors = {position : (error, 0) for (position, _), error in zip(batch, network_errors) if error is not None}
+        elif settings['engine'] == 'benders':
+            for _, network in batch:
+                solve_benders(network.n, settings['benders_periods'], threads=settings['benders_threads'])
+        elif settings['engine'] == 'rolling':
+            for _, network in batch:
+                solve_rolling_horizon(network.n, settings['rolling_window'], settings['rolling_overlap'])
+        else:
+            for position, network in batch:
+                timings = solve_model(network, settings['solver'], settings['solver_options'],
+                                      settings['persistent_model'], io_api=settings['io_api'],
+                                      **get_warm_start(network, settings['basis_dir']))
+                instrumentation.add('model build', timings['model build'], **labels[position])
+                instrumentation.add('solve', timings['solve'], **labels[position], **get_model_statistics(network.n))
+            return errors
+        # The other engines build and solve their programmes in one go, for the whole batch
+        for position, _ in batch:
+            instrumentation.add('solve', (time.perf_counter() - start)/len(batch), **labels[position],
+                                batch_size=len(batch))
+        return errors
+
+    def solve_fallbacks(position, network, error, seconds):
+        # Keep the reason of the first failure, which the fallbacks were meant to get around
+        reason = get_failure_reason(error, seconds, settings['solve_time_limit'])
+        for solver, solver_options in settings['fallback_solves']:
+            print(f'Plant optimisation failed ({error}), retrying with {solver} {solver_options}.')
+            try:
+                timings = solve_model(network, solver, solver_options,
+                                      network_settings['persistent_model'] and not settings['segments'],
+                                      io_api=settings['io_api'] if solver in ('highs', 'gurobi') else 'lp')
+                instrumentation.add('fallback solve', timings['model build'] + timings['solve'],
+                                    **labels[position], solver=solver, **get_model_statistics(network.n))
+                return None
+            except Exception as fallback_error:
+                error = fallback_error
+        if not settings['isolate_failures']:
+            raise error
+        print(f'Plant optimisation failed ({error}), recording nan results.')
+        return reason
+
+    def solve_batch(batch):
+        start_batch = time.time()
+        try:
+            errors = solve_engine(batch)
+        except Exception as error:
+            # Find the plants that fail on their own
+            errors = {batch[0][0] : (error, time.time() - start_batch)} if len(batch) == 1 else {}
+            for position, network in batch if len(batch) > 1 else []:
+                start_network = time.time()
+                try:
+                    errors.update(solve_engine([(position, network)]))
+                except Exception as network_error:
+                    errors[position] = (network_error, time.time() - start_network)
+        for position, network in batch:
+            reason = solve_fallbacks(position, network, *errors[position]) if position in errors else None
+            if reason is None:
+                try:
+                    with instrumentation.time('results', **labels[position]):
+                        results[position] = get_plant_results(network, problems[position][0], plant_type)
+                except Exception as error:
+                    if not settings['isolate_failures']:
+                        raise
+                    print(f'Reading the plant results failed ({error}), recording nan results.')
+                    reason = 'results_error'
+            if reason is not None:
+                results[position] = get_nan_results(problems[position][0])
+                if failures is not None:
+                    failures[position] = reason
+            elif solve_cache is not None:
+                solve_cache.put(keys[position], results[position])
+
+    for position, (generators, demand_schedule) in enumerate(problems):
+        # Reuse the results of an identical plant LP solved in this or an earlier run
+        if solve_cache is not None:
+            solve_settings = {'solver' : settings['solver'],
+                              'solver_options' : settings['solver_options'],
+                              'water_limit' : settings['water_limit'],
+                              'segments' : settings['segments'],
+                              'engine' : settings['engine']}
+            # Benders results depend on the periods within the tolerance, and rolling
+            # horizon results on the window
+            if settings['engine'] == 'benders':
+                solve_settings['benders_periods'] = settings['benders_periods']
+            elif settings['engine'] == 'rolling':
+                solve_settings['rolling_window'] = settings['rolling_window']
+                solve_settings['rolling_overlap'] = settings['rolling_overlap']
+            keys[position] = solve_cache.get_key(plant_type, generators, demand_schedule, settings['country_series'],
+                                                 solve_settings)
+            results[position] = solve_cache.get(keys[position])
+            if results[position] is not None:
+                continue
+
+        with instrumentation.time('network build', **labels[position]):
+            # Solve over chronological segments instead of every snapshot
+            if settings['segments']:
+                network_generators, network_schedule, segment_lengths = \
+                    aggregate_time_series(generators, demand_schedule, settings['segments'])
+            else:
+                network_generators, network_schedule, segment_lengths = generators, demand_schedule, None
+            network = get_network(network_generators, network_schedule, network_settings, segment_lengths)
+
+        # Check for water constraint before any solving occurs
+        if settings['water_limit'] != False:
+            water_constraint = get_water_constraint(network, demand_schedule, settings['water_limit'])
+            if water_constraint == False:
+                print('Not enough water to meet demand!')
+                results[position] = get_nan_results(generators)
+                if solve_cache is not None:
+                    solve_cache.put(keys[position], results[position])
+                continue
+
+        batch.append((position, network))
+        if len(batch) == batch_size:
+            solve_batch(batch)
+            batch = []
+    if len(batch) > 0:
+        solve_batch(batch)
+    return results
+
+def get_hexagon_problem(hexagon, settings):
+    '''
+    Gets the generators and demand schedules of the plants of a hexagon.
+
+    Parameters
+    ----------
+    hexagon : dictionary
+        hexagon dictionary as taken by optimize_hexagon.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    generators : dictionary
+        potential and maximum capacity of each generator type.
+    demand_schedules : dictionary
+        demand schedule of "trucking" and "pipeline" transport.
+    viable : dictionary
+        whether the plant of "trucking" and "pipeline" transport can be built.
+    '''
+    trucking_state = hexagon['trucking_state']
+
+    # Get the demand schedule for both pipeline and trucking transport
+    trucking_demand_schedule, pipeline_demand_schedule =\
+        get_demand_schedule(settings['annual_demand_quantity'],
+                        settings['start_date'],
+                        settings['end_date'],
+                        trucking_state,
+                        settings['transport_params_filepath'],
+                        settings['freq'])
+    demand_schedules = {"trucking" : trucking_demand_schedule, "pipeline" : pipeline_demand_schedule}
+
+    # Get the potential and max capacity for each generation type
+    # Ammonia plants are solved on the snapshots of the demand schedule
+    if pd.isnull(trucking_state) == False:
+        snapshots = trucking_demand_schedule.index
     else:
-        # old_rate = model.link_p['HB', t - 1]
-        old_rate = model.link_p['HB', t - pd.Timedelta(timestep, unit = 'H')]
+        snapshots = pipeline_demand_schedule.index
+    generators = {}
+    for gen, potential in hexagon['potentials'].items():
+        if settings['plant_type'] == "ammonia":
+            potential = potential.sel(time=snapshots)
+        generators[gen] = [potential, hexagon['max_capacities'][gen]]
+
+    # If the hexagon has no viable trucking state (i.e., no roads reach it), set everything to nan.
+    # For pipeline, set it up with pipeline demand schedule if construction is true.
+    # If construction is false, you can't transport it, so everything gets nan
+    # UNLESS in the demand centre hexagon (demand location has trucking state as None).
+    viable = {"trucking" : pd.isnull(trucking_state) == False,
+              "pipeline" : settings['pipeline_construction'] == True or trucking_state == "None"}
+    return generators, demand_schedules, viable
+
+def optimize_hexagon(hexagon, settings):
+    '''
+    Designs the plant of one hexagon for both trucking and pipeline transport.
+
+    This is the unit of work handed to the worker processes, so it only uses
+    its arguments and never the snakemake object.
+
+    Parameters
+    ----------
+    hexagon : dictionary
+        index, trucking state, and generator potential and maximum capacity of the hexagon,
+        optionally the transport cost of "trucking" and "pipeline" as "transport_costs",
+        and optionally the results of transports solved in an earlier run as "checkpoint".
+    settings : dictionary
+        run-wide settings: plant type, demand quantity and dates, solver, snapshots,
+        country parameters and water limit.
+
+    Returns
+    -------
+    index : int
+        index of the hexagon in the hexagon file.
+    results : dictionary
+        results of solve_hexagon_transport for "trucking" and "pipeline", and the
+        relative levelized cost errors of solves checked against a reference solve
+        as "lc_errors", a list of (check, error) tuples.
+    '''
+    return optimize_hexagon_batch([hexagon], settings)[0]
+
+def optimize_hexagon_batch(hexagon_batch, settings):
+    '''
+    Designs the plants of several hexagons, solving their plant LPs together so
+    that the sparse engine can stack them into block-diagonal LPs.
+
+    Parameters
+    ----------
+    hexagon_batch : list
+        hexagon dictionaries as taken by optimize_hexagon.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    results : list
+        (index, results) from optimize_hexagon for each hexagon of the batch.
+    '''
+    start = time.time()
+    hexagon_data = []
+    problems = []
+    for hexagon in hexagon_batch:
+        i = hexagon['index']
+        generators, demand_schedules, viable = get_hexagon_problem(hexagon, settings)
+
+        # Transports solved before the run was restarted are not solved again
+        results = dict(hexagon.get('checkpoint', {}))
+        # With pruning, the transport with the dearer transport cost is only solved if it can still win
+        transport_costs = hexagon.get('transport_costs', {})
+        deferred = None
+        if settings['prune_transport'] and all(viable.values()) \
+                and all(np.isfinite(transport_costs.get(transport, np.nan)) for transport in viable):
+            deferred = max(viable, key=lambda transport: transport_costs[transport])
+            if deferred in results:
+                deferred = None
+        results["dominated"] = None
+        results["failures"] = {}
+        for transport in ("trucking", "pipeline"):
+            if transport in results or transport == deferred:
+                pass
+            elif viable[transport]:
+                problems.append((i, results, transport, generators, demand_schedules[transport]))
+            else:
+                results[transport] = get_nan_results(generators)
+        hexagon_data.append((i, results, generators, demand_schedules, deferred, transport_costs))
+
+    failures = {}
+    solved = solve_hexagon_transports([(generators, demand_schedule)
+                                       for _, _, _, generators, demand_schedule in problems], settings, failures,
+                                      [{'hexagon' : i, 'transport' : transport}
+                                       for i, _, transport, _, _ in problems])
+    for position, ((_, results, transport, _, _), transport_results) in enumerate(zip(problems, solved)):
+        results[transport] = transport_results
+        if position in failures:
+            results["failures"][transport] = failures[position]
+
+    # A deferred transport is dominated if its transport cost and a lower bound on its
+    # production cost already exceed the total cost of the other transport
+    problems = []
+    for i, results, generators, demand_schedules, deferred, transport_costs in hexagon_data:
+        if deferred is None:
+            continue
+        other = "pipeline" if deferred == "trucking" else "trucking"
+        network = Network(settings['plant_type'], generators)
+        production_cost_bound = network.get_production_cost_bound(demand_schedules[deferred], settings['country_series'],
+                                                                  get_electricity_per_demand(settings['plant_type']))
+        if production_cost_bound + transport_costs[deferred] > results[other][0] + transport_costs[other]:
+            results[deferred] = get_nan_results(generators)
+            results["dominated"] = deferred
+        else:
+            problems.append((i, results, deferred, generators, demand_schedules[deferred]))
+    failures = {}
+    solved = solve_hexagon_transports([(generators, demand_schedule)
+                                       for _, _, _, generators, demand_schedule in problems], settings, failures,
+                                      [{'hexagon' : i, 'transport' : transport}
+                                       for i, _, transport, _, _ in problems])
+    for position, ((_, results, transport, _, _), transport_results) in enumerate(zip(problems, solved)):
+        results[transport] = transport_results
+        if position in failures:
+            results["failures"][transport] = failures[position]
+
+    # Compare the solves of every nth hexagon with full-resolution or PyPSA solves
+    for i, results, generators, demand_schedules, _, _ in hexagon_data:
+        results["lc_errors"] = []
+        checks = []
+        if settings['segments'] and settings['segments_check'] and i % settings['segments_check'] == 0:
+            checks.append((f"{settings['segments']} segments against full resolution", dict(settings, segments=0)))
+        if settings['engine'] != 'pypsa' and settings['engine_check'] and i % settings['engine_check'] == 0:
+            checks.append((f"{settings['engine']} engine against PyPSA", dict(settings, engine='pypsa')))
+        for check, reference_settings in checks:
+            for transport in ("trucking", "pipeline"):
+                lc = results[transport][0]
+                if np.isnan(lc):
+                    continue
+                reference_lc = solve_hexagon_transport(generators, demand_schedules[transport], reference_settings,
+                                                       {'hexagon' : i, 'transport' : transport, 'check' : check})[0]
+                if np.isnan(reference_lc):
+                    continue
+                results["lc_errors"].append((check, (lc - reference_lc)/reference_lc))
+
+    # Share the wall time of the batch between its hexagons for the solve time history
+    for _, results, _, _, _, _ in hexagon_data:
+        results["solve_time"] = (time.time() - start)/len(hexagon_data)
+    return [(i, results) for i, results, _, _, _, _ in hexagon_data]
+
+def optimize_hexagons(hexagon_list, settings, processes):
+    '''
+    Optimises all hexagons, in parallel if more than one process is given.
+
+    Parameters
+    ----------
+    hexagon_list : list
+        hexagon dictionaries as taken by optimize_hexagon.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    processes : int
+        number of worker processes. 1 solves every hexagon in this process.
+
+    Yields
+    ------
+    results : tuple
+        (index, results) from optimize_hexagon as soon as each hexagon is solved, in the
+        order of hexagon_list unless several processes schedule the longest solves first.
+    '''
+    # Batches of hexagons whose trucking and pipeline LPs fill one stacked LP
+    hexagons_per_batch = max(1, settings['batch_size']//2) if settings['engine'] == 'sparse' else 1
+    batches = [hexagon_list[start:start + hexagons_per_batch]
+               for start in range(0, len(hexagon_list), hexagons_per_batch)]
+    worker = partial(optimize_hexagon_batch, settings=settings)
+
+    if processes <= 1:
+        for hexagon_batch in batches:
+            yield from worker(hexagon_batch)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        if settings['schedule'] != 'longest_first':
+            # Contiguous chunks keep the pickling overhead low while still balancing load
+            chunksize = max(1, len(batches) // (processes * 4))
+            for results in pool.imap(worker, batches, chunksize=chunksize):
+                yield from results
+            return
+        # Dispatch the longest expected batches first, one at a time to whichever
+        # process is free, so no long solve is left to run alone at the end
+        solve_times = get_solve_times(settings)
+        features = {hexagon['index'] : get_solve_time_features(hexagon, settings) for hexagon in hexagon_list}
+        estimates = [sum(solve_times.estimate(*features[hexagon['index']]) for hexagon in hexagon_batch)
+                     for hexagon_batch in batches]
+        batches = [batches[position] for position in np.argsort(estimates, kind='stable')[::-1]]
+        # Cached and checkpointed plants would record the time of a lookup
+        record = settings['solve_cache_path'] is None
+        unrecorded = {hexagon['index'] for hexagon in hexagon_list if len(hexagon.get('checkpoint', {})) > 0}
+        try:
+            for results in pool.imap_unordered(worker, batches, chunksize=1):
+                for i, hexagon_results in results:
+                    if record and i not in unrecorded:
+                        solve_times.add(*features[i], hexagon_results["solve_time"])
+                    yield i, hexagon_results
+        finally:
+            solve_times.flush()
+
+def get_hexagon_features(hexagon_list):
+    '''
+    Gets the standardised features the plant surrogate is fitted on.
 
+    Parameters
+    ----------
+    hexagon_list : list
+        hexagon dictionaries as taken by optimize_hexagon.
+
+    Returns
+    -------
+    features : numpy array
+        mean and standard deviation of the potential and logarithm of the maximum
+        capacity of each generator, one row per hexagon.
+    '''
+    rows = []
+    for hexagon in hexagon_list:
+        row = []
+        for gen, potential in hexagon['potentials'].items():
+            potential = np.asarray(potential, dtype=float)
+            row += [potential.mean(), potential.std(), np.log1p(hexagon['max_capacities'][gen])]
+        rows.append(row)
+    features = np.array(rows)
+    # Unlimited capacities are treated as the largest limited one
+    features = np.where(np.isfinite(features), features, np.nanmax(np.where(np.isfinite(features), features, np.nan), axis=0))
+    features = np.nan_to_num(features)
+    deviation = features.std(axis=0)
+    deviation[deviation == 0] = 1
+    return (features - features.mean(axis=0))/deviation
 
-    return model.link_p['HB', t] - old_rate <= \
-        model.link_p_nom['HB'] * model.HB_max_ramp_up()
+def _flatten_results(results, generators):
+    '''
+    Puts the trucking and pipeline results of a hexagon in one list of numbers.
+    '''
+    values = []
+    for transport in ("trucking", "pipeline"):
+        lc, generator_capacities, electrolyzer_capacity, battery_capacity, h2_storage, nh3_storage = results[transport]
+        values += [lc] + [generator_capacities[gen] for gen in generators] \
+            + [electrolyzer_capacity, battery_capacity, h2_storage, nh3_storage]
+    return values
+
+def _unflatten_results(values, generators):
+    '''
+    Inverse of _flatten_results, with capacities cut off at zero.
+    '''
+    results = {}
+    length = len(generators) + 5
+    for position, transport in enumerate(("trucking", "pipeline")):
+        part = np.array(values[position*length:(position + 1)*length], dtype=float)
+        part[1:] = np.maximum(part[1:], 0)
+        results[transport] = (part[0], dict(zip(generators, part[1:len(generators) + 1])),
+                              *part[len(generators) + 1:])
+    results["lc_errors"] = []
+    return results
+
+def optimize_hexagons_by_surrogate(hexagon_list, settings, processes, n_clusters, tolerance):
+    '''
+    Optimises representative hexagons and predicts the results of the other hexagons.
+
+    Hexagons are grouped by trucking state, so all hexagons of a group have the same
+    demand schedules, and clustered on their weather profiles and maximum capacities.
+    The hexagon closest to the centre of each cluster is solved and a linear surrogate
+    is fitted on the solved hexagons of the group. Hexagons whose predicted levelized
+    cost is extrapolated, or has a standard deviation above the tolerance, are solved too.
+
+    Parameters
+    ----------
+    hexagon_list : list
+        hexagon dictionaries as taken by optimize_hexagon.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    processes : int
+        number of worker processes.
+    n_clusters : int
+        number of representative hexagons, shared between groups by size.
+    tolerance : float
+        largest standard deviation of a predicted levelized cost relative to the prediction.
+
+    Returns
+    -------
+    results : list
+        (index, results) tuples as returned by optimize_hexagon, in the order of hexagon_list.
+    methods : dictionary
+        "solved" or "surrogate" for each hexagon index.
+    '''
+    generators = list(hexagon_list[0]['max_capacities'].keys())
+    features = get_hexagon_features(hexagon_list)
+    # Enough representatives per group to fit every coefficient with some to spare
+    min_clusters = 2*(features.shape[1] + 1)
+    groups = {}
+    for position, hexagon in enumerate(hexagon_list):
+        groups.setdefault(str(hexagon['trucking_state']), []).append(position)
+
+    # Solve the representatives of all groups together to keep every process busy
+    representatives = {}
+    for state, positions in groups.items():
+        positions = np.array(positions)
+        group_clusters = max(min_clusters, round(n_clusters*len(positions)/len(hexagon_list)))
+        _, group_representatives = get_clusters(features[positions], group_clusters)
+        representatives[state] = positions[group_representatives]
+    solved = dict(optimize_hexagons([hexagon_list[position] for positions in representatives.values()
+                                     for position in positions], settings, processes))
+
+    predicted = {}
+    unsure = []
+    for state, positions in groups.items():
+        others = np.setdiff1d(positions, representatives[state])
+        if len(others) == 0:
+            continue
+        outputs = np.array([_flatten_results(solved[hexagon_list[position]['index']], generators)
+                            for position in representatives[state]], dtype=float)
+        surrogate = fit_surrogate(features[representatives[state]], outputs)
+        # Outputs that some representatives have but that could not be fitted
+        if any(coefficients is None and np.isfinite(outputs[:, column]).any()
+               for column, coefficients in enumerate(surrogate['coefficients'])):
+            unsure.extend(others)
+            continue
+        predictions, deviations, extrapolated = predict_surrogate(surrogate, features[others])
+        lc_columns = [0, outputs.shape[1]//2]
+        for row, position in enumerate(others):
+            if any(extrapolated[row, column] or deviations[row, column] > tolerance*abs(predictions[row, column])
+                   for column in lc_columns if np.isfinite(predictions[row, column])):
+                unsure.append(position)
+            else:
+                predicted[hexagon_list[position]['index']] = _unflatten_results(predictions[row], generators)
+    solved.update(optimize_hexagons([hexagon_list[position] for position in unsure], settings, processes))
+    print(f"\nSolved {len(solved)} hexagons and predicted {len(predicted)} with the surrogate.")
+
+    results = []
+    methods = {}
+    for hexagon in hexagon_list:
+        i = hexagon['index']
+        if i in solved:
+            results.append((i, solved[i]))
+            methods[i] = "solved"
+        else:
+            results.append((i, predicted[i]))
+            methods[i] = "surrogate"
+    return results, methods
+
+def get_profile_key(hexagon):
+    '''
+    Gets a fingerprint of the weather profiles and trucking state of a hexagon.
+
+    Hexagons in the same weather cell get the same fingerprint, so their plants
+    only differ in the maximum capacities of the generators.
+    '''
+    digest = hashlib.sha256()
+    digest.update(str(hexagon['trucking_state']).encode())
+    for gen, potential in hexagon['potentials'].items():
+        digest.update(gen.encode())
+        digest.update(np.ascontiguousarray(potential, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+def _fits_capacities(results, max_capacities, tolerance=1e-6):
+    '''
+    Checks that the generator capacities of both transports are within the maximum capacities.
+    '''
+    return all(not capacity > max_capacities[gen]*(1 + tolerance) + tolerance
+               for transport in ("trucking", "pipeline")
+               for gen, capacity in results[transport][1].items())
+
+def optimize_hexagons_by_profile(hexagon_list, settings, processes):
+    '''
+    Optimises hexagons with the same weather profiles once, without their land limits.
+
+    Hexagons are grouped by get_profile_key. The plants of each group of several
+    hexagons are solved once with unlimited generator capacities, and that solution
+    is optimal for every hexagon of the group whose maximum capacities it fits within.
+    Only the hexagons whose limits are binding are solved on their own.
+
+    Parameters
+    ----------
+    hexagon_list : list
+        hexagon dictionaries as taken by optimize_hexagon.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    processes : int
+        number of worker processes.
+
+    Returns
+    -------
+    results : list
+        (index, results) tuples as returned by optimize_hexagon, in the order of hexagon_list.
+    methods : dictionary
+        "solved" or "shared" for each hexagon index.
+    '''
+    groups = {}
+    for hexagon in hexagon_list:
+        groups.setdefault(get_profile_key(hexagon), []).append(hexagon)
+
+    # Solve one relaxed plant per group of several hexagons and every other hexagon
+    # together to keep every process busy. Both transports of a relaxed plant are
+    # solved, since its members are compared with them one by one.
+    relaxed_settings = dict(settings, prune_transport=False)
+    relaxed = {}
+    singles = []
+    for key, group in groups.items():
+        if len(group) == 1:
+            singles.append(group[0])
+        else:
+            relaxed[key] = {'index' : group[0]['index'],
+                            'trucking_state' : group[0]['trucking_state'],
+                            'potentials' : group[0]['potentials'],
+                            'max_capacities' : {gen: np.inf for gen in group[0]['max_capacities']}}
+    relaxed_solved = dict(optimize_hexagons(list(relaxed.values()), relaxed_settings, processes))
+    relaxed_results = {key: relaxed_solved[hexagon['index']] for key, hexagon in relaxed.items()}
+    solved = dict(optimize_hexagons(singles, settings, processes))
+
+    shared = {}
+    binding = []
+    for key, results in relaxed_results.items():
+        for hexagon in groups[key]:
+            if _fits_capacities(results, hexagon['max_capacities']):
+                shared[hexagon['index']] = {"trucking" : results["trucking"],
+                                            "pipeline" : results["pipeline"],
+                                            "lc_errors" : []}
+            else:
+                binding.append(hexagon)
+    solved.update(optimize_hexagons(binding, settings, processes))
+    print(f"\nSolved {len(relaxed) + len(solved)} plants for {len(hexagon_list)} hexagons "
+          f"with {len(groups)} different weather profiles.")
+
+    results = []
+    methods = {}
+    for hexagon in hexagon_list:
+        i = hexagon['index']
+        if i in solved:
+            results.append((i, solved[i]))
+            methods[i] = "solved"
+        else:
+            results.append((i, shared[i]))
+            methods[i] = "shared"
+    return results, methods
+
+def get_total_cost_bound(hexagon, settings):
+    '''
+    Gets a lower bound on the lowest total cost of a hexagon without solving its plants.
+
+    Parameters
+    ----------
+    hexagon : dictionary
+        hexagon dictionary as taken by optimize_hexagon, with "transport_costs" and "water_cost".
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    bound : float
+        lower bound on the production, transport and water cost per kg, inf if no
+        transport is viable, or nan if a transport cost is missing.
+    '''
+    generators, demand_schedules, viable = get_hexagon_problem(hexagon, settings)
+    electricity_per_demand = get_electricity_per_demand(settings['plant_type'])
+    bounds = [Network(settings['plant_type'], generators).get_production_cost_bound(
+                  demand_schedules[transport], settings['country_series'], electricity_per_demand)
+              + hexagon['transport_costs'][transport]
+              for transport in ("trucking", "pipeline") if viable[transport]]
+    if len(bounds) == 0:
+        return np.inf
+    return min(bounds) + hexagon['water_cost']
+
+def get_total_cost(hexagon, results):
+    '''
+    Gets the lowest total cost of a solved hexagon, as calculated by total_costs.py.
+    '''
+    return np.nanmin([results[transport][0] + hexagon['transport_costs'][transport]
+                      for transport in ("trucking", "pipeline")]) + hexagon['water_cost']
+
+def optimize_hexagons_top_k(hexagon_list, settings, processes, top_k):
+    '''
+    Optimises hexagons in order of a lower bound on their total cost until the
+    cheapest hexagons are known.
+
+    Hexagons are solved in increasing order of get_total_cost_bound, and the search
+    stops once the k-th lowest solved total cost is at most the bound of the next
+    hexagon. The top_k cheapest hexagons are then exact, and the hexagons that were
+    not solved have nan results.
+
+    Parameters
+    ----------
+    hexagon_list : list
+        hexagon dictionaries as taken by get_total_cost_bound.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+    processes : int
+        number of worker processes.
+    top_k : int
+        number of cheapest hexagons to find.
+
+    Returns
+    -------
+    results : list
+        (index, results) tuples as returned by optimize_hexagon, in the order of hexagon_list.
+    methods : dictionary
+        "solved" or "bounded" for each hexagon index.
+    '''
+    generators = list(hexagon_list[0]['max_capacities'].keys())
+    bounds = np.array([get_total_cost_bound(hexagon, settings) for hexagon in hexagon_list])
+    # Hexagons without a bound can not be ruled out, so they are solved first
+    order = np.argsort(np.nan_to_num(bounds, nan=-np.inf), kind='stable')
+
+    solved = {}
+    total_costs = []
+    # Results arrive in bound order, and stopping closes the worker processes
+    ordered_settings = dict(settings, schedule='input')
+    for position, (i, results) in zip(order, optimize_hexagons([hexagon_list[position] for position in order],
+                                                                ordered_settings, processes)):
+        solved[i] = results
+        total_cost = get_total_cost(hexagon_list[position], results)
+        if np.isfinite(total_cost):
+            total_costs.append(total_cost)
+        remaining = order[len(solved):]
+        if len(remaining) == 0:
+            break
+        if len(total_costs) >= top_k and heapq.nsmallest(top_k, total_costs)[-1] <= bounds[remaining[0]]:
+            break
+    print(f"\nSolved {len(solved)} of {len(hexagon_list)} hexagons to find the {top_k} cheapest.")
+
+    results = []
+    methods = {}
+    for hexagon in hexagon_list:
+        i = hexagon['index']
+        if i in solved:
+            results.append((i, solved[i]))
+            methods[i] = "solved"
+        else:
+            results.append((i, {"trucking" : get_nan_results(generators),
+                                "pipeline" : get_nan_results(generators),
+                                "lc_errors" : []}))
+            methods[i] = "bounded"
+    return results, methods
 
 if __name__ == "__main__":
+    # Only the rule reads the cutout, so the functions above can be imported without atlite
+    import atlite
     # -- Next two lines to be deleted
     # warnings.filterwarnings("ignore")
     logging.basicConfig(level=logging.ERROR)
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+    # Time every stage of the rule and every plant solve, with the records under benchmarks/
+    benchmark_path = get_benchmark_path('optimize_plant', snakemake.wildcards) \
+        if snakemake.config['instrumentation'] else None
+    _instrumentation = Instrumentation(benchmark_path, reset=True)
+    start_inputs = time.perf_counter()
 
     transport_params_filepath = str(snakemake.input.transport_parameters)
     country_params_filepath = str(snakemake.input.country_parameters)
@@ -345,7 +1701,66 @@ if __name__ == "__main__":
     solver = str(snakemake.config['solver'])
     generators = dict(snakemake.config['generators_dict'])
     hexagons = gpd.read_file(str(snakemake.input.hexagons))
+    _instrumentation.add('read inputs', time.perf_counter() - start_inputs)
     pipeline_construction = True # snakemake config
+    # Split the threads of the rule, capped by snakemake at --cores, between hexagons
+    # solved in parallel, solver threads, BLAS threads and the dask workers of atlite
+    thread_budget = get_thread_budget(snakemake.threads,
+                                      str(snakemake.config['plant_optimization']['thread_policy']),
+                                      int(snakemake.config['plant_optimization']['solver_threads']))
+    apply_thread_budget(thread_budget, 'optimize_plant')
+    processes = thread_budget['processes']
+    # Hand the problem to the solver in memory where linopy supports it
+    io_api = str(snakemake.config['plant_optimization']['io_api'])
+    if io_api == 'direct' and solver not in ('highs', 'gurobi'):
+        print(f"\nThe direct solver interface is only available for HiGHS and Gurobi, using LP files for {solver}.")
+        io_api = 'lp'
+    # Screening mode: solve representative hexagons and predict the others
+    surrogate_clusters = int(snakemake.config['plant_optimization']['surrogate_clusters'])
+    surrogate_tolerance = float(snakemake.config['plant_optimization']['surrogate_tolerance'])
+    # Search mode: only solve hexagons until the cheapest ones per demand center are known
+    top_k = int(snakemake.config['plant_optimization']['top_k'])
+    # Solve hexagons of the same weather cell once where their land limits allow it
+    reuse_profiles = bool(snakemake.config['plant_optimization']['reuse_profiles'])
+    # Build and solve hydrogen plants as sparse matrices instead of through PyPSA
+    engine = str(snakemake.config['plant_optimization']['engine'])
+    if engine in ('sparse', 'benders', 'rolling') and str(snakemake.wildcards.plant_type) != 'hydrogen':
+        print(f"\nThe {engine} engine only covers hydrogen plants, using PyPSA.")
+        engine = 'pypsa'
+    # Decompose by weather year unless a number of periods is given
+    benders_periods = int(snakemake.config['plant_optimization']['benders_periods']) \
+        or int(snakemake.config['years_to_check'])
+
+    # Solves to try in turn after a plant fails: the same solver with relaxed options,
+    # then each fallback solver
+    solve_time_limit = float(snakemake.config['plant_optimization']['solve_time_limit'])
+    fallback_solves = []
+    if snakemake.config['plant_optimization']['relaxed_retry']:
+        fallback_solves.append((solver, get_relaxed_solver_options(solver, solve_time_limit)))
+    for fallback_solver in snakemake.config['plant_optimization']['fallback_solvers']:
+        fallback_solves.append((str(fallback_solver),
+                                get_solver_options(str(fallback_solver),
+                                                   thread_budget['solver_threads'],
+                                                   time_limit=solve_time_limit)))
+
+    # Keep every solved plant on disk so a killed run can be resumed. Settings that
+    # only change how fast plants are solved do not invalidate the checkpoint.
+    checkpoint = None
+    if snakemake.config['plant_optimization']['checkpoint']:
+        run_config = dict(snakemake.config)
+        run_config['plant_optimization'] = {key: value for key, value in
+                                            snakemake.config['plant_optimization'].items()
+                                            if key not in ('processes', 'persistent_model', 'order',
+                                                           'warm_start', 'solve_cache', 'solve_cache_path',
+                                                           'checkpoint', 'io_api', 'solver_threads',
+                                                           'engine_check', 'batch_size', 'benders_threads',
+                                                           'schedule', 'solve_time_history', 'solve_time_records',
+                                                           'thread_policy')}
+        run_config.pop('instrumentation', None)
+        run_config.pop('progress_interval', None)
+        run_config.pop('profiling', None)
+        checkpoint = Checkpoint(f'{snakemake.output}.checkpoint.jsonl',
+                                get_run_fingerprint(run_config, snakemake.wildcards, list(snakemake.input)))
 
     # Get a uniform capacity layout for all grid cells. https://atlite.readthedocs.io/en/master/ref_api.html
     # Alycia to double-check we are using the right layout
@@ -357,25 +1772,114 @@ if __name__ == "__main__":
     water_limit = bool(snakemake.config['water_limit'])
     freq = str(snakemake.config['freq'])
     
-    for gen in generators.keys():
-         profiles.append(get_generator_profile(gen, cutout, layout, hexagons, freq))
+    with _instrumentation.time('weather profiles'):
+        for gen in generators.keys():
+             profiles.append(get_generator_profile(gen, cutout, layout, hexagons, freq))
     
     times = profiles[0].time
     plant_type = str(snakemake.wildcards.plant_type)
 
+    # Worker processes exit without cleaning up, so the basis files of every process
+    # for warm starts go to one directory that this process removes
+    basis_dir = tempfile.TemporaryDirectory(prefix='geox_basis_') \
+        if snakemake.config['plant_optimization']['warm_start'] else None
+
+    settings = {
+        'plant_type' : plant_type,
+        'start_date' : start_date,
+        'end_date' : end_date,
+        'freq' : freq,
+        'times' : times,
+        'solver' : solver,
+        'country_series' : country_series,
+        'water_limit' : water_limit,
+        'pipeline_construction' : pipeline_construction,
+        'transport_params_filepath' : transport_params_filepath,
+        'len_hexagons' : len_hexagons,
+        'persistent_model' : bool(snakemake.config['plant_optimization']['persistent_model']),
+        'basis_dir' : basis_dir.name if basis_dir is not None else None,
+        'solve_cache_path' : str(snakemake.config['plant_optimization']['solve_cache_path'])
+                             if snakemake.config['plant_optimization']['solve_cache'] else None,
+        'solver_options' : get_solver_options(solver,
+                                              thread_budget['solver_threads'],
+                                              str(snakemake.config['plant_optimization']['solver_presolve']),
+                                              str(snakemake.config['plant_optimization']['solver_method']),
+                                              solve_time_limit),
+        'solve_time_limit' : solve_time_limit,
+        'fallback_solves' : fallback_solves,
+        'isolate_failures' : bool(snakemake.config['plant_optimization']['isolate_failures']),
+        'io_api' : io_api,
+        'segments' : int(snakemake.config['plant_optimization']['segments']),
+        'segments_check' : int(snakemake.config['plant_optimization']['segments_check']),
+        'engine' : engine,
+        'engine_check' : int(snakemake.config['plant_optimization']['engine_check']),
+        'batch_size' : int(snakemake.config['plant_optimization']['batch_size']),
+        'benders_periods' : benders_periods,
+        'benders_threads' : int(snakemake.config['plant_optimization']['benders_threads']),
+        'rolling_window' : int(snakemake.config['plant_optimization']['rolling_window']),
+        'rolling_overlap' : int(snakemake.config['plant_optimization']['rolling_overlap']),
+        'prune_transport' : bool(snakemake.config['plant_optimization']['prune_transport']),
+        'schedule' : str(snakemake.config['plant_optimization']['schedule']),
+        'solve_time_history' : str(snakemake.config['plant_optimization']['solve_time_history']),
+        'solve_time_records' : int(snakemake.config['plant_optimization']['solve_time_records']),
+        'benchmark_path' : benchmark_path,
+        'demand_center' : None,
+    }
+
+    # Visit hexagons along a space-filling curve so consecutive solves are similar
+    if str(snakemake.config['plant_optimization']['order']) == 'spatial':
+        hexagon_order = get_hilbert_order(hexagons)
+    else:
+        hexagon_order = range(len_hexagons)
+
+    # Get the potential and max capacity for each generation type in every hexagon
+    hexagon_list = []
+    for i in hexagon_order:
+        potentials = {}
+        max_capacities = {}
+        for gen_index, gen in enumerate(generators.keys()):
+            potentials[gen] = profiles[gen_index].sel(hexagon = i)
+            # -- Eventually make a for loop - we can change the theo_turbines name to be Wind
+            gen_capacity = int(snakemake.config['gen_capacity'][f'{gen.lower()}'])
+            if gen == "Wind":
+                # -- We'll need to remove this hard-coded 4 eventually CONFIG FILE - 4 MW turbine in spatial data prep
+                max_capacities[gen] = hexagons.loc[i,'theo_turbines']*gen_capacity
+            elif gen == "Solar":
+                max_capacities[gen] = hexagons.loc[i,'theo_pv']*gen_capacity
+            # -- Eventually move loops to something like this so we don't have ifs - max_capacity = hexagons.loc[i, gen] * SNAKEMAKE_CONFIG_GEN_SIZE
+        hexagon_list.append({'index' : i,
+                             'potentials' : potentials,
+                             'max_capacities' : max_capacities,
+                             'water_cost' : hexagons.loc[i, 'Lowest water cost']})
+
+    # Screen out hexagons that can never meet the demand before building any network
+    if snakemake.config['plant_optimization']['prescreen']:
+        prescreen = get_prescreen(hexagon_list, dict(zip(generators.keys(), profiles)),
+                                  demand_params['Annual demand [kg/a]'], plant_type, water_limit)
+    else:
+        prescreen = pd.DataFrame("feasible", index=[hexagon['index'] for hexagon in hexagon_list],
+                                 columns=demand_centers)
+
+    # Report progress over every hexagon of every demand center at most once per
+    # interval, and keep the latest counts in a status file for monitoring
+    progress = Progress("Plant optimisation", len(demand_centers)*len_hexagons,
+                        get_status_path('optimize_plant', snakemake.wildcards),
+                        snakemake.config['progress_interval'])
+
     # Loop through all demand centers -- limit this on continental scale
     for demand_center in demand_centers:
         print(f"\nOptimisation for {demand_center} begins...")
+        progress.labels = {'demand center' : demand_center}
         # Store trucking results
         trucking_lcs = np.zeros(len_hexagons)
-        t_generators_capacities = deepcopy(snakemake.config['generators_dict'])
+        t_generators_capacities = {gen: np.zeros(len_hexagons) for gen in generators.keys()}
         t_electrolyzer_capacities= np.zeros(len_hexagons)
         t_battery_capacities = np.zeros(len_hexagons)
         t_h2_storages= np.zeros(len_hexagons)
         
         # Store pipeline variables
         pipeline_lcs = np.zeros(len_hexagons)
-        p_generators_capacities = deepcopy(snakemake.config['generators_dict'])
+        p_generators_capacities = {gen: np.zeros(len_hexagons) for gen in generators.keys()}
         p_electrolyzer_capacities= np.zeros(len_hexagons)
         p_battery_capacities = np.zeros(len_hexagons)
         p_h2_storages= np.zeros(len_hexagons)
@@ -385,166 +1889,91 @@ if __name__ == "__main__":
             t_nh3_storages = np.zeros(len_hexagons)
             p_nh3_storages = np.zeros(len_hexagons)
 
-        annual_demand_quantity = demand_params.loc[demand_center,'Annual demand [kg/a]']
-
-        # Loop through all hexagons
-        for i in range(len_hexagons):
-            print(f"\nCurrently optimising {i+1} of {len(hexagons)} hexagons...")
-            trucking_state = hexagons.loc[i, f'{demand_center} trucking state']
-            gen_index = 0
-            generators = deepcopy(snakemake.config['generators_dict'])
-            
-            # Get the demand schedule for both pipeline and trucking transport
-            trucking_demand_schedule, pipeline_demand_schedule =\
-                get_demand_schedule(annual_demand_quantity,
-                                start_date,
-                                end_date,
-                                trucking_state,
-                                transport_params_filepath,
-                                freq)
-            
-            # Get the max capacity for each generation type
-            for gen in generators.keys():
-                if plant_type == "hydrogen":
-                    potential = profiles[gen_index].sel(hexagon = i)
-                elif plant_type == "ammonia":
-                    potential = profiles[gen_index].sel(hexagon=i, time=trucking_demand_schedule.index)
-                # -- Eventually make a for loop - we can change the theo_turbines name to be Wind
-                gen_capacity = int(snakemake.config['gen_capacity'][f'{gen.lower()}'])
-                if gen == "Wind":
-                    # -- We'll need to remove this hard-coded 4 eventually CONFIG FILE - 4 MW turbine in spatial data prep
-                    max_capacity = hexagons.loc[i,'theo_turbines']*gen_capacity
-                elif gen == "Solar":
-                    max_capacity = hexagons.loc[i,'theo_pv']*gen_capacity
-                # -- Eventually move loops to something like this so we don't have ifs - max_capacity = hexagons.loc[i, gen] * SNAKEMAKE_CONFIG_GEN_SIZE
-                
-                generators[gen].append(potential)
-                generators[gen].append(max_capacity)
-                gen_index += 1
-            
-            # For each transport type, set up the network and solve
-            transport_types = ["trucking", "pipeline"]
-            for transport in transport_types:
-                network = Network(plant_type, generators)
-                
-                # If trucking is viable
-                if transport == "trucking" and pd.isnull(trucking_state) == False:
-                    network.set_network(trucking_demand_schedule, times, country_series)
-                    
-                    # Check for water constraint before any solving occurs
-                    if water_limit != False:
-                        water_constraint = get_water_constraint(network, trucking_demand_schedule, water_limit)
-                        if water_constraint == False:
-                            print('Not enough water to meet demand!')
-                            trucking_lcs[i], generators_capacities, t_electrolyzer_capacities[i], t_battery_capacities[i], \
-                            t_h2_storages[i] = np.nan
-                            for gen, capacity in generators_capacities.items():
-                                t_generators_capacities[gen].append(np.nan)
-                            continue
-                    
-                    network.set_generators_in_network(country_series)
-                    start_ke=time.time()
-                    # print(network.n.stores)
-                    #network.n.remove("Store","Compressed H2 Store")
-                    solve_model(network, solver)
-
-                    if plant_type == "hydrogen":
-                        trucking_lcs[i], generators_capacities, \
-                        t_electrolyzer_capacities[i], t_battery_capacities[i], \
-                        t_h2_storages[i] = get_h2_results(network.n, generators)
-                    elif plant_type == "ammonia":
-                        trucking_lcs[i], generators_capacities, \
-                        t_electrolyzer_capacities[i], t_battery_capacities[i], \
-                        t_h2_storages[i], t_nh3_storages[i]  = get_nh3_results(network.n, generators)
-                    
-                    for gen, capacity in generators_capacities.items():
-                        t_generators_capacities[gen].append(capacity)
-                    print('Time Taken KE :',time.time()-start_ke)
-
-                # If the hexagon has no viable trucking state (i.e., no roads reach it), set everything to nan.
-                elif transport == "trucking" and pd.isnull(trucking_state) == True:
-                    trucking_lcs[i], generators_capacities, t_electrolyzer_capacities[i], t_battery_capacities[i], \
-                    t_h2_storages[i] = np.nan
-                    for gen, capacity in generators_capacities.items():
-                        t_generators_capacities[gen].append(np.nan)
-                    if plant_type == "ammonia":
-                        t_nh3_storages[1] = np.nan
-
-                # For pipeline, set it up with pipeline demand schedule if construction is true
-                else:
-                    if pipeline_construction == True:
-                        network.set_network(pipeline_demand_schedule, times, country_series)
-
-                        # Check for water constraint before any solving occurs
-                        if water_limit != False:
-                            water_constraint = get_water_constraint(network, pipeline_demand_schedule, water_limit)
-                            if water_constraint == False:
-                                print('Not enough water to meet demand!')
-                                pipeline_lcs[i], generators_capacities, p_electrolyzer_capacities[i], p_battery_capacities[i], \
-                                p_h2_storages[i] = np.nan
-                                for gen, capacity in generators_capacities.items():
-                                    p_generators_capacities[gen].append(np.nan)
-                                continue
-
-                        network.set_generators_in_network(country_series)
-                        start_ke=time.time()
-                        solve_model(network, solver)
-
-                        if plant_type == "hydrogen":
-                            pipeline_lcs[i], generators_capacities, \
-                            p_electrolyzer_capacities[i], p_battery_capacities[i], \
-                            p_h2_storages[i] = get_h2_results(network.n, generators)
-                        elif plant_type == "ammonia":
-                            pipeline_lcs[i], generators_capacities, \
-                            p_electrolyzer_capacities[i], p_battery_capacities[i], \
-                            p_h2_storages[i], p_nh3_storages[i] = get_nh3_results(network.n, generators)
-
-                        for gen, capacity in generators_capacities.items():
-                            p_generators_capacities[gen].append(capacity)
-                        print('Time Taken KE :',time.time()-start_ke)
-
-                    # If construction is false, you can't transport it
-                    # Everything gets nan UNLESS in the demand centre hexagon
-                    else:
-                        # -- Demand location has trucking state as None, this is an easy check
-                        if trucking_state == "None":
-                            network.set_network(pipeline_demand_schedule, times, country_series)
-
-                            # Check for water constraint before any solving occurs
-                            if water_limit != False:
-                                water_constraint = get_water_constraint(network, pipeline_demand_schedule, water_limit)
-                                if water_constraint == False:
-                                    print('Not enough water to meet demand!')
-                                    pipeline_lcs[i], generators_capacities, p_electrolyzer_capacities[i], p_battery_capacities[i], \
-                                    p_h2_storages[i] = np.nan
-                                    for gen, capacity in generators_capacities.items():
-                                        p_generators_capacities[gen].append(np.nan)
-                                    continue
-
-                            network.set_generators_in_network(country_series)
-                            start_ke=time.time()
-                            solve_model(network, solver)
-
-                            if plant_type == "hydrogen":
-                                pipeline_lcs[i], generators_capacities, \
-                                p_electrolyzer_capacities[i], p_battery_capacities[i], \
-                                p_h2_storages[i] = get_h2_results(network.n, generators)
-                            elif plant_type == "ammonia":
-                                pipeline_lcs[i], generators_capacities, \
-                                p_electrolyzer_capacities[i], p_battery_capacities[i], \
-                                p_h2_storages[i], p_nh3_storages[i] = get_nh3_results(network.n, generators)
-
-                            for gen, capacity in generators_capacities.items():
-                                p_generators_capacities[gen].append(capacity)
-                            print('Time Taken KE :',time.time()-start_ke)
-                        else:
-                            pipeline_lcs[i], p_electrolyzer_capacities[i], p_battery_capacities[i], p_h2_storages[i] = np.nan
-                            for gen in p_generators_capacities.keys():
-                                p_generators_capacities[gen].append(np.nan)
-                            if plant_type == "ammonia": 
-                                p_nh3_storages[1] = np.nan
+        settings['annual_demand_quantity'] = demand_params.loc[demand_center,'Annual demand [kg/a]']
+        settings['demand_center'] = demand_center
+        if plant_type == "hydrogen":
+            trucking_transport_costs = hexagons[f'{demand_center} trucking transport and conversion costs']
+            pipeline_transport_costs = hexagons[f'{demand_center} pipeline transport and conversion costs']
+        elif plant_type == "ammonia":
+            trucking_transport_costs = hexagons[f'{demand_center} trucking transport costs']
+            pipeline_transport_costs = hexagons[f'{demand_center} pipeline transport costs']
+        for hexagon in hexagon_list:
+            hexagon['trucking_state'] = hexagons.loc[hexagon['index'], f'{demand_center} trucking state']
+            hexagon['transport_costs'] = {
+                "trucking" : hexagons.loc[hexagon['index'], f'{demand_center} road construction costs']
+                             + trucking_transport_costs[hexagon['index']],
+                "pipeline" : pipeline_transport_costs[hexagon['index']]}
+            if checkpoint is not None:
+                hexagon['checkpoint'] = checkpoint.get(demand_center, hexagon['index'])
+
+        screening = prescreen[demand_center]
+        if snakemake.config['plant_optimization']['prescreen']:
+            hexagons[f'{demand_center} plant screening'] = screening
+        feasible_hexagons = [hexagon for hexagon in hexagon_list if screening[hexagon['index']] == "feasible"]
+        screened_results = [(i, {"trucking" : get_nan_results(generators),
+                                 "pipeline" : get_nan_results(generators),
+                                 "lc_errors" : []})
+                            for i in screening.index[screening != "feasible"]]
+        if len(screened_results) > 0:
+            print(f"\nScreened out {len(screened_results)} hexagons that cannot meet the demand: "
+                  f"{screening[screening != 'feasible'].value_counts().to_dict()}")
+
+        # Results are written by hexagon index, so the output does not depend on solving order
+        lc_errors = []
+        dominated_transports = pd.Series(None, index=hexagons.index, dtype=object)
+        plant_failures = pd.Series(None, index=hexagons.index, dtype=object)
+        if top_k > 0 and len(feasible_hexagons) > 0:
+            hexagon_results, methods = optimize_hexagons_top_k(feasible_hexagons, settings, processes, top_k)
+            hexagons[f'{demand_center} plant optimisation method'] = pd.Series(methods)
+        elif surrogate_clusters > 0 and len(feasible_hexagons) > 0:
+            hexagon_results, methods = optimize_hexagons_by_surrogate(feasible_hexagons, settings, processes,
+                                                                      surrogate_clusters, surrogate_tolerance)
+            hexagons[f'{demand_center} plant optimisation method'] = pd.Series(methods)
+        elif reuse_profiles and len(feasible_hexagons) > 0:
+            hexagon_results, methods = optimize_hexagons_by_profile(feasible_hexagons, settings, processes)
+            hexagons[f'{demand_center} plant optimisation method'] = pd.Series(methods)
+        else:
+            hexagon_results = optimize_hexagons(feasible_hexagons, settings, processes)
+            methods = None
+        for i, results in chain(hexagon_results, screened_results):
+            if checkpoint is not None and screening[i] == "feasible" and (methods is None or methods[i] in ("solved", "shared")):
+                for transport in ("trucking", "pipeline"):
+                    # A dominated transport is pruned again, and a failed one solved again, on resume
+                    if transport != results.get("dominated") and transport not in results.get("failures", {}):
+                        checkpoint.add(demand_center, i, transport, results[transport])
+            lc_errors.extend(results["lc_errors"])
+            dominated_transports[i] = results.get("dominated")
+            progress.update(failed=int(len(results.get("failures", {})) > 0))
+            if len(results.get("failures", {})) > 0:
+                plant_failures[i] = ", ".join(f"{transport}: {reason}"
+                                              for transport, reason in results["failures"].items())
+            trucking_lcs[i], generators_capacities, t_electrolyzer_capacities[i], \
+            t_battery_capacities[i], t_h2_storages[i], nh3_storage = results["trucking"]
+            for gen, capacity in generators_capacities.items():
+                t_generators_capacities[gen][i] = capacity
+            if plant_type == "ammonia":
+                t_nh3_storages[i] = nh3_storage
+
+            pipeline_lcs[i], generators_capacities, p_electrolyzer_capacities[i], \
+            p_battery_capacities[i], p_h2_storages[i], nh3_storage = results["pipeline"]
+            for gen, capacity in generators_capacities.items():
+                p_generators_capacities[gen][i] = capacity
+            if plant_type == "ammonia":
+                p_nh3_storages[i] = nh3_storage
         
         print("\nOptimisation complete.\n")        
+        for check in dict.fromkeys(check for check, _ in lc_errors):
+            errors = np.abs([error for error_check, error in lc_errors if error_check == check])
+            print(f"Levelized cost error of {check} "
+                  f"over {len(errors)} solves: mean {errors.mean():.2%}, max {errors.max():.2%}\n")
+        if settings['isolate_failures']:
+            hexagons[f'{demand_center} plant failures'] = plant_failures
+            if plant_failures.notna().any():
+                print(f"Recorded nan results for {plant_failures.notna().sum()} hexagons whose plants failed: "
+                      f"{plant_failures.value_counts().to_dict()}\n")
+        if settings['prune_transport']:
+            hexagons[f'{demand_center} dominated transport'] = dominated_transports
+            print(f"Pruned {dominated_transports.notna().sum()} dominated transport plants.\n")
         # Updating trucking-based results in hexagon file
         for gen, capacities in t_generators_capacities.items():
             hexagons[f'{demand_center} trucking {gen.lower()} capacity'] = capacities
@@ -565,5 +1994,13 @@ if __name__ == "__main__":
         if plant_type == "ammonia":  
             hexagons[f'{demand_center} pipeline NH3 storage capacity'] = p_nh3_storages
 
+    progress.finish()
+    if basis_dir is not None:
+        basis_dir.cleanup()
 
-    hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8')
\ No newline at end of file
+    _instrumentation.labels = {}
+    with _instrumentation.time('write output'):
+        hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8')
+    if checkpoint is not None:
+        checkpoint.remove()
+    _instrumentation.write_report()
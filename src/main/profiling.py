@@ -0,0 +1,180 @@
+import atexit
+import cProfile
+from collections import Counter
+import glob
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+# Seconds between stack samples of the 'sample' mode
+SAMPLE_INTERVAL = 0.01
+
+def get_profile_path(rule, wildcards):
+    '''
+    Gets the path of the profiles of a rule under profiles/.
+
+    Parameters
+    ----------
+    rule : string
+        name of the rule.
+    wildcards : dictionary
+        snakemake wildcards of the rule.
+
+    Returns
+    -------
+    path : string
+        path without extension, e.g. 'profiles/optimize_plant_IN_2023_hydrogen'.
+    '''
+    return os.path.join('profiles', '_'.join([rule] + [str(value) for value in dict(wildcards).values()]))
+
+def start_profiling(rule, wildcards, mode='off'):
+    '''
+    Profiles the rule script from here until its process exits.
+
+    'cprofile' records every function call in '<path>.prof', and 'sample' records
+    the stack of the main thread every SAMPLE_INTERVAL seconds in '<path>.folded',
+    the collapsed stack format of flame graph tools. Both track the peak memory
+    allocated by Python with tracemalloc and write it, with the largest allocation
+    sites still held at exit, to '<path>_memory.json'. Only the process of the rule
+    is profiled: worker processes it forks run without profiler.
+
+    Parameters
+    ----------
+    rule : string
+        name of the rule.
+    wildcards : dictionary
+        snakemake wildcards of the rule.
+    mode : string
+        'off', 'cprofile' or 'sample'. The PROFILING environment variable overrides
+        it. Default is 'off'.
+    '''
+    mode = os.environ.get('PROFILING', mode)
+    if mode == 'off':
+        return
+    if mode not in ('cprofile', 'sample'):
+        raise ValueError(f"Unknown profiling mode '{mode}', use 'off', 'cprofile' or 'sample'.")
+    path = get_profile_path(rule, wildcards)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tracemalloc.start()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = _StackSampler(threading.main_thread().ident)
+        profiler.start()
+    pid = os.getpid()
+
+    def stop_in_child():
+        # Profiling a forked worker would only slow it down, its records are never written
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        tracemalloc.stop()
+    os.register_at_fork(after_in_child=stop_in_child)
+
+    def write_profile():
+        if os.getpid() != pid:
+            return
+        if mode == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(f'{path}.prof')
+        else:
+            profiler.stop()
+            with open(f'{path}.folded', 'w', encoding='utf-8') as file:
+                for stack, count in profiler.samples.most_common():
+                    file.write(f'{stack} {count}\n')
+        _, peak = tracemalloc.get_traced_memory()
+        sites = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        tracemalloc.stop()
+        with open(f'{path}_memory.json', 'w', encoding='utf-8') as file:
+            json.dump({'rule' : rule,
+                       'peak MiB' : peak/2**20,
+                       'largest sites at exit' : [{'site' : str(site.traceback), 'MiB' : site.size/2**20}
+                                                  for site in sites]},
+                      file, indent=2)
+        print(f"\n{rule} profile written to {path}, peak Python memory {peak/2**20:.1f} MiB.")
+    atexit.register(write_profile)
+
+class _StackSampler(threading.Thread):
+    """
+    A thread that counts the collapsed stacks of another thread at a fixed interval.
+    """
+    def __init__(self, thread_id):
+        """
+
+        """
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def merge_profiles(folder='profiles', output='profiles/merged'):
+    '''
+    Merges the profiles of every rule in a folder into one report.
+
+    Collapsed stacks are summed into '<output>.folded' under a root frame named after
+    each profile, ready for flamegraph.pl or speedscope. cProfile files are added
+    into '<output>.prof' for pstats or snakeviz, and the peak memory of every rule
+    is listed in '<output>_memory.json'.
+
+    Parameters
+    ----------
+    folder : string
+        folder of the profiles. Default is 'profiles'.
+    output : string
+        path of the merged report without extension. Default is 'profiles/merged'.
+    '''
+    merged = os.path.basename(output)
+    stacks = Counter()
+    for path in sorted(glob.glob(os.path.join(glob.escape(folder), '*.folded'))):
+        name = os.path.basename(path)[:-len('.folded')]
+        if name == merged:
+            continue
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack != '':
+                    stacks[f'{name};{stack}'] += int(count)
+    if len(stacks) > 0:
+        with open(f'{output}.folded', 'w', encoding='utf-8') as file:
+            for stack, count in stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+    profiles = [path for path in sorted(glob.glob(os.path.join(glob.escape(folder), '*.prof')))
+                if os.path.basename(path) != f'{merged}.prof']
+    if len(profiles) > 0:
+        stats = pstats.Stats(*profiles)
+        stats.dump_stats(f'{output}.prof')
+        stats.sort_stats('cumulative').print_stats(20)
+
+    memory = {}
+    for path in sorted(glob.glob(os.path.join(glob.escape(folder), '*_memory.json'))):
+        name = os.path.basename(path)[:-len('_memory.json')]
+        if name != merged:
+            with open(path, encoding='utf-8') as file:
+                memory[name] = json.load(file)['peak MiB']
+    if len(memory) > 0:
+        with open(f'{output}_memory.json', 'w', encoding='utf-8') as file:
+            json.dump({'peak MiB' : memory}, file, indent=2)
+        for name, peak in sorted(memory.items(), key=lambda item: -item[1]):
+            print(f"{name}: peak Python memory {peak:.1f} MiB")
+
+if __name__ == "__main__":
+    # python src/main/profiling.py [folder] [output]
+    merge_profiles(*sys.argv[1:3])
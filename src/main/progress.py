@@ -0,0 +1,160 @@
+from datetime import datetime
+import json
+import os
+import time
+
+from instrumentation import get_benchmark_path
+
+class Progress:
+    """
+    A class representing the progress of a loop over hexagons.
+
+    Reports are rate-limited: a line with the counts, throughput and expected time
+    left is printed, and the status file rewritten, at most once every interval
+    seconds and when the loop finishes. The status file is replaced in one step,
+    so a monitor never reads half of it.
+
+    Attributes
+    ----------
+    description : string
+        what is being done, e.g. "Optimising plants".
+    total : int
+        number of items the loop will complete.
+    path : string or None
+        path of the JSON status file, or None to only print.
+    interval : float
+        least seconds between reports, 0 to report every update.
+    labels : dictionary
+        labels written to the status file, such as the current demand center.
+    completed : int
+        number of items completed so far, failed ones included.
+    failed : int
+        number of items that failed.
+    Methods
+    -------
+    update(completed, failed):
+        counts completed items and reports if the interval has passed.
+    finish():
+        reports the final counts.
+    get_status():
+        gets the counts, throughput and expected time left.
+    """
+    def __init__(self, description, total, path=None, interval=10):
+        """
+
+        """
+        self.description = description
+        self.total = total
+        self.path = path
+        self.interval = interval
+        self.labels = {}
+        self.completed = 0
+        self.failed = 0
+        self._start = time.perf_counter()
+        self._last_report = self._start
+        if path is not None:
+            self._write_status()
+
+    def update(self, completed=1, failed=0):
+        '''
+        Counts completed items and reports if the interval has passed.
+
+        Parameters
+        ----------
+        completed : int
+            number of items completed, failed ones included. Default is 1.
+        failed : int
+            number of those items that failed. Default is 0.
+        '''
+        self.completed += completed
+        self.failed += failed
+        if time.perf_counter() - self._last_report >= self.interval:
+            self._report()
+
+    def finish(self):
+        '''
+        Reports the final counts.
+        '''
+        self._report(finished=True)
+
+    def get_status(self, finished=False):
+        '''
+        Gets the counts, throughput and expected time left.
+
+        Parameters
+        ----------
+        finished : bool
+            whether the loop has finished. Default is False.
+
+        Returns
+        -------
+        status : dictionary
+            description, state, labels, completed, failed and total items, elapsed
+            seconds, throughput in items per second, expected seconds left (None
+            until an item is completed) and the time of the report.
+        '''
+        elapsed = time.perf_counter() - self._start
+        throughput = self.completed/elapsed if elapsed > 0 else 0.
+        eta = (self.total - self.completed)/throughput if throughput > 0 else None
+        return {'description' : self.description,
+                'state' : "finished" if finished else "running",
+                **self.labels,
+                'completed' : self.completed,
+                'failed' : self.failed,
+                'total' : self.total,
+                'elapsed seconds' : elapsed,
+                'throughput per second' : throughput,
+                'eta seconds' : 0. if finished else eta,
+                'updated' : datetime.now().isoformat(timespec='seconds')}
+
+    def _report(self, finished=False):
+        '''
+        Prints the status and rewrites the status file.
+        '''
+        self._last_report = time.perf_counter()
+        status = self.get_status(finished)
+        eta = "unknown" if status['eta seconds'] is None else _format_seconds(status['eta seconds'])
+        print(f"{self.description}: {self.completed} of {self.total} "
+              f"({self.completed/max(self.total, 1):.0%}), {self.failed} failed, "
+              f"{status['throughput per second']:.2f}/s, {_format_seconds(status['elapsed seconds'])} "
+              f"elapsed, {eta} left")
+        if self.path is not None:
+            self._write_status(status)
+
+    def _write_status(self, status=None):
+        '''
+        Replaces the status file.
+        '''
+        folder = os.path.dirname(self.path)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        temporary = f'{self.path}.{os.getpid()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.get_status() if status is None else status, file, indent=2)
+        os.replace(temporary, self.path)
+
+def _format_seconds(seconds):
+    '''
+    Formats seconds as hours, minutes and seconds.
+    '''
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+def get_status_path(rule, wildcards):
+    '''
+    Gets the path of the status file of a rule under benchmarks/.
+
+    Parameters
+    ----------
+    rule : string
+        name of the rule.
+    wildcards : dictionary
+        snakemake wildcards of the rule.
+
+    Returns
+    -------
+    path : string
+        path of the JSON status file, e.g. 'benchmarks/optimize_plant_IN_2023_hydrogen_status.json'.
+    '''
+    return f"{get_benchmark_path(rule, wildcards)}_status.json"
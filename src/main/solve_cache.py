@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+
+def results_to_list(results):
+    '''
+    Converts the results of a plant LP to a list that can be written as JSON.
+
+    Parameters
+    ----------
+    results : tuple
+        levelized cost, generator capacities, electrolyzer capacity, battery capacity,
+        hydrogen storage and ammonia storage.
+
+    Returns
+    -------
+    values : list
+        the results as floats, with the generator capacities as a dictionary.
+    '''
+    lc, generator_capacities, electrolyzer_capacity, battery_capacity, h2_storage, nh3_storage = results
+    return [float(lc), {gen: float(capacity) for gen, capacity in generator_capacities.items()},
+            float(electrolyzer_capacity), float(battery_capacity), float(h2_storage), float(nh3_storage)]
+
+def results_from_list(values):
+    '''
+    Converts results from results_to_list back to a tuple.
+    '''
+    return tuple(values)
+
+class SolveCache:
+    """
+    A class representing a persistent cache of plant optimisation results.
+
+    Results are stored in an SQLite file under a fingerprint of everything the plant
+    LP depends on, so a rerun only solves LPs whose inputs have changed and identical
+    LPs within a run are only solved once.
+
+    Attributes
+    ----------
+    path : string
+        path to the SQLite file.
+    connection :
+        SQLite connection, opened on first use. Default is None
+    results : dictionary
+        results already read or written by this process, keyed by fingerprint.
+    Methods
+    -------
+    get_key(plant_type, generators, demand_schedule, country_series, solver):
+        gets the fingerprint of a plant LP.
+    get(key):
+        gets the results stored under a fingerprint.
+    put(key, results):
+        stores the results of a plant LP.
+    """
+    def __init__(self, path):
+        """
+
+        """
+        self.path = path
+        self.connection = None
+        self.results = {}
+        self._plant_design_hashes = {}
+
+    def get_key(self, plant_type, generators, demand_schedule, country_series, solver):
+        '''
+        Gets the fingerprint of a plant LP.
+
+        Parameters
+        ----------
+        plant_type : string
+            type of plant, "hydrogen" or "ammonia".
+        generators : dictionary
+            contains generator types with their potential and maximum capacity.
+        demand_schedule : pandas DataFrame
+            demand profile for the transport type.
+        country_series: pandas Series
+            interest rate and lifetime information.
+        solver : dictionary
+            solver name, options and any other setting that changes the results.
+
+        Returns
+        -------
+        key : string
+            hexadecimal SHA-256 digest.
+        '''
+        digest = hashlib.sha256()
+        digest.update(plant_type.encode())
+        digest.update(self._get_plant_design_hash(plant_type).encode())
+        for gen, gen_list in generators.items():
+            digest.update(gen.encode())
+            digest.update(np.ascontiguousarray(gen_list[0], dtype=np.float64).tobytes())
+            digest.update(repr(float(gen_list[1])).encode())
+            digest.update(repr((float(country_series[f'{gen} interest rate']),
+                                float(country_series[f'{gen} lifetime (years)']))).encode())
+        digest.update(repr((float(country_series['Plant interest rate']),
+                            float(country_series['Plant lifetime (years)']))).encode())
+        digest.update(np.ascontiguousarray(demand_schedule.index.asi8).tobytes())
+        digest.update(np.ascontiguousarray(demand_schedule['Demand'], dtype=np.float64).tobytes())
+        digest.update(json.dumps(solver, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        '''
+        Gets the results stored under a fingerprint.
+
+        Parameters
+        ----------
+        key : string
+            fingerprint from get_key.
+
+        Returns
+        -------
+        results : tuple or None
+            results as stored by put, or None if the LP has not been solved before.
+        '''
+        if key not in self.results:
+            row = self._get_connection().execute(
+                'SELECT results FROM plant_results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.results[key] = results_from_list(json.loads(row[0]))
+        return self.results[key]
+
+    def put(self, key, results):
+        '''
+        Stores the results of a plant LP.
+
+        Parameters
+        ----------
+        key : string
+            fingerprint from get_key.
+        results : tuple
+            levelized cost, generator capacities, electrolyzer capacity, battery capacity,
+            hydrogen storage and ammonia storage.
+        '''
+        self.results[key] = results
+        connection = self._get_connection()
+        with connection:
+            connection.execute('INSERT OR REPLACE INTO plant_results (key, results) VALUES (?, ?)',
+                               (key, json.dumps(results_to_list(results))))
+
+    def _get_connection(self):
+        '''
+        Opens the SQLite file on first use, creating it if needed.
+        '''
+        if self.connection is None:
+            folder = os.path.dirname(self.path)
+            if folder != '':
+                os.makedirs(folder, exist_ok=True)
+            # Several worker processes and rules may share the file
+            self.connection = sqlite3.connect(self.path, timeout=600)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS plant_results '
+                                    '(key TEXT PRIMARY KEY, results TEXT NOT NULL)')
+            self.connection.commit()
+        return self.connection
+
+    def _get_plant_design_hash(self, plant_type):
+        '''
+        Gets the hash of the csv files describing the plant design.
+        '''
+        if plant_type not in self._plant_design_hashes:
+            folder = "parameters/basic_h2_plant" if plant_type == "hydrogen" else "parameters/basic_nh3_plant"
+            digest = hashlib.sha256()
+            for filename in sorted(os.listdir(folder)):
+                digest.update(filename.encode())
+                with open(os.path.join(folder, filename), 'rb') as file:
+                    digest.update(file.read())
+            self._plant_design_hashes[plant_type] = digest.hexdigest()
+        return self._plant_design_hashes[plant_type]
@@ -0,0 +1,182 @@
+from collections import deque
+import json
+import os
+import numpy as np
+import pandas as pd
+
+def get_solve_time_features(hexagon, settings):
+    '''
+    Gets the features of a hexagon that the time to solve its plants depends on.
+
+    Parameters
+    ----------
+    hexagon : dictionary
+        hexagon dictionary as taken by optimize_hexagon.
+    settings : dictionary
+        run-wide settings, see optimize_hexagon.
+
+    Returns
+    -------
+    kind : string
+        plant type, engine, time resolution and segments, as solve times of
+        different kinds are not comparable.
+    features : list
+        constant, number of viable transports, whether trucking has sparse
+        deliveries, and the log of the maximum capacity of each generator.
+    '''
+    trucking_state = hexagon['trucking_state']
+    trucking = pd.isnull(trucking_state) == False
+    pipeline = settings['pipeline_construction'] == True or trucking_state == "None"
+    kind = f"{settings['plant_type']}/{settings['engine']}/{settings['freq']}/{settings['segments']}"
+    features = [1., float(trucking) + float(pipeline), float(trucking and trucking_state != "None")]
+    features += [float(np.log1p(min(capacity, 1e9))) for capacity in hexagon['max_capacities'].values()]
+    return kind, features
+
+class SolveTimes:
+    """
+    A class representing a history of plant optimisation solve times.
+
+    Timed solves are appended to a JSON lines file in batches, and a log-linear
+    model fitted on the solves of the same kind estimates how long a new hexagon
+    will take. Until there are enough solves, longer times are expected for more
+    viable transports and for trucking with sparse deliveries. Only the most recent
+    solves of each kind are kept, and the file is rewritten with them once it has
+    grown to twice their number.
+
+    Attributes
+    ----------
+    path : string
+        path to the JSON lines file.
+    max_records : int
+        most recent solves of each kind that are kept.
+    buffer_size : int
+        solves held in memory before they are appended to the file.
+    records : dictionary
+        (features, seconds) of the kept solves, keyed by kind.
+    Methods
+    -------
+    add(kind, features, seconds):
+        adds the time of a solve to the history.
+    flush():
+        writes the solves added since the last flush to the file.
+    estimate(kind, features):
+        gets the expected time of a solve.
+    """
+    def __init__(self, path, max_records=1000, buffer_size=100):
+        """
+
+        """
+        self.path = path
+        self.max_records = max_records
+        self.buffer_size = buffer_size
+        self.records = {}
+        self._coefficients = {}
+        self._pending = []
+        self._lines = 0
+        self._read()
+
+    def add(self, kind, features, seconds):
+        '''
+        Adds the time of a solve to the history, and writes the solves added since
+        the last flush once there are buffer_size of them.
+
+        Parameters
+        ----------
+        kind : string
+            kind of solve from get_solve_time_features.
+        features : list
+            features of the hexagon from get_solve_time_features.
+        seconds : float
+            wall time of the solve.
+        '''
+        self._keep(kind, list(features), float(seconds))
+        self._coefficients.pop(kind, None)
+        self._pending.append({'kind' : kind, 'features' : list(features), 'seconds' : float(seconds)})
+        if len(self._pending) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Writes the solves added since the last flush to the file.
+        '''
+        if len(self._pending) == 0:
+            return
+        folder = os.path.dirname(self.path)
+        if folder != '':
+            os.makedirs(folder, exist_ok=True)
+        kept = sum(len(records) for records in self.records.values())
+        if self._lines + len(self._pending) > 2*max(kept, self.max_records):
+            # Roll the file over to the kept solves, replacing it in one step
+            temporary = f'{self.path}.{os.getpid()}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                for kind, records in self.records.items():
+                    for features, seconds in records:
+                        file.write(json.dumps({'kind' : kind, 'features' : features, 'seconds' : seconds}) + '\n')
+            os.replace(temporary, self.path)
+            self._lines = kept
+        else:
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.writelines(json.dumps(record) + '\n' for record in self._pending)
+            self._lines += len(self._pending)
+        self._pending = []
+
+    def estimate(self, kind, features):
+        '''
+        Gets the expected time of a solve.
+
+        Parameters
+        ----------
+        kind : string
+            kind of solve from get_solve_time_features.
+        features : list
+            features of the hexagon from get_solve_time_features.
+
+        Returns
+        -------
+        seconds : float
+            expected wall time, or a relative cost in arbitrary units while the
+            history has too few solves of this kind.
+        '''
+        coefficients = self._get_coefficients(kind, len(features))
+        if coefficients is None:
+            return features[1]*(1 + features[2])
+        return float(np.exp(np.dot(features, coefficients)))
+
+    def _get_coefficients(self, kind, n_features):
+        '''
+        Fits the log of the solve times on the features, once there are enough solves.
+        '''
+        if kind not in self._coefficients:
+            records = [(features, seconds) for features, seconds in self.records.get(kind, [])
+                       if len(features) == n_features]
+            coefficients = None
+            # Enough solves to fit every coefficient with some to spare
+            if len(records) >= 2*n_features:
+                features = np.array([features for features, _ in records])
+                seconds = np.array([seconds for _, seconds in records])
+                coefficients = np.linalg.lstsq(features, np.log(np.maximum(seconds, 1e-3)), rcond=None)[0]
+            self._coefficients[kind] = coefficients
+        return self._coefficients[kind]
+
+    def _read(self):
+        '''
+        Reads the solves of earlier runs.
+        '''
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A run was killed while writing this line
+                    continue
+                self._lines += 1
+                self._keep(record['kind'], record['features'], record['seconds'])
+
+    def _keep(self, kind, features, seconds):
+        '''
+        Adds a solve to the kept solves of its kind, dropping the oldest beyond max_records.
+        '''
+        records = self.records.setdefault(kind, deque(maxlen=self.max_records))
+        records.append((features, seconds))
@@ -0,0 +1,689 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from scipy.optimize import linprog
+from pypsa.descriptors import get_switchable_as_dense
+
+class SparseLP:
+    """
+    A class representing a linear programme assembled directly as sparse matrices.
+
+    Attributes
+    ----------
+    lower : list
+        lower bounds of the variable blocks.
+    upper : list
+        upper bounds of the variable blocks.
+    cost : list
+        objective coefficients of the variable blocks.
+    n_variables : int
+        number of variables added so far.
+    Methods
+    -------
+    add_variables(lower, upper, cost):
+        adds a block of variables.
+    add_constraints(terms, sense, rhs):
+        adds a block of constraints.
+    set_bounds(labels, lower, upper):
+        changes the bounds of variables already added.
+    set_cost(labels, cost):
+        changes the objective coefficients of variables already added.
+    solve():
+        solves the programme with HiGHS through scipy.
+    """
+    def __init__(self):
+        """
+
+        """
+        self.lower = []
+        self.upper = []
+        self.cost = []
+        self.n_variables = 0
+        self._rows = {'<=' : ([], [], [], []), '==' : ([], [], [], [])}
+        self._n_rows = {'<=' : 0, '==' : 0}
+        self._problem = None
+
+    def add_variables(self, lower, upper, cost):
+        '''
+        Adds a block of variables.
+
+        Parameters
+        ----------
+        lower : numpy array
+            lower bounds, the shape of the array is the shape of the block.
+        upper : numpy array
+            upper bounds, broadcast to the shape of lower.
+        cost : numpy array
+            objective coefficients, broadcast to the shape of lower.
+
+        Returns
+        -------
+        labels : numpy array
+            column of each variable in the programme, in the shape of the block.
+        '''
+        self._problem = None
+        lower = np.asarray(lower, dtype=float)
+        labels = np.arange(self.n_variables, self.n_variables + lower.size).reshape(lower.shape)
+        self.n_variables += lower.size
+        self.lower.append(lower.ravel())
+        self.upper.append(np.broadcast_to(np.asarray(upper, dtype=float), lower.shape).ravel())
+        self.cost.append(np.broadcast_to(np.asarray(cost, dtype=float), lower.shape).ravel())
+        return labels
+
+    def add_constraints(self, terms, sense, rhs):
+        '''
+        Adds a block of constraints sum(coefficient * variable) sense rhs.
+
+        Parameters
+        ----------
+        terms : list
+            (coefficients, labels) pairs, broadcast to the shape of rhs. Labels of -1 are left out.
+        sense : string
+            '<=', '>=' or '=='.
+        rhs : numpy array
+            right-hand side, the shape of the array is the shape of the block.
+        '''
+        self._problem = None
+        rhs = np.asarray(rhs, dtype=float)
+        factor = 1.
+        if sense == '>=':
+            sense, factor = '<=', -1.
+        rows = np.arange(self._n_rows[sense], self._n_rows[sense] + rhs.size).reshape(rhs.shape)
+        self._n_rows[sense] += rhs.size
+        row_list, column_list, value_list, rhs_list = self._rows[sense]
+        for coefficients, labels in terms:
+            labels = np.broadcast_to(labels, rhs.shape)
+            coefficients = np.broadcast_to(np.asarray(coefficients, dtype=float), rhs.shape)
+            present = labels >= 0
+            row_list.append(rows[present])
+            column_list.append(labels[present])
+            value_list.append(factor*coefficients[present])
+        rhs_list.append(factor*rhs.ravel())
+
+    def set_bounds(self, labels, lower, upper):
+        '''
+        Changes the bounds of variables already added, without building the matrices again.
+
+        Parameters
+        ----------
+        labels : numpy array
+            columns of the variables.
+        lower : numpy array
+            new lower bounds.
+        upper : numpy array
+            new upper bounds.
+        '''
+        problem = self._get_problem()
+        problem['bounds'][labels, 0] = lower
+        problem['bounds'][labels, 1] = upper
+
+    def set_cost(self, labels, cost):
+        '''
+        Changes the objective coefficients of variables already added.
+
+        Parameters
+        ----------
+        labels : numpy array
+            columns of the variables.
+        cost : numpy array
+            new objective coefficients.
+        '''
+        self._get_problem()['c'][labels] = cost
+
+    def solve(self, time_limit=None):
+        '''
+        Solves the programme with HiGHS through scipy.
+
+        Parameters
+        ----------
+        time_limit : float
+            seconds after which the solve is stopped. Default is None, no limit.
+
+        Returns
+        -------
+        result : scipy OptimizeResult
+            solution, with the objective value as fun, the status as status and the
+            sensitivity of the objective to the variable bounds as lower.marginals
+            and upper.marginals.
+        '''
+        options = {} if time_limit is None else {'time_limit' : time_limit}
+        return linprog(**self._get_problem(), method='highs', options=options)
+
+    def _get_problem(self):
+        '''
+        Builds the matrices of the programme on first use.
+        '''
+        if self._problem is None:
+            problem = {'c' : np.concatenate(self.cost),
+                       'bounds' : np.column_stack([np.concatenate(self.lower), np.concatenate(self.upper)])}
+            for sense, name in (('<=', 'ub'), ('==', 'eq')):
+                row_list, column_list, value_list, rhs_list = self._rows[sense]
+                if self._n_rows[sense] == 0:
+                    problem[f'A_{name}'], problem[f'b_{name}'] = None, None
+                    continue
+                problem[f'A_{name}'] = sp.csr_matrix((np.concatenate(value_list),
+                                                      (np.concatenate(row_list), np.concatenate(column_list))),
+                                                     shape=(self._n_rows[sense], self.n_variables))
+                problem[f'b_{name}'] = np.concatenate(rhs_list)
+            self._problem = problem
+        return self._problem
+
+def _add_nominal(lp, df, attr):
+    '''
+    Adds the capacity variables of a component, fixed for components that are not extendable.
+    '''
+    extendable = df[f'{attr}_extendable'].to_numpy(dtype=bool)
+    nominal = df[attr].to_numpy(dtype=float)
+    lower = np.where(extendable, df[f'{attr}_min'].to_numpy(dtype=float), nominal)
+    upper = np.where(extendable, df[f'{attr}_max'].fillna(np.inf).to_numpy(dtype=float), nominal)
+    return lp.add_variables(lower, upper, np.where(extendable, df['capital_cost'].to_numpy(dtype=float), 0.))
+
+def _add_dispatch(lp, n, component, df, p_nom, weightings):
+    '''
+    Adds the dispatch variables of a generator or link limited by p_min_pu and p_max_pu.
+    '''
+    p_min_pu = get_switchable_as_dense(n, component, 'p_min_pu').to_numpy()
+    p_max_pu = get_switchable_as_dense(n, component, 'p_max_pu').to_numpy()
+    marginal_cost = get_switchable_as_dense(n, component, 'marginal_cost').to_numpy()
+    # A zero minimum is a bound, anything else needs a constraint
+    p = lp.add_variables(np.where(p_min_pu == 0, 0., -np.inf), np.inf, weightings[:, None]*marginal_cost)
+    lp.add_constraints([(1, p), (-p_max_pu, p_nom)], '<=', np.zeros(p.shape))
+    if (p_min_pu != 0).any():
+        lp.add_constraints([(1, np.where(p_min_pu == 0, -1, p)), (-p_min_pu, np.where(p_min_pu == 0, -1, p_nom))],
+                           '>=', np.zeros(p.shape))
+    return p
+
+def _previous(labels, cyclic):
+    '''
+    Gets the labels of the previous snapshot, the last for the first snapshot of cyclic
+    assets and -1 (left out) for the first snapshot of the others.
+    '''
+    previous = np.roll(labels, 1, axis=0)
+    previous[0] = np.where(cyclic, previous[0], -1)
+    return previous
+
+def _add_boundary_levels(lp, levels, standing, shortfall_cost):
+    '''
+    Adds the levels of storage assets before the first and after the last snapshot of a
+    block as variables, for the caller to fix. Energy above the level the first snapshot
+    needs can be dropped, and a shortfall from the final level is paid for at the
+    shortfall cost.
+
+    Returns the terms of the initial level in the balance of the storage levels, and
+    the labels of the initial levels, final levels and shortfalls.
+    '''
+    n_assets = levels.shape[1]
+    initial = lp.add_variables(np.zeros(n_assets), np.inf, 0.)
+    dropped = lp.add_variables(np.zeros(n_assets), np.inf, 0.)
+    final = lp.add_variables(np.zeros(n_assets), np.inf, 0.)
+    # Without a cost, the final levels must be reached
+    if shortfall_cost is None:
+        shortfall = lp.add_variables(np.zeros(n_assets), 0., 0.)
+    else:
+        shortfall = lp.add_variables(np.zeros(n_assets), np.inf, shortfall_cost)
+    lp.add_constraints([(1, levels[-1]), (1, shortfall), (-1, final)], '>=', np.zeros(n_assets))
+    initial_column = np.full(levels.shape, -1)
+    initial_column[0] = initial
+    dropped_column = np.full(levels.shape, -1)
+    dropped_column[0] = dropped
+    return [(standing, initial_column), (-standing, dropped_column)], initial, final, shortfall
+
+def add_network(lp, n, shedding_cost=None, boundary_levels=False):
+    '''
+    Adds the capacity expansion of a single-period PyPSA plant network to a programme
+    as one block of variables and constraints, formulated as in PyPSA's linopy optimisation.
+
+    Covers generators, links with up to three buses, stores, storage units without
+    inflow and loads. Extra constraints, ramp limits and unit commitment are not supported.
+
+    Parameters
+    ----------
+    lp : SparseLP
+        programme to add the network to.
+    n :
+        network with snapshots, weightings, loads and generator potentials set.
+    shedding_cost : float
+        cost of shedding a unit of load at any bus, so that the programme is feasible
+        whatever the capacities. Default is None for no load shedding.
+    boundary_levels : bool
+        whether the levels of stores and storage units before the first and after the
+        last snapshot are variables to be fixed by the caller, for blocks of consecutive
+        periods. Missing the final level costs the shedding cost. Default is False,
+        cyclic or from the initial level as in PyPSA.
+
+    Returns
+    -------
+    block : dictionary
+        variable range of the block, objective constant, labels of the capacity, load
+        shedding, storage level and operational variables, objective weightings of the
+        snapshots, and with boundary levels the labels of the initial levels, final
+        levels and shortfalls of the stores followed by the storage units.
+    '''
+    if n.links.get('ramp_limit_up', np.nan).notnull().any() or n.links.get('ramp_limit_down', np.nan).notnull().any():
+        raise NotImplementedError('The sparse plant LP does not support ramp limits.')
+    if (get_switchable_as_dense(n, 'StorageUnit', 'inflow') != 0).any().any():
+        raise NotImplementedError('The sparse plant LP does not support storage inflow.')
+
+    start = lp.n_variables
+    n_snapshots = len(n.snapshots)
+    objective_weightings = n.snapshot_weightings.objective.to_numpy()
+    store_weightings = n.snapshot_weightings.stores.to_numpy()
+    # Injections into each bus, (sign, labels, bus) per component port
+    injections = []
+
+    generators = n.generators
+    generator_p_nom = _add_nominal(lp, generators, 'p_nom')
+    generator_p = _add_dispatch(lp, n, 'Generator', generators, generator_p_nom, objective_weightings)
+    injections.append((generators.sign.to_numpy(dtype=float), generator_p, generators.bus.to_numpy()))
+
+    links = n.links
+    link_p_nom = _add_nominal(lp, links, 'p_nom')
+    link_p = _add_dispatch(lp, n, 'Link', links, link_p_nom, objective_weightings)
+    injections.append((-1., link_p, links.bus0.to_numpy()))
+    injections.append((get_switchable_as_dense(n, 'Link', 'efficiency').to_numpy(), link_p, links.bus1.to_numpy()))
+    for port in ('2', '3'):
+        if f'bus{port}' in links and (links[f'bus{port}'] != '').any():
+            efficiency = links[f'efficiency{port}'].fillna(1.).to_numpy(dtype=float)
+            injections.append((efficiency, link_p, links[f'bus{port}'].to_numpy()))
+
+    stores = n.stores
+    store_e_nom = _add_nominal(lp, stores, 'e_nom')
+    e_min_pu = get_switchable_as_dense(n, 'Store', 'e_min_pu').to_numpy()
+    e_max_pu = get_switchable_as_dense(n, 'Store', 'e_max_pu').to_numpy()
+    store_e = lp.add_variables(np.where(e_min_pu == 0, 0., -np.inf), np.inf, 0.)
+    store_p = lp.add_variables(np.full((n_snapshots, len(stores)), -np.inf), np.inf,
+                               objective_weightings[:, None]*get_switchable_as_dense(n, 'Store', 'marginal_cost').to_numpy())
+    lp.add_constraints([(1, store_e), (-e_max_pu, store_e_nom)], '<=', np.zeros(store_e.shape))
+    if (e_min_pu != 0).any():
+        lp.add_constraints([(1, np.where(e_min_pu == 0, -1, store_e)), (-e_min_pu, np.where(e_min_pu == 0, -1, store_e_nom))],
+                           '>=', np.zeros(store_e.shape))
+    cyclic = stores.e_cyclic.to_numpy(dtype=bool)
+    standing = (1 - get_switchable_as_dense(n, 'Store', 'standing_loss').to_numpy())**store_weightings[:, None]
+    rhs = np.zeros(store_e.shape)
+    terms = [(-1, store_e), (-store_weightings[:, None], store_p)]
+    if boundary_levels:
+        boundary_terms, store_initial, store_final, store_shortfall = \
+            _add_boundary_levels(lp, store_e, standing, shedding_cost)
+        terms += boundary_terms + [(standing, _previous(store_e, False))]
+    else:
+        rhs[0] = np.where(cyclic, 0., -stores.e_initial.to_numpy(dtype=float))
+        terms.append((standing, _previous(store_e, cyclic)))
+    lp.add_constraints(terms, '==', rhs)
+    injections.append((stores.sign.to_numpy(dtype=float), store_p, stores.bus.to_numpy()))
+
+    units = n.storage_units
+    unit_p_nom = _add_nominal(lp, units, 'p_nom')
+    weighted_cost = objective_weightings[:, None]*get_switchable_as_dense(n, 'StorageUnit', 'marginal_cost').to_numpy()
+    unit_dispatch = lp.add_variables(np.zeros((n_snapshots, len(units))), np.inf, weighted_cost)
+    unit_store = lp.add_variables(np.zeros((n_snapshots, len(units))), np.inf, 0.)
+    unit_soc = lp.add_variables(np.zeros((n_snapshots, len(units))), np.inf, 0.)
+    lp.add_constraints([(1, unit_dispatch), (-get_switchable_as_dense(n, 'StorageUnit', 'p_max_pu').to_numpy(), unit_p_nom)],
+                       '<=', np.zeros(unit_dispatch.shape))
+    lp.add_constraints([(1, unit_store), (get_switchable_as_dense(n, 'StorageUnit', 'p_min_pu').to_numpy(), unit_p_nom)],
+                       '<=', np.zeros(unit_store.shape))
+    lp.add_constraints([(1, unit_soc), (-units.max_hours.to_numpy(dtype=float), unit_p_nom)],
+                       '<=', np.zeros(unit_soc.shape))
+    cyclic = units.cyclic_state_of_charge.to_numpy(dtype=bool)
+    standing = (1 - get_switchable_as_dense(n, 'StorageUnit', 'standing_loss').to_numpy())**store_weightings[:, None]
+    rhs = np.zeros(unit_soc.shape)
+    terms = [(-1, unit_soc),
+             (-store_weightings[:, None]/get_switchable_as_dense(n, 'StorageUnit', 'efficiency_dispatch').to_numpy(),
+              unit_dispatch),
+             (store_weightings[:, None]*get_switchable_as_dense(n, 'StorageUnit', 'efficiency_store').to_numpy(),
+              unit_store)]
+    if boundary_levels:
+        boundary_terms, unit_initial, unit_final, unit_shortfall = \
+            _add_boundary_levels(lp, unit_soc, standing, shedding_cost)
+        terms += boundary_terms + [(standing, _previous(unit_soc, False))]
+    else:
+        rhs[0] = np.where(cyclic, 0., -units.state_of_charge_initial.to_numpy(dtype=float))
+        terms.append((standing, _previous(unit_soc, cyclic)))
+    lp.add_constraints(terms, '==', rhs)
+    injections.append((units.sign.to_numpy(dtype=float), unit_dispatch, units.bus.to_numpy()))
+    injections.append((-units.sign.to_numpy(dtype=float), unit_store, units.bus.to_numpy()))
+
+    # Nodal balance, one row per snapshot and bus
+    buses = n.buses.index
+    terms = []
+    for coefficients, labels, asset_buses in injections:
+        coefficients = np.broadcast_to(coefficients, labels.shape)
+        for bus_position, bus in enumerate(buses):
+            at_bus = asset_buses == bus
+            for asset in np.flatnonzero(at_bus):
+                column = np.full((n_snapshots, len(buses)), -1)
+                column[:, bus_position] = labels[:, asset]
+                terms.append((coefficients[:, asset][:, None], column))
+    shedding = None
+    if shedding_cost is not None:
+        shedding = lp.add_variables(np.zeros((n_snapshots, len(buses))), np.inf,
+                                    shedding_cost*objective_weightings[:, None])
+        terms.append((1, shedding))
+    load_p_set = get_switchable_as_dense(n, 'Load', 'p_set') * n.loads.sign
+    rhs = -load_p_set.T.groupby(n.loads.bus).sum().T.reindex(columns=buses, fill_value=0.).to_numpy()
+    lp.add_constraints(terms, '==', rhs)
+
+    operation = [generator_p, link_p, store_e, store_p, unit_dispatch, unit_store, unit_soc]
+    if shedding is not None:
+        operation.append(shedding)
+    block = {'start' : start,
+             'end' : lp.n_variables,
+             'constant' : _get_objective_constant(n),
+             'generators' : generator_p_nom,
+             'links' : link_p_nom,
+             'stores' : store_e_nom,
+             'storage_units' : unit_p_nom,
+             'shedding' : shedding,
+             'store_levels' : store_e,
+             'state_of_charge' : unit_soc,
+             'operation' : operation,
+             'weightings' : objective_weightings}
+    if boundary_levels:
+        block['initial_levels'] = np.concatenate([store_initial, unit_initial])
+        block['final_levels'] = np.concatenate([store_final, unit_final])
+        block['level_shortfall'] = np.concatenate([store_shortfall, unit_shortfall])
+    return block
+
+def _get_capacities(n):
+    '''
+    Gets the nominal capacity, capital cost and extendability of every asset, in the
+    order of the capacity variables of add_network.
+    '''
+    capacities = [(n.generators, 'p_nom'), (n.links, 'p_nom'), (n.stores, 'e_nom'), (n.storage_units, 'p_nom')]
+    nominal = np.concatenate([df[attr].to_numpy(dtype=float) for df, attr in capacities])
+    capital_cost = np.concatenate([df['capital_cost'].to_numpy(dtype=float) for df, _ in capacities])
+    extendable = np.concatenate([df[f'{attr}_extendable'].to_numpy(dtype=bool) for df, attr in capacities])
+    return nominal, capital_cost, extendable
+
+def _get_objective_constant(n):
+    '''
+    Gets the capital cost of capacity that already exists, which is not part of the objective, as in PyPSA.
+    '''
+    nominal, capital_cost, extendable = _get_capacities(n)
+    return (nominal*capital_cost)[extendable].sum()
+
+def _set_capacities(n, values):
+    '''
+    Writes optimal capacities, in the order of the capacity variables of add_network, to a network.
+    '''
+    sizes = np.cumsum([len(n.generators), len(n.links), len(n.stores)])
+    generator_values, link_values, store_values, unit_values = np.split(values, sizes)
+    n.generators['p_nom_opt'] = generator_values
+    n.links['p_nom_opt'] = link_values
+    n.stores['e_nom_opt'] = store_values
+    n.storage_units['p_nom_opt'] = unit_values
+
+def solve_sparse_lps(networks, time_limit=None):
+    '''
+    Solves the capacity expansion of several plant networks as one block-diagonal
+    programme, and writes the optimal capacities and objective back to each network.
+
+    Blocks share no variables or constraints, so each network gets the solution it
+    would get on its own, and its objective is the cost of its own variables. If the
+    stacked programme fails, the networks are solved one by one to find the failing ones.
+
+    Parameters
+    ----------
+    networks : list
+        networks with snapshots, weightings, loads and generator potentials set.
+    time_limit : float
+        seconds after which each solve is stopped. Default is None, no limit.
+
+    Returns
+    -------
+    errors : list
+        None for each network that was solved, and the error of each that failed.
+    '''
+    lp = SparseLP()
+    blocks = [add_network(lp, n) for n in networks]
+    result = lp.solve(time_limit)
+    if result.status != 0:
+        if len(networks) > 1:
+            return [solve_sparse_lps([n], time_limit)[0] for n in networks]
+        return [RuntimeError(f'Plant optimisation failed: {result.message}')]
+
+    cost = np.concatenate(lp.cost)
+    for n, block in zip(networks, blocks):
+        variables = slice(block['start'], block['end'])
+        n.objective = cost[variables] @ result.x[variables] - block['constant']
+        _set_capacities(n, result.x[np.concatenate([block['generators'], block['links'],
+                                                     block['stores'], block['storage_units']])])
+    return [None]*len(networks)
+
+def solve_sparse_lp(n):
+    '''
+    Solves the capacity expansion of a plant network without building a PyPSA model,
+    and writes the optimal capacities and objective back to the network.
+
+    Parameters
+    ----------
+    n :
+        network with snapshots, weightings, loads and generator potentials set.
+    '''
+    error = solve_sparse_lps([n])[0]
+    if error is not None:
+        raise error
+
+def solve_benders(n, n_periods, tolerance=1e-4, max_iterations=200, threads=1, shedding_cost=1e5,
+                  max_escalations=3):
+    '''
+    Solves the capacity expansion of a plant network by Benders decomposition, and writes
+    the optimal capacities and objective back to the network.
+
+    A master problem chooses the capacities, the levels of stores and storage units at
+    the boundaries between periods, and estimates the operating cost of each period from
+    the cuts found so far. Each period is an operational subproblem with the capacities
+    and its boundary levels fixed, and load or a final level it cannot meet is paid for
+    at the shedding cost, so every subproblem is feasible. The sensitivity of its cost to
+    the capacities and levels gives a new cut, until the lower bound of the master
+    problem and the best solution found are within the tolerance. The programme of a
+    period is built when it is solved and dropped afterwards, so only the cuts are kept
+    between rounds and at most one period per thread is in memory. Operating costs must
+    not be negative.
+
+    Parameters
+    ----------
+    n :
+        network with snapshots, weightings, loads and generator potentials set.
+    n_periods : int
+        number of consecutive periods of equal length the snapshots are split into.
+    tolerance : float
+        largest gap between the best solution and the lower bound, relative to the best solution.
+    max_iterations : int
+        largest number of master problems solved.
+    threads : int
+        number of subproblems solved at the same time.
+    shedding_cost : float
+        cost of shedding a unit of load or missing a unit of a final level. If either is
+        still needed once the decomposition has converged, it is solved again at 100
+        times the cost.
+    max_escalations : int
+        largest number of times the shedding cost is raised before the demand is taken
+        to be impossible to meet.
+    '''
+    periods = np.array_split(np.arange(len(n.snapshots)), n_periods)
+
+    def solve_subproblem(period, capacity_values, levels):
+        # Capacities and boundary levels are variables of the master problem and fixed in the subproblems
+        lp = SparseLP()
+        block = add_network(lp, n.copy(snapshots=n.snapshots[periods[period]]), shedding_cost=shedding_cost,
+                            boundary_levels=True)
+        capacities = np.concatenate([block['generators'], block['links'], block['stores'], block['storage_units']])
+        lp.set_cost(capacities, 0.)
+        lp.set_bounds(capacities, capacity_values, capacity_values)
+        lp.set_bounds(block['initial_levels'], levels[period], levels[period])
+        lp.set_bounds(block['final_levels'], levels[period + 1], levels[period + 1])
+        result = lp.solve()
+        if result.status != 0:
+            raise RuntimeError(f'Plant optimisation failed: {result.message}')
+        marginals = result.lower.marginals + result.upper.marginals
+        shed = result.x[block['shedding']].sum() + result.x[block['level_shortfall']].sum()
+        return result.fun, marginals[capacities], marginals[block['initial_levels']], \
+            marginals[block['final_levels']], shed
+
+    nominal, capital_cost, extendable = _get_capacities(n)
+    capacity_frames = ((n.generators, 'p_nom'), (n.links, 'p_nom'), (n.stores, 'e_nom'), (n.storage_units, 'p_nom'))
+    lower = np.where(extendable, np.concatenate([df[f'{attr}_min'].to_numpy(dtype=float)
+                                                 for df, attr in capacity_frames]), nominal)
+    upper = np.where(extendable, np.concatenate([df[f'{attr}_max'].fillna(np.inf).to_numpy(dtype=float)
+                                                 for df, attr in capacity_frames]), nominal)
+    capital_cost = np.where(extendable, capital_cost, 0.)
+    n_capacities = len(nominal)
+
+    # Master variables are the capacities, the operating cost of each period and the
+    # level of each store and storage unit at each period boundary, the first boundary
+    # being the start of the first period and the last the end of the last period
+    n_stores = len(n.stores)
+    n_levels = n_stores + len(n.storage_units)
+    n_variables = n_capacities + n_periods + (n_periods + 1)*n_levels
+    level_columns = n_capacities + n_periods + np.arange((n_periods + 1)*n_levels).reshape(n_periods + 1, n_levels)
+    master_cost = np.concatenate([capital_cost, np.ones(n_periods), np.zeros((n_periods + 1)*n_levels)])
+    level_lower = np.zeros((n_periods + 1, n_levels))
+    level_upper = np.full((n_periods + 1, n_levels), np.inf)
+    # Cyclic assets end the last period at the level they start the first with, the others
+    # start from their initial level and may end at any level
+    cyclic = np.concatenate([n.stores.e_cyclic.to_numpy(dtype=bool),
+                             n.storage_units.cyclic_state_of_charge.to_numpy(dtype=bool)])
+    initial = np.concatenate([n.stores.e_initial.to_numpy(dtype=float),
+                              n.storage_units.state_of_charge_initial.to_numpy(dtype=float)])
+    level_lower[0] = np.where(cyclic, 0., initial)
+    level_upper[0] = np.where(cyclic, np.inf, initial)
+    level_upper[-1] = np.where(cyclic, np.inf, 0.)
+    master_bounds = np.column_stack([np.concatenate([lower, np.zeros(n_periods), level_lower.ravel()]),
+                                     np.concatenate([upper, np.full(n_periods, np.inf), level_upper.ravel()])])
+    master_eq = np.zeros((cyclic.sum(), n_variables))
+    master_eq[np.arange(cyclic.sum()), level_columns[-1, cyclic]] = 1
+    master_eq[np.arange(cyclic.sum()), level_columns[0, cyclic]] = -1
+    # Levels are within the energy capacity at the snapshot before each boundary
+    boundary_snapshots = np.array([period[0] - 1 for period in periods] + [len(n.snapshots) - 1])
+    level_limits = np.concatenate([get_switchable_as_dense(n, 'Store', 'e_max_pu').to_numpy()[boundary_snapshots],
+                                   np.broadcast_to(n.storage_units.max_hours.to_numpy(dtype=float),
+                                                   (n_periods + 1, len(n.storage_units)))], axis=1)
+    level_capacities = n_capacities - n_levels + np.arange(n_levels)
+    level_rows = np.zeros(((n_periods + 1)*n_levels, n_variables))
+    level_rows[np.arange(level_rows.shape[0]), level_columns.ravel()] = 1
+    level_rows[np.arange(level_rows.shape[0]), np.tile(level_capacities, n_periods + 1)] = -level_limits.ravel()
+    total_load = n.loads_t.p_set.abs().to_numpy().sum()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for _ in range(max_escalations + 1):
+            cuts = [*level_rows]
+            cut_rhs = [0.]*len(level_rows)
+            best_cost = np.inf
+            for _ in range(max_iterations):
+                master = linprog(master_cost, A_ub=np.array(cuts), b_ub=np.array(cut_rhs),
+                                 A_eq=master_eq if cyclic.any() else None, b_eq=np.zeros(cyclic.sum()) if cyclic.any() else None,
+                                 bounds=master_bounds, method='highs')
+                if master.status != 0:
+                    raise RuntimeError(f'Plant optimisation failed: {master.message}')
+                # Round-off below a lower bound of zero would make the subproblems infeasible
+                capacity_values = np.clip(master.x[:n_capacities], lower, upper)
+                levels = np.clip(master.x[level_columns], level_lower, level_upper)
+                results = list(executor.map(lambda period: solve_subproblem(period, capacity_values, levels),
+                                            range(n_periods)))
+                cost = capital_cost @ capacity_values + sum(result[0] for result in results)
+                if cost < best_cost:
+                    best_cost, best_capacities, best_shed = cost, capacity_values, sum(result[-1] for result in results)
+                if best_cost - master.fun <= tolerance*abs(best_cost):
+                    break
+                # theta_k >= f_k + marginals_k (x - x_k), one cut per period
+                for period, (fun, marginals, initial_marginals, final_marginals, _) in enumerate(results):
+                    cut = np.zeros(n_variables)
+                    cut[:n_capacities] = marginals
+                    cut[n_capacities + period] = -1
+                    cut[level_columns[period]] += initial_marginals
+                    cut[level_columns[period + 1]] += final_marginals
+                    cuts.append(cut)
+                    cut_rhs.append(marginals @ capacity_values + initial_marginals @ levels[period]
+                                   + final_marginals @ levels[period + 1] - fun)
+            else:
+                print(f"Benders decomposition stopped after {max_iterations} iterations with a gap of "
+                      f"{(best_cost - master.fun)/abs(best_cost):.2%}.")
+
+            # Shedding load was cheaper than building capacity, so start again at a higher cost
+            if best_shed <= 1e-6*total_load:
+                break
+            shedding_cost *= 100
+        else:
+            raise RuntimeError('Plant optimisation failed: the demand cannot be met within the maximum capacities.')
+
+    n.objective = best_cost - _get_objective_constant(n)
+    _set_capacities(n, best_capacities)
+
+def solve_rolling_horizon(n, window, overlap=0):
+    '''
+    Solves the capacity expansion of a plant network over consecutive windows of
+    snapshots, and writes the capacities and objective back to the network.
+
+    Each window is solved with the capacities of the earlier windows as lower bounds
+    and the capital costs scaled to the share of the snapshot weightings it covers.
+    Only the snapshots before the overlap with the next window are kept, and the
+    storage levels at the end of them are the initial levels of the next window, so
+    only one window is in memory at a time. Cyclic storage starts the first window at
+    the level it ends that window with, and must end every later window at least at
+    that level. The capacities of the last window meet the demand of every window, so the result is a feasible design that costs at least as much as
+    the design of a single LP over all snapshots.
+
+    Parameters
+    ----------
+    n :
+        network with snapshots, weightings, loads and generator potentials set.
+    window : int
+        number of snapshots in each window.
+    overlap : int
+        number of snapshots at the end of each window that are solved again at the
+        start of the next window. Default is 0
+    '''
+    if not 0 <= overlap < window:
+        raise ValueError('The overlap of the rolling horizon must be shorter than its window.')
+    total_weighting = n.snapshot_weightings.objective.sum()
+    store_cyclic = n.stores.e_cyclic.to_numpy(dtype=bool)
+    unit_cyclic = n.storage_units.cyclic_state_of_charge.to_numpy(dtype=bool)
+    capacities = None
+    operating_cost = 0.
+    for start in range(0, len(n.snapshots), window - overlap):
+        window_n = n.copy(snapshots=n.snapshots[start:start + window])
+        last = start + window >= len(n.snapshots)
+        kept = len(window_n.snapshots) if last else window - overlap
+        share = window_n.snapshot_weightings.objective.sum()/total_weighting
+        components = ((window_n.generators, 'p_nom'), (window_n.links, 'p_nom'),
+                      (window_n.stores, 'e_nom'), (window_n.storage_units, 'p_nom'))
+        if capacities is not None:
+            sizes = np.cumsum([len(df) for df, _ in components[:-1]])
+            for (df, attr), values in zip(components, np.split(capacities, sizes)):
+                df[f'{attr}_min'] = np.maximum(df[f'{attr}_min'], values)
+        for df, _ in components:
+            df['capital_cost'] *= share
+        # Cyclic assets start the first window at a free level and end every later window
+        # at least at that level, so no window drains them, and all assets carry their
+        # level over between windows
+        if start > 0:
+            window_n.stores['e_cyclic'] = False
+            window_n.stores['e_initial'] = store_levels
+            window_n.storage_units['cyclic_state_of_charge'] = False
+            window_n.storage_units['state_of_charge_initial'] = states_of_charge
+
+        lp = SparseLP()
+        block = add_network(lp, window_n)
+        if start > 0:
+            lp.add_constraints([(1, np.where(store_cyclic, block['store_levels'][-1], -1))],
+                               '>=', np.where(store_cyclic, initial_store_levels, 0.))
+            lp.add_constraints([(1, np.where(unit_cyclic, block['state_of_charge'][-1], -1))],
+                               '>=', np.where(unit_cyclic, initial_states_of_charge, 0.))
+        result = lp.solve()
+        if result.status != 0:
+            raise RuntimeError(f'Plant optimisation failed: {result.message}')
+        capacities = result.x[np.concatenate([block['generators'], block['links'],
+                                              block['stores'], block['storage_units']])]
+        cost = np.concatenate(lp.cost)
+        for labels in block['operation']:
+            operating_cost += (cost[labels[:kept]]*result.x[labels[:kept]]).sum()
+        store_levels = result.x[block['store_levels'][kept - 1]]
+        states_of_charge = result.x[block['state_of_charge'][kept - 1]]
+        if start == 0:
+            initial_store_levels = result.x[block['store_levels'][-1]]
+            initial_states_of_charge = result.x[block['state_of_charge'][-1]]
+        if last:
+            break
+
+    _, capital_cost, extendable = _get_capacities(n)
+    n.objective = (capital_cost*capacities)[extendable].sum() + operating_cost - _get_objective_constant(n)
+    _set_capacities(n, capacities)
@@ -0,0 +1,140 @@
+import numpy as np
+
+def get_clusters(features, n_clusters, seed=0, max_iterations=100):
+    '''
+    Clusters points with k-means and picks the point closest to each cluster centre.
+
+    Parameters
+    ----------
+    features : numpy array
+        one row per point and one column per standardised feature.
+    n_clusters : int
+        number of clusters.
+    seed : int
+        seed of the k-means++ initialisation.
+    max_iterations : int
+        maximum number of k-means iterations.
+
+    Returns
+    -------
+    labels : numpy array
+        cluster of each point.
+    representatives : numpy array
+        position of the representative point of each cluster.
+    '''
+    n_points = len(features)
+    if n_clusters >= n_points:
+        return np.arange(n_points), np.arange(n_points)
+    rng = np.random.default_rng(seed)
+
+    # k-means++ initialisation, spreading the starting centres out
+    centres = [features[rng.integers(n_points)]]
+    distances = ((features - centres[0])**2).sum(axis=1)
+    for _ in range(1, n_clusters):
+        if distances.sum() > 0:
+            centre = features[rng.choice(n_points, p=distances/distances.sum())]
+        else:
+            centre = features[rng.integers(n_points)]
+        centres.append(centre)
+        distances = np.minimum(distances, ((features - centre)**2).sum(axis=1))
+    centres = np.array(centres)
+
+    labels = np.full(n_points, -1)
+    for _ in range(max_iterations):
+        squared_distances = ((features[:, None, :] - centres[None, :, :])**2).sum(axis=2)
+        new_labels = squared_distances.argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(n_clusters):
+            members = labels == cluster
+            if members.any():
+                centres[cluster] = features[members].mean(axis=0)
+            else:
+                # Restart an empty cluster at the point furthest from its centre
+                furthest = squared_distances[np.arange(n_points), labels].argmax()
+                centres[cluster] = features[furthest]
+                labels[furthest] = cluster
+
+    # The representative is a real point, so it can be solved
+    representatives = []
+    for cluster in range(n_clusters):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        closest = ((features[members] - centres[cluster])**2).sum(axis=1).argmin()
+        representatives.append(members[closest])
+    return labels, np.array(representatives)
+
+def fit_surrogate(features, outputs):
+    '''
+    Fits a linear least-squares surrogate of each output on the features.
+
+    Parameters
+    ----------
+    features : numpy array
+        one row per solved point and one column per standardised feature.
+    outputs : numpy array
+        one row per solved point and one column per output. Outputs that are nan
+        for a point are fitted without that point.
+
+    Returns
+    -------
+    surrogate : dictionary
+        coefficients, residual standard deviation and leverage data of each output.
+    '''
+    design = np.column_stack([np.ones(len(features)), features])
+    n_parameters = design.shape[1]
+    surrogate = {'coefficients' : [], 'sigma' : [], 'inverse' : [], 'max_leverage' : []}
+    for column in outputs.T:
+        finite = np.isfinite(column)
+        if finite.sum() <= n_parameters:
+            # Too few solved points to fit, so nothing can be predicted
+            for values in surrogate.values():
+                values.append(None)
+            continue
+        x = design[finite]
+        coefficients, _, _, _ = np.linalg.lstsq(x, column[finite], rcond=None)
+        residuals = column[finite] - x @ coefficients
+        inverse = np.linalg.pinv(x.T @ x)
+        surrogate['coefficients'].append(coefficients)
+        surrogate['sigma'].append(np.sqrt((residuals**2).sum()/(finite.sum() - n_parameters)))
+        surrogate['inverse'].append(inverse)
+        surrogate['max_leverage'].append(np.einsum('ij,jk,ik->i', x, inverse, x).max())
+    return surrogate
+
+def predict_surrogate(surrogate, features):
+    '''
+    Predicts the outputs of unsolved points with a fitted surrogate.
+
+    Parameters
+    ----------
+    surrogate : dictionary
+        surrogate from fit_surrogate.
+    features : numpy array
+        one row per point and one column per standardised feature.
+
+    Returns
+    -------
+    predictions : numpy array
+        one row per point and one column per output, nan where the output could not be fitted.
+    deviations : numpy array
+        standard deviation of each prediction.
+    extrapolated : numpy array
+        whether each prediction lies outside the range of the solved points, that is,
+        has a higher leverage than any of them.
+    '''
+    design = np.column_stack([np.ones(len(features)), features])
+    n_outputs = len(surrogate['coefficients'])
+    predictions = np.full((len(features), n_outputs), np.nan)
+    deviations = np.full((len(features), n_outputs), np.nan)
+    extrapolated = np.zeros((len(features), n_outputs), dtype=bool)
+    for output in range(n_outputs):
+        coefficients = surrogate['coefficients'][output]
+        if coefficients is None:
+            continue
+        leverage = np.einsum('ij,jk,ik->i', design, surrogate['inverse'][output], design)
+        predictions[:, output] = design @ coefficients
+        deviations[:, output] = surrogate['sigma'][output]*np.sqrt(1 + leverage)
+        extrapolated[:, output] = leverage > surrogate['max_leverage'][output]*(1 + 1e-9)
+    return predictions, deviations, extrapolated
@@ -0,0 +1,80 @@
+import os
+import dask
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+def get_thread_budget(threads, policy='processes', solver_threads=0):
+    '''
+    Splits the threads snakemake gives a rule between worker processes, solver
+    threads, BLAS threads and dask workers, so the layers do not compete for cores.
+
+    Parameters
+    ----------
+    threads : int
+        threads of the rule, capped by snakemake at --cores.
+    policy : string
+        'processes' solves one single-threaded plant per thread, 'solver' solves one
+        plant at a time with every thread, 'balanced' runs half as many processes with
+        two solver threads each, and 'manual' runs as many processes with
+        solver_threads each as fit into the threads. Default is 'processes'.
+    solver_threads : int
+        solver threads per process with the 'manual' policy, 0 for one process with
+        the solver's own choice. Default is 0.
+
+    Returns
+    -------
+    budget : dictionary
+        number of "threads", worker "processes", "solver_threads" and "blas_threads"
+        per process, "idle_threads" left over by the split and "dask_workers", which
+        run before the processes are started and get every thread.
+    '''
+    threads = max(1, int(threads))
+    if policy == 'processes':
+        processes, per_process = threads, 1
+    elif policy == 'solver':
+        processes, per_process = 1, threads
+    elif policy == 'balanced':
+        processes = max(1, threads//2)
+        per_process = threads//processes
+    elif policy == 'manual':
+        per_process = min(int(solver_threads), threads)
+        processes = max(1, threads//per_process) if per_process > 0 else 1
+    else:
+        raise ValueError(f"Unknown thread policy '{policy}', use 'processes', 'solver', 'balanced' or 'manual'.")
+    # BLAS gets the share of each process, so it cannot oversubscribe the cores either
+    blas_threads = per_process if per_process > 0 else threads//processes
+    return {'threads' : threads,
+            'processes' : processes,
+            'solver_threads' : per_process,
+            'blas_threads' : blas_threads,
+            'idle_threads' : threads - processes*blas_threads,
+            'dask_workers' : threads}
+
+def apply_thread_budget(budget, rule):
+    '''
+    Limits the BLAS and dask threads of this process to the budget and reports the split.
+
+    The environment variables reach solver subprocesses and any process started
+    later; BLAS libraries already loaded are limited through threadpoolctl if it is
+    installed. Worker processes forked afterwards inherit the limits.
+
+    Parameters
+    ----------
+    budget : dictionary
+        split of the threads from get_thread_budget.
+    rule : string
+        name of the rule, for the report.
+    '''
+    for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                     'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS'):
+        os.environ[variable] = str(budget['blas_threads'])
+    if threadpool_limits is not None:
+        threadpool_limits(limits=budget['blas_threads'])
+    dask.config.set(scheduler='threads', num_workers=budget['dask_workers'])
+    solver_threads = budget['solver_threads'] if budget['solver_threads'] > 0 else "the solver's choice of"
+    idle = f", leaving {budget['idle_threads']} idle" if budget['idle_threads'] > 0 else ""
+    print(f"\n{rule} splits {budget['threads']} threads into {budget['dask_workers']} dask workers, then "
+          f"{budget['processes']} processes with {solver_threads} solver threads and "
+          f"{budget['blas_threads']} BLAS threads each{idle}.")
@@ -15,9 +15,18 @@ Bring together all previous data to calculate lowest-cost of commodity
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+from instrumentation import Instrumentation, get_benchmark_path
+from progress import Progress, get_status_path
+from profiling import start_profiling
+import time
 from utils import check_folder_exists
 
 def main():
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('calculate_total_costs', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
+    start_inputs = time.perf_counter()
     hexagons = gpd.read_file(str(snakemake.input.hexagons))
     demand_params_filepath = str(snakemake.input.demand_parameters)
     demand_center_list = pd.read_excel(demand_params_filepath,
@@ -25,12 +34,19 @@ def main():
                                     )
     demand_centers = demand_center_list.index
     plant_type = str(snakemake.wildcards.plant_type)
+    instrumentation.add('read inputs', time.perf_counter() - start_inputs)
 
     check_folder_exists("results")
+    # Report progress at most once per interval, with the latest counts in a status file
+    progress = Progress("Total costs", len(demand_centers)*len(hexagons),
+                        get_status_path('calculate_total_costs', snakemake.wildcards),
+                        snakemake.config['progress_interval'])
 
     # Get lowest cost for each transport type
     for demand_center in demand_centers:
         print(f"Calculating total costs for {demand_center} begins...\n")
+        start_demand_center = time.perf_counter()
+        progress.labels = {'demand center' : demand_center}
         if plant_type == "hydrogen":
             trucking_tranport_costs = hexagons[f'{demand_center} trucking transport and conversion costs']
             pipeline_transport_costs = hexagons[f'{demand_center} pipeline transport and conversion costs']
@@ -50,14 +66,19 @@ def main():
 
         # Get the lowest between the trucking and the pipeline options
         for i in range(len(hexagons)):
-            print(f"Calculating total costs for {i+1} of {len(hexagons)}...")
             hexagons.loc[i, f'{demand_center} lowest cost'] = np.nanmin(
                                     [hexagons.loc[i, f'{demand_center} trucking total cost'],
                                     hexagons.loc[i, f'{demand_center} pipeline total cost']
                                     ])
+            progress.update()
+        instrumentation.add('total costs', time.perf_counter() - start_demand_center,
+                            demand_center=demand_center, hexagons=len(hexagons))
             
+    progress.finish()
     print("\nCalculations complete.\n")
-    hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8')
+    with instrumentation.time('write output'):
+        hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8')
+    instrumentation.write_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -20,9 +20,14 @@ import pandas as pd
 from functions import CRF, cheapest_trucking_strategy, h2_conversion_stand, \
                             cheapest_pipeline_strategy, calculate_trucking_costs, \
                             calculate_nh3_pipeline_costs
+from instrumentation import Instrumentation, get_benchmark_path
+from progress import Progress, get_status_path
+from profiling import start_profiling
 from shapely.geometry import Point
 import shapely.wkt
 import geopy.distance
+from thread_budget import apply_thread_budget, get_thread_budget
+import time
 from utils import check_folder_exists
 
 def calculate_dist_to_demand(hex_geometry, demand_center_lat, demand_center_lon):
@@ -83,6 +88,13 @@ def calculate_road_construction_cost(distance_to_road, road_capex,
     return cost
 
 def main():
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+    # Nothing runs in parallel here but numpy, so it gets every thread of the rule
+    apply_thread_budget(get_thread_budget(snakemake.threads, 'solver'), 'optimize_transport')
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('optimize_transport', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
+    start_inputs = time.perf_counter()
     plant_type = str(snakemake.wildcards.plant_type)
     tech_params_filepath = str(snakemake.input.technology_parameters)
     demand_params_filepath = str(snakemake.input.demand_parameters)
@@ -121,11 +133,19 @@ def main():
     infrastructure_lifetime = country_params['Infrastructure lifetime (years)'].iloc[0]
 
     check_folder_exists("resources")
+    instrumentation.add('read inputs', time.perf_counter() - start_inputs)
+    # Report progress over every hexagon of every demand center at most once per
+    # interval, and keep the latest counts in a status file for monitoring
+    progress = Progress("Transport optimisation", len(demand_centers)*len(hexagons),
+                        get_status_path('optimize_transport', snakemake.wildcards),
+                        snakemake.config['progress_interval'])
     
     # calculate cost of hydrogen state conversion and transportation for demand
     # loop through all demand centers-- limit this on continential scale
     for demand_center in demand_centers:
         print(f"\nOptimisation for {demand_center} begins...\n")
+        progress.labels = {'demand center' : demand_center}
+        start_demand_center = time.perf_counter()
         # Demand location based variables
         demand_center_lat = demand_center_list.loc[demand_center,'Lat [deg]']
         demand_center_lon = demand_center_list.loc[demand_center,'Lon [deg]']
@@ -144,7 +164,6 @@ def main():
         
         # Loop through all hexagons
         for i in range(len(hexagons)):
-            print(f"Currently optimising {i+1} of {len(hexagons)} hexagons...")
             dist_to_road = hexagons['road_dist'][i]
             hex_geometry = hexagons['geometry'][i]
             dist_to_demand = calculate_dist_to_demand(hex_geometry, demand_center_lat, demand_center_lon)
@@ -273,9 +292,9 @@ def main():
                                                         pipeline_params_filepath,
                                                         infrastructure_interest_rate
                                                         )
-                        print(pipeline_costs[i],pipeline_type)
                 else:
                     pipeline_costs[i] = np.nan
+            progress.update()
 
         print("\nOptimisation complete.\n")
         # Hexagon file updated with each demand center's costs and states
@@ -287,8 +306,13 @@ def main():
             hexagons[f'{demand_center} trucking transport costs'] = trucking_costs # cost of trucking transport
             hexagons[f'{demand_center} pipeline transport costs'] = pipeline_costs # cost of supply conversion, pipeline transport, and demand conversion
         hexagons[f'{demand_center} trucking state'] = trucking_states
+        instrumentation.add('transport costs', time.perf_counter() - start_demand_center,
+                            demand_center=demand_center, hexagons=len(hexagons))
+    progress.finish()
 
-    hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8') # SNAKEMAKE OUTPUT
+    with instrumentation.time('write output'):
+        hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8') # SNAKEMAKE OUTPUT
+    instrumentation.write_report()
 
 if __name__ == "__main__":
     main()
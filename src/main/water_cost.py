@@ -13,9 +13,18 @@ Water costs for commodity production in each hexagon
 import geopandas as gpd
 import pandas as pd
 import numpy as np
+from instrumentation import Instrumentation, get_benchmark_path
+from progress import Progress, get_status_path
+from profiling import start_profiling
+import time
 
 def main():
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
     print("Calculations begin...\n")
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('calculate_water_costs', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
+    start_inputs = time.perf_counter()
     hexagons = gpd.read_file(str(snakemake.input.hexagons))
     tech_params_filepath = str(snakemake.input.technology_parameters)
     country_params_filepath = str(snakemake.input.country_parameters)
@@ -36,11 +45,16 @@ def main():
     water_spec_cost = water_data['Water specific cost (euros/m3)']
     water_demand = water_data['Water demand  (L/kg of commodity)']
     elec_price = country_params['Electricity price (euros/kWh)'].iloc[0]
+    instrumentation.add('read inputs', time.perf_counter() - start_inputs)
     
+    # Report progress at most once per interval, with the latest counts in a status file
+    progress = Progress("Water costs", len(hexagons),
+                        get_status_path('calculate_water_costs', snakemake.wildcards),
+                        snakemake.config['progress_interval'])
     # Loop through all hexagons
     # Calculating water costs for each hexagon
+    start_costs = time.perf_counter()
     for i in range(len(hexagons)):
-        print(f"Calculating water costs for {i+1} of {len(hexagons)}...")
         waterbody_dist = hexagons['waterbody_dist'][i]
         waterway_dist = hexagons['waterway_dist'][i]
         ocean_dist = hexagons['ocean_dist'][i]
@@ -60,13 +74,19 @@ def main():
                             ) * water_demand/1000
         
         min_h2o_costs[i] = min(h2o_costs_dom_water_bodies[i], h2o_costs_ocean[i])
+        progress.update()
+
+    progress.finish()
+    instrumentation.add('water costs', time.perf_counter() - start_costs, hexagons=len(hexagons))
 
     print("\nCalculations complete.\n")
     hexagons['Ocean water costs'] = h2o_costs_ocean
     hexagons['Freshwater costs'] = h2o_costs_dom_water_bodies
     hexagons['Lowest water cost'] = min_h2o_costs
 
-    hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8')
+    with instrumentation.time('write output'):
+        hexagons.to_file(str(snakemake.output), driver='GeoJSON', encoding='utf-8')
+    instrumentation.write_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
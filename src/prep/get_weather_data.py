@@ -19,7 +19,10 @@ For this rule to work you must have
 """
 import logging
 import atlite
+import dask
 import geopandas as gpd
+from instrumentation import Instrumentation, get_benchmark_path
+from profiling import start_profiling
 from utils import check_folder_exists
 
 def calculate_coords(hexagons):
@@ -80,8 +83,13 @@ def prepare_cutout(min_lon, min_lat, max_lon, max_lat, start_date, end_date):
     cutout.prepare(tmpdir="temp", show_progress=True) # TEMPDIR DEFINITION IS NEW TO FIX ERROR
 
 def main():
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('get_weather_data', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
     try:
-        hexagons = gpd.read_file(f"data/hexagons_with_country_{snakemake.wildcards.country}_{snakemake.config['scenario']['plant_type']}.geojson")
+        with instrumentation.time('read inputs'):
+            hexagons = gpd.read_file(f"data/hexagons_with_country_{snakemake.wildcards.country}_{snakemake.config['scenario']['plant_type']}.geojson")
     except:
         print(f"There is no file called \'hexagons_with_country_{snakemake.wildcards.country}_{snakemake.config['scenario']['plant_type']}.geojson\' in the 'data/' folder. \nRun the necessary rule to produce that file.")
     else:
@@ -98,7 +106,14 @@ def main():
         check_folder_exists("cutouts")
         check_folder_exists("temp")
 
-        prepare_cutout(min_lon, min_lat, max_lon, max_lat, start_date, end_date)
+        # atlite prepares the cutout with dask, which gets every thread of the rule
+        dask.config.set(scheduler='threads', num_workers=int(snakemake.threads))
+        print(f"\nget_weather_data prepares the cutout with {snakemake.threads} dask workers.")
+
+        # Download and conversion of the ERA5 data, usually most of the rule
+        with instrumentation.time('prepare cutout'):
+            prepare_cutout(min_lon, min_lat, max_lon, max_lat, start_date, end_date)
+        instrumentation.write_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
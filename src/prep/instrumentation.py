@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+import glob
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+class Instrumentation:
+    """
+    A class representing the timing records of a rule.
+
+    Every record is appended to a JSON lines file of its own process as soon as it
+    is made, so worker processes need no way back to the main process and a killed
+    run keeps its records. The file stays open and line buffered, so each record is
+    written out without opening the file again. When the rule finishes, the files of all processes are
+    merged into '<path>.csv' and a summary of percentiles and hot spots is written
+    to '<path>_summary.json'.
+
+    Attributes
+    ----------
+    path : string or None
+        path of the records without extension, or None to record nothing.
+    labels : dictionary
+        labels added to every record, such as the demand center.
+    Methods
+    -------
+    time(stage, **values):
+        times the code in a with statement.
+    add(stage, seconds, **values):
+        writes a record.
+    close():
+        closes the records file of this process.
+    write_report():
+        merges the records of all processes and writes and prints the summary.
+    """
+    def __init__(self, path, reset=False):
+        """
+
+        """
+        self.path = path
+        self.labels = {}
+        self._file = None
+        self._pid = None
+        if path is not None and reset:
+            # Records of an earlier run that was killed
+            for part in glob.glob(f'{glob.escape(path)}.*.jsonl'):
+                os.remove(part)
+
+    @contextmanager
+    def time(self, stage, **values):
+        '''
+        Times the code in a with statement.
+
+        Parameters
+        ----------
+        stage : string
+            name of the stage, e.g. "solve".
+        **values
+            labels and counts of the record. Values can be added to the yielded
+            dictionary inside the with statement.
+
+        Yields
+        ------
+        values : dictionary
+            labels and counts written with the record.
+        '''
+        start = time.perf_counter()
+        try:
+            yield values
+        finally:
+            self.add(stage, time.perf_counter() - start, **values)
+
+    def add(self, stage, seconds, **values):
+        '''
+        Writes a record.
+
+        Parameters
+        ----------
+        stage : string
+            name of the stage.
+        seconds : float
+            wall time of the stage.
+        **values
+            labels and counts of the record, e.g. hexagon, transport or iterations.
+        '''
+        if self.path is None:
+            return
+        record = dict(self.labels, stage=stage, seconds=float(seconds), **values)
+        # Forked worker processes inherit the file of the main process and open their own
+        if self._file is None or self._pid != os.getpid():
+            folder = os.path.dirname(self.path)
+            if folder != '':
+                os.makedirs(folder, exist_ok=True)
+            self._file = open(f'{self.path}.{os.getpid()}.jsonl', 'a', encoding='utf-8', buffering=1)
+            self._pid = os.getpid()
+        self._file.write(json.dumps(record, default=_to_json) + '\n')
+
+    def close(self):
+        '''
+        Closes the records file of this process. A later record opens it again.
+        '''
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file = None
+
+    def write_report(self, hot_spots=10):
+        '''
+        Merges the records of all processes into a CSV file and writes and prints
+        a summary of the time spent in each stage and the slowest records.
+
+        Parameters
+        ----------
+        hot_spots : int
+            number of slowest records in the summary. Default is 10.
+
+        Returns
+        -------
+        summary : dictionary
+            count, total, mean and percentiles of the seconds of each stage, and the
+            slowest records as "hot spots". Empty if nothing was recorded.
+        '''
+        if self.path is None:
+            return {}
+        self.close()
+        records = []
+        parts = sorted(glob.glob(f'{glob.escape(self.path)}.*.jsonl'))
+        for part in parts:
+            with open(part, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A process was killed while writing this line
+                        continue
+        if len(records) == 0:
+            return {}
+        records = pd.DataFrame(records)
+        records.to_csv(f'{self.path}.csv', index=False)
+        for part in parts:
+            os.remove(part)
+
+        stages = {}
+        for stage, seconds in records.groupby('stage', sort=False)['seconds']:
+            stages[stage] = {'count' : int(seconds.size),
+                             'total' : float(seconds.sum()),
+                             'mean' : float(seconds.mean()),
+                             **{f'p{percentile}' : float(np.percentile(seconds, percentile))
+                                for percentile in (50, 90, 99)},
+                             'max' : float(seconds.max())}
+        slowest = records.nlargest(hot_spots, 'seconds')
+        summary = {'stages' : stages,
+                   'hot spots' : [{key: value for key, value in record.items() if not pd.isnull(value)}
+                                  for record in slowest.to_dict('records')]}
+        with open(f'{self.path}_summary.json', 'w', encoding='utf-8') as file:
+            json.dump(summary, file, indent=2, default=_to_json)
+
+        print(f"\nTime per stage, written to {self.path}.csv:")
+        total = records['seconds'].sum()
+        for stage, values in sorted(stages.items(), key=lambda item: -item[1]['total']):
+            print(f"{stage}: {values['total']:.1f} s ({values['total']/total:.0%}) over {values['count']} records, "
+                  f"p50 {values['p50']:.3f} s, p90 {values['p90']:.3f} s, p99 {values['p99']:.3f} s, "
+                  f"max {values['max']:.3f} s")
+        return summary
+
+def _to_json(value):
+    '''
+    Converts numpy numbers for json.
+    '''
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def get_benchmark_path(rule, wildcards):
+    '''
+    Gets the path of the timing records of a rule under benchmarks/.
+
+    Parameters
+    ----------
+    rule : string
+        name of the rule.
+    wildcards : dictionary
+        snakemake wildcards of the rule.
+
+    Returns
+    -------
+    path : string
+        path without extension, e.g. 'benchmarks/optimize_plant_IN_2023_hydrogen'.
+    '''
+    return os.path.join('benchmarks', '_'.join([rule] + [str(value) for value in dict(wildcards).values()]))
@@ -10,6 +10,9 @@ Functions for preparing the hexagon file for optimization.
 import geopandas as gpd
 import pandas as pd
 import json
+from instrumentation import Instrumentation, get_benchmark_path
+from profiling import start_profiling
+import time
 
 def assign_country(hexagons, world):
     """
@@ -82,21 +85,31 @@ def update_hexagons(hexagons, output_hexagon_path):
         hexagons.to_file(f"{output_hexagon_path}", driver="GeoJSON")
 
 def main():
+    start_profiling(snakemake.rule, snakemake.wildcards, snakemake.config['profiling'])
     print("Prepping file...")
+    # Time every stage of the rule, with the records under benchmarks/
+    instrumentation = Instrumentation(get_benchmark_path('prep_main', snakemake.wildcards)
+                                      if snakemake.config['instrumentation'] else None, reset=True)
+    start_inputs = time.perf_counter()
     country_parameters = pd.read_excel(str(snakemake.input.country_parameters),
                                         index_col='Country')
     hexagons = gpd.read_file(str(snakemake.input.hexagons))
     world = gpd.read_file(gpd.datasets.get_path('naturalearth_lowres')) # may need to switch to higher res
+    instrumentation.add('read inputs', time.perf_counter() - start_inputs)
 
     output_hexagon_path = str(snakemake.output)
 
-    hexagons_with_country = assign_country(hexagons, world)
-    update_hexagons(hexagons_with_country, output_hexagon_path)
+    with instrumentation.time('assign country', hexagons=len(hexagons)):
+        hexagons_with_country = assign_country(hexagons, world)
+    with instrumentation.time('write output'):
+        update_hexagons(hexagons_with_country, output_hexagon_path)
 
     # Finish off with the removing extra hexagons.
-    final_hexagons = remove_extra_hexagons(output_hexagon_path, country_parameters)
-    update_hexagons(final_hexagons, output_hexagon_path)
+    with instrumentation.time('remove extra hexagons'):
+        final_hexagons = remove_extra_hexagons(output_hexagon_path, country_parameters)
+        update_hexagons(final_hexagons, output_hexagon_path)
     print("File prepped.")
+    instrumentation.write_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'main'))
+from plant_optimization import aggregate_time_series, get_demand_schedule
+
+@pytest.mark.parametrize('transport_state', ['500 bar', 'None'])
+def test_aggregate_full_year_demand_schedule(transport_state):
+    if transport_state != 'None':
+        # Trucking schedules read the truck capacity from the transport parameters
+        pytest.importorskip('openpyxl')
+    # Schedules of a default run span the whole weather year, end date included
+    trucking_schedule, pipeline_schedule = get_demand_schedule(
+        1e6, '2023-01-01', '2024-01-01', transport_state,
+        os.path.join(ROOT, 'parameters', 'IN', 'hydrogen', 'transport_parameters.xlsx'), 'H')
+    rng = np.random.default_rng(0)
+    # Hourly weather of 2023, as in the cutout of the run
+    generators = {'Solar' : [rng.random(8760), 1000.], 'Wind' : [rng.random(8760), 500.]}
+
+    for demand_schedule in (trucking_schedule, pipeline_schedule):
+        aggregated_generators, aggregated_schedule, segment_lengths = \
+            aggregate_time_series(generators, demand_schedule, 24)
+        assert segment_lengths.sum() == 8760
+        assert len(aggregated_schedule) == len(segment_lengths)
+        assert all(len(gen_list[0]) == len(segment_lengths) for gen_list in aggregated_generators.values())
+        # Demand over the weather snapshots is kept, only the end date is dropped
+        np.testing.assert_allclose((aggregated_schedule['Demand']*segment_lengths).sum(),
+                                   demand_schedule['Demand'].iloc[:8760].sum())
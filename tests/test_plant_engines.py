@@ -0,0 +1,195 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src', 'main'))
+import plant_optimization
+from network import Network
+from plant_optimization import get_demand_schedule, get_plant_results, get_total_cost, get_total_cost_bound, \
+    optimize_hexagon_batch, optimize_hexagons_top_k, solve_hexagon_transports
+
+# One week of a small hydrogen plant, delivered without transport so no transport parameters are read
+START_DATE = '2023-01-01'
+END_DATE = '2023-01-08'
+TIMES = pd.date_range(START_DATE, END_DATE, freq='H', inclusive='left')
+QUANTITY = 1e5
+COUNTRY_SERIES = pd.Series({'Plant interest rate' : 0.08, 'Plant lifetime (years)' : 20,
+                            'Solar interest rate' : 0.06, 'Solar lifetime (years)' : 25,
+                            'Wind interest rate' : 0.07, 'Wind lifetime (years)' : 25})
+
+def get_hexagon(i, max_capacity=1e4):
+    '''
+    Gets a hexagon with synthetic weather, seeded by its index.
+    '''
+    rng = np.random.default_rng(i)
+    hours = np.arange(len(TIMES))
+    # Daylight with a few dull days, and wind that changes from day to day
+    solar = np.clip(np.sin((hours % 24 - 6)/12*np.pi), 0, None)*rng.uniform(0.2, 1, len(TIMES)//24).repeat(24)
+    wind = np.clip(rng.normal(0.3, 0.15, len(TIMES)//24).repeat(24) + rng.normal(0, 0.05, len(TIMES)), 0, 1)
+    return {'index' : i,
+            'trucking_state' : 'None',
+            'potentials' : {'Solar' : solar, 'Wind' : wind},
+            'max_capacities' : {'Solar' : max_capacity, 'Wind' : max_capacity},
+            'transport_costs' : {'trucking' : 0.5 + 0.1*i, 'pipeline' : 0.4 + 0.2*i},
+            'water_cost' : 0.01}
+
+def get_settings(**values):
+    '''
+    Gets the run-wide settings of a serial run with the PyPSA engine, with the given values changed.
+    '''
+    settings = {'plant_type' : 'hydrogen', 'annual_demand_quantity' : QUANTITY,
+                'start_date' : START_DATE, 'end_date' : END_DATE, 'freq' : 'H', 'times' : TIMES,
+                'solver' : 'highs', 'solver_options' : {}, 'country_series' : COUNTRY_SERIES,
+                'water_limit' : False, 'pipeline_construction' : True, 'transport_params_filepath' : None,
+                'persistent_model' : False, 'basis_dir' : None, 'solve_cache_path' : None,
+                'solve_time_limit' : 0, 'fallback_solves' : [], 'isolate_failures' : False, 'io_api' : 'direct',
+                'segments' : 0, 'segments_check' : 0, 'engine' : 'pypsa', 'engine_check' : 0, 'batch_size' : 1,
+                'benders_periods' : 1, 'benders_threads' : 1, 'rolling_window' : len(TIMES), 'rolling_overlap' : 0,
+                'prune_transport' : False, 'schedule' : 'input', 'solve_time_history' : None,
+                'solve_time_records' : 0, 'benchmark_path' : None, 'demand_center' : None}
+    settings.update(values)
+    return settings
+
+def get_problems(hexagons):
+    '''
+    Gets the generators and demand schedule of the trucking and pipeline plant of each hexagon.
+    '''
+    problems = []
+    for hexagon in hexagons:
+        generators = {gen : [potential, hexagon['max_capacities'][gen]]
+                      for gen, potential in hexagon['potentials'].items()}
+        problems += [(generators, demand_schedule) for demand_schedule in
+                     get_demand_schedule(QUANTITY, START_DATE, END_DATE, 'None', None, 'H')]
+    return problems
+
+def solve_with_pypsa(generators, demand_schedule):
+    '''
+    Solves a plant with a fresh PyPSA network, as the reference of the other engines.
+    '''
+    network = Network('hydrogen', generators)
+    network.set_network(demand_schedule, TIMES, COUNTRY_SERIES)
+    network.set_generators_in_network(COUNTRY_SERIES)
+    status, _ = network.n.optimize(solver_name='highs')
+    if status != 'ok':
+        return None
+    return get_plant_results(network, generators, 'hydrogen')
+
+@pytest.fixture(autouse=True)
+def plant_design(monkeypatch):
+    # Plant designs are read relative to the repository, and every test starts without
+    # the networks and cache of earlier tests
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(plant_optimization, '_persistent_networks', {})
+    monkeypatch.setattr(plant_optimization, '_solve_cache', None)
+
+@pytest.fixture(scope='module')
+def reference():
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        hexagons = [get_hexagon(i) for i in range(4)]
+        yield hexagons, [solve_with_pypsa(*problem) for problem in get_problems(hexagons)]
+    finally:
+        os.chdir(cwd)
+
+@pytest.mark.parametrize('values', [{'engine' : 'sparse'},
+                                    {'engine' : 'sparse', 'batch_size' : 4},
+                                    {'persistent_model' : True},
+                                    {'engine' : 'rolling', 'rolling_window' : len(TIMES)}])
+def test_engines_match_pypsa(reference, values):
+    hexagons, reference_results = reference
+    results = solve_hexagon_transports(get_problems(hexagons), get_settings(**values))
+    for result, reference_result in zip(results, reference_results):
+        np.testing.assert_allclose(result[0], reference_result[0], rtol=1e-5)
+        for gen, capacity in result[1].items():
+            np.testing.assert_allclose(capacity, reference_result[1][gen], rtol=1e-3, atol=1e-3)
+
+def test_benders_matches_pypsa(reference):
+    hexagons, reference_results = reference
+    # Storage carried over the boundary between the periods keeps the optimum of the whole week
+    result = solve_hexagon_transports(get_problems(hexagons[:1])[1:], get_settings(engine='benders', benders_periods=2))[0]
+    np.testing.assert_allclose(result[0], reference_results[1][0], rtol=1e-4)
+
+def test_rolling_windows_cost_at_least_pypsa(reference):
+    hexagons, reference_results = reference
+    results = solve_hexagon_transports(get_problems(hexagons),
+                                       get_settings(engine='rolling', rolling_window=72, rolling_overlap=24))
+    for result, reference_result in zip(results, reference_results):
+        # Every window meets its demand with the capacities of the last window, a feasible design
+        assert result[0] >= reference_result[0]*(1 - 1e-6)
+        assert result[0] <= reference_result[0]*1.5
+
+def test_solve_cache_reuses_results(reference, tmp_path, monkeypatch):
+    hexagons, reference_results = reference
+    settings = get_settings(engine='sparse', solve_cache_path=str(tmp_path/'cache.sqlite'))
+    results = solve_hexagon_transports(get_problems(hexagons), settings)
+
+    # A later run reads every plant from the file instead of solving it
+    def fail(*args, **kwargs):
+        raise AssertionError('A cached plant was solved again.')
+    monkeypatch.setattr(plant_optimization, '_solve_cache', None)
+    monkeypatch.setattr(plant_optimization, 'solve_sparse_lps', fail)
+    cached_results = solve_hexagon_transports(get_problems(hexagons), settings)
+    for result, cached_result, reference_result in zip(results, cached_results, reference_results):
+        assert cached_result[0] == result[0]
+        assert cached_result[1] == pytest.approx(result[1])
+        np.testing.assert_allclose(cached_result[0], reference_result[0], rtol=1e-5)
+
+    # Aggregated plants are other LPs
+    with pytest.raises(AssertionError):
+        solve_hexagon_transports(get_problems(hexagons[:1]), dict(settings, engine='sparse', segments=24))
+
+def test_total_cost_bound_is_below_pypsa(reference):
+    hexagons, reference_results = reference
+    for hexagon, trucking_results, pipeline_results in zip(hexagons, reference_results[::2], reference_results[1::2]):
+        assert get_total_cost_bound(hexagon, get_settings()) <= \
+            get_total_cost(hexagon, {'trucking' : trucking_results, 'pipeline' : pipeline_results})
+
+@pytest.mark.parametrize('max_capacity', [150., 0.])
+def test_total_cost_bound_with_land_limits(max_capacity):
+    for i in range(2):
+        hexagon = get_hexagon(i, max_capacity)
+        bound = get_total_cost_bound(hexagon, get_settings())
+        trucking_results, pipeline_results = [solve_with_pypsa(*problem) for problem in get_problems([hexagon])]
+        if trucking_results is None or pipeline_results is None:
+            # Plants that cannot be built have no cost to bound
+            assert trucking_results is None and pipeline_results is None
+            continue
+        assert bound <= get_total_cost(hexagon, {'trucking' : trucking_results, 'pipeline' : pipeline_results})
+
+def test_pruned_transport_is_dominated(reference):
+    hexagons, reference_results = reference
+    settings = get_settings(engine='sparse', prune_transport=True)
+    for hexagon, trucking_results, pipeline_results in zip(hexagons, reference_results[::2], reference_results[1::2]):
+        results = optimize_hexagon_batch([dict(hexagon, transport_costs={'trucking' : 1e3, 'pipeline' : 0.1})],
+                                         settings)[0][1]
+        # Trucking costs so much more than a week of production that the lower bound of its plant rules it out
+        assert results['dominated'] == 'trucking'
+        assert np.isnan(results['trucking'][0])
+        np.testing.assert_allclose(results['pipeline'][0], pipeline_results[0], rtol=1e-5)
+        assert pipeline_results[0] + 0.1 < trucking_results[0] + 1e3
+
+        # Close transport costs leave both plants to be solved
+        results = optimize_hexagon_batch([dict(hexagon, transport_costs={'trucking' : 0.1, 'pipeline' : 0.1})],
+                                         settings)[0][1]
+        assert results['dominated'] is None
+        np.testing.assert_allclose(results['trucking'][0], trucking_results[0], rtol=1e-5)
+        np.testing.assert_allclose(results['pipeline'][0], pipeline_results[0], rtol=1e-5)
+
+def test_top_k_finds_cheapest_hexagons(reference):
+    hexagons, reference_results = reference
+    total_costs = {hexagon['index'] : get_total_cost(hexagon, {'trucking' : trucking_results,
+                                                               'pipeline' : pipeline_results})
+                   for hexagon, trucking_results, pipeline_results
+                   in zip(hexagons, reference_results[::2], reference_results[1::2])}
+    results, methods = optimize_hexagons_top_k(hexagons, get_settings(engine='sparse'), 1, 2)
+    cheapest = sorted(total_costs, key=total_costs.get)[:2]
+    for i, hexagon_results in results:
+        if i in cheapest:
+            assert methods[i] == 'solved'
+            np.testing.assert_allclose(get_total_cost(hexagons[i], hexagon_results), total_costs[i], rtol=1e-5)
+        elif methods[i] == 'bounded':
+            assert np.isnan(hexagon_results['trucking'][0]) and np.isnan(hexagon_results['pipeline'][0])